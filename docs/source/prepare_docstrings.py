@@ -15,14 +15,17 @@ order = [
     "hepconvert.merge",
     "hepconvert.parquet_to_root",
     "hepconvert.root_to_parquet",
+    "hepconvert.parquet_to_parquet",
     "hepconvert.copy_root",
 ]
 
 common = [
     "hepconvert.parquet_to_root",
     "hepconvert.root_to_parquet",
+    "hepconvert.parquet_to_parquet",
     "hepconvert.copy_root",
     "hepconvert.merge_root",
+    "hepconvert.compact_parquet",
     "hepconvert.add_histograms",
 ]
 
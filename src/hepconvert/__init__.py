@@ -6,17 +6,23 @@ hepconvert: File conversion package.
 from __future__ import annotations
 
 from hepconvert._version import __version__
+from hepconvert.chain import iterate_chain, plan_jobs
 from hepconvert.copy_root import copy_root
 from hepconvert.histogram_adding import add_histograms
-from hepconvert.merge import merge_root
+from hepconvert.merge import compact_parquet, merge_root
+from hepconvert.parquet_to_parquet import parquet_to_parquet
 from hepconvert.parquet_to_root import parquet_to_root
 from hepconvert.root_to_parquet import root_to_parquet
 
 __all__ = [
     "__version__",
     "add_histograms",
+    "compact_parquet",
     "merge_root",
     "copy_root",
+    "iterate_chain",
+    "parquet_to_parquet",
     "parquet_to_root",
+    "plan_jobs",
     "root_to_parquet",
 ]
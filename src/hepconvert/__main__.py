@@ -9,7 +9,8 @@ CONTEXT_SETTINGS = {"help_option_names": ["-h", "--help"]}
 def main() -> None:
     """
     Must provide a subcommand:
-    parquet-to-root, root-to-parquet, copy-root, add, or add
+    parquet-to-root, root-to-parquet, parquet-to-parquet, copy-root, add, merge-root,
+    or compact-parquet
     """
 
 
@@ -46,6 +47,11 @@ def main() -> None:
     is_flag=True,
     help="If True, overwrites destination file if it already exists.",
 )
+@click.option(
+    "--memory-map",
+    is_flag=True,
+    help="Memory-map the local input file instead of reading it into new buffers.",
+)
 def parquet_to_root(
     destination,
     file,
@@ -61,6 +67,7 @@ def parquet_to_root(
     compression="zlib",
     compression_level=1,
     force,
+    memory_map,
 ):
     """
     Convert Parquet file to ROOT file.
@@ -81,6 +88,7 @@ def parquet_to_root(
         compression=compression,
         compression_level=compression_level,
         force=force,
+        memory_map=memory_map,
     )
 
 
@@ -103,6 +111,18 @@ def parquet_to_root(
     type=str,
     help="If an integer, the maximum number of entries to include in each iteration step; if a string, the maximum memory size to include. The string must be a number followed by a memory unit, such as “100 MB”.",
 )
+@click.option(
+    "--memory-budget",
+    default=None,
+    type=str,
+    help="Memory that each chunk may take while it is read and written, such as “500 MB”. If given, the number of entries per step is adjusted after each chunk to stay within it.",
+)
+@click.option(
+    "--basket-size",
+    default=None,
+    type=str,
+    help="If given, chunks are collected until a branch holds this many bytes, such as “1 MB”, and then written as one TBasket.",
+)
 @click.option(
     "-dt",
     "--drop-trees",
@@ -157,6 +177,8 @@ def copy_root(
     resize_factor=10.0,
     counter_name=lambda counted: "n" + counted,
     step_size="100 MB",
+    memory_budget=None,
+    basket_size=None,
     compression="LZ4",
     compression_level=1,
 ):
@@ -182,6 +204,8 @@ def copy_root(
         resize_factor=resize_factor,
         counter_name=counter_name,
         step_size=step_size,
+        memory_budget=memory_budget,
+        basket_size=basket_size,
         compression=compression,
         compression_level=compression_level,
     )
@@ -281,6 +305,18 @@ def add(
     type=str,
     help="If an integer, the maximum number of entries to include in each iteration step; if a string, the maximum memory size to include. The string must be a number followed by a memory unit, such as “100 MB”.",
 )
+@click.option(
+    "--memory-budget",
+    default=None,
+    type=str,
+    help="Memory that each chunk may take while it is read and written, such as “500 MB”. If given, the number of entries per step is adjusted after each chunk to stay within it.",
+)
+@click.option(
+    "--basket-size",
+    default=None,
+    type=str,
+    help="If given, chunks are collected until a branch holds this many bytes, such as “1 MB”, and then written as one TBasket.",
+)
 @click.option(
     "-db",
     "--drop-branches",
@@ -334,13 +370,79 @@ def add(
     default=False,
     help="Skip corrupt or non-existent files without exiting",
 )
+@click.option(
+    "--prefetch-files",
+    default=0,
+    type=int,
+    help="Number of input files opened and read in background threads ahead of the one being written.",
+)
+@click.option(
+    "--prefetch-memory",
+    default="1 GB",
+    type=str,
+    help="Maximum size of the chunks read ahead and waiting to be written, such as “1 GB”.",
+)
+@click.option(
+    "--fast-merge",
+    is_flag=True,
+    help="Copy compressed TBaskets from inputs with the same TTree layout and compression, without recompressing them.",
+)
+@click.option(
+    "--max-output-bytes",
+    default=None,
+    type=str,
+    help="Roll over to a new numbered output file once the output reaches this size, such as “2 GB”.",
+)
+@click.option(
+    "--max-output-entries",
+    default=None,
+    type=int,
+    help="Roll over to a new numbered output file once a TTree in the output has this many entries.",
+)
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="Merge in this many processes, through intermediate files.",
+)
+@click.option(
+    "--fan-in",
+    default=2,
+    type=int,
+    help="Number of intermediate files merged together at each level of a parallel merge.",
+)
+@click.option(
+    "--scratch-dir",
+    default=None,
+    type=click.Path(),
+    help="Directory for the intermediate files of a parallel merge.",
+)
+@click.option(
+    "--journal",
+    is_flag=True,
+    help="Keep a journal of the committed inputs next to the output, so that an interrupted merge can be resumed.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue an interrupted merge from its journal, skipping the inputs that were committed.",
+)
+@click.option(
+    "--manifest",
+    is_flag=True,
+    help="Record the merged inputs in the output, so that appends only merge new or changed inputs.",
+)
+@click.option(
+    "--virtual",
+    is_flag=True,
+    help="Write an index of the inputs and the sums of their histograms instead of copying their TTrees.",
+)
 def merge_root(
     destination,
     files,
     *,
     fieldname_separator="_",
     title="",
-    field_name=lambda outer, inner: inner if outer == "" else outer + "_" + inner,
     drop_branches=None,
     keep_branches=None,
     drop_trees=None,
@@ -350,13 +452,26 @@ def merge_root(
     progress_bar,
     initial_basket_capacity=10,
     resize_factor=10.0,
-    counter_name=lambda counted: "n" + counted,
     step_size="100 MB",
+    memory_budget=None,
+    basket_size=None,
     force,
     append,
     compression="LZ4",
     compression_level=1,
     skip_bad_files=False,
+    prefetch_files=0,
+    prefetch_memory="1 GB",
+    fast_merge=False,
+    max_output_bytes=None,
+    max_output_entries=None,
+    workers=None,
+    fan_in=2,
+    scratch_dir=None,
+    journal=False,
+    resume=False,
+    manifest=False,
+    virtual=False,
 ):
     """
     Merge TTrees and add histograms.
@@ -368,7 +483,6 @@ def merge_root(
         files,
         fieldname_separator=fieldname_separator,
         title=title,
-        field_name=field_name,
         drop_branches=drop_branches,
         keep_branches=keep_branches,
         drop_trees=drop_trees,
@@ -378,13 +492,97 @@ def merge_root(
         progress_bar=progress_bar,
         initial_basket_capacity=initial_basket_capacity,
         resize_factor=resize_factor,
-        counter_name=counter_name,
         step_size=step_size,
+        memory_budget=memory_budget,
+        basket_size=basket_size,
         force=force,
         append=append,
         compression=compression,
         compression_level=compression_level,
         skip_bad_files=skip_bad_files,
+        prefetch_files=prefetch_files,
+        prefetch_memory=prefetch_memory,
+        fast_merge=fast_merge,
+        max_output_bytes=max_output_bytes,
+        max_output_entries=max_output_entries,
+        workers=workers,
+        fan_in=fan_in,
+        scratch_dir=scratch_dir,
+        journal=journal,
+        resume=resume,
+        manifest=manifest,
+        virtual=virtual,
+    )
+
+
+@main.command()
+@click.argument("directory", type=click.Path())
+@click.option(
+    "--target-size",
+    default="512 MB",
+    type=str,
+    help="Size that each merged file should reach, such as “512 MB”.",
+)
+@click.option(
+    "--small-file-size",
+    default=None,
+    type=str,
+    help="Files at least this large are left untouched. Defaults to the target size.",
+)
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="Number of groups of files merged at the same time.",
+)
+@click.option(
+    "--keep-inputs",
+    is_flag=True,
+    help="Keep the small files after they have been merged.",
+)
+@click.option(
+    "-c",
+    "--compression",
+    default="zstd",
+    help='Compression algorithm for the merged files, such as "ZSTD", "LZ4", "SNAPPY", or "GZIP".',
+)
+@click.option(
+    "--compression-level",
+    default=None,
+    type=int,
+    help="Use a compression level particular to the chosen compressor.",
+)
+@click.option(
+    "--row-group-bytes",
+    default=None,
+    type=str,
+    help="Target size of each row group in the merged files, such as “128 MB”.",
+)
+def compact_parquet(
+    directory,
+    *,
+    target_size="512 MB",
+    small_file_size=None,
+    workers=None,
+    keep_inputs,
+    compression="zstd",
+    compression_level=None,
+    row_group_bytes=None,
+):
+    """
+    Merge the small Parquet files of a directory into fewer, larger files.
+    """
+    import hepconvert.merge  # pylint: disable=import-outside-toplevel
+
+    hepconvert.compact_parquet(
+        directory,
+        target_size=target_size,
+        small_file_size=small_file_size,
+        workers=workers,
+        remove_inputs=not keep_inputs,
+        compression=compression,
+        compression_level=compression_level,
+        row_group_bytes=row_group_bytes,
     )
 
 
@@ -430,6 +628,12 @@ def merge_root(
     default="100 MB",
     help="Specify batch size for reading ROOT file. If an integer, the maximum number of entries to include in each iteration step; if a string, the maximum memory size to include.",
 )
+@click.option(
+    "--memory-budget",
+    default=None,
+    type=str,
+    help="Memory that each chunk may take while it is read and written, such as “500 MB”. If given, the number of entries per step is adjusted after each chunk to stay within it.",
+)
 @click.option(
     "--list-to32",
     default=False,
@@ -566,6 +770,7 @@ def root_to_parquet(
     expressions=None,
     force=False,
     step_size="100MB",
+    memory_budget=None,
     list_to32=False,
     string_to32=True,
     bytestring_to32=True,
@@ -604,6 +809,7 @@ def root_to_parquet(
         expressions=expressions,
         force=force,
         step_size=step_size,
+        memory_budget=memory_budget,
         list_to32=list_to32,
         string_to32=string_to32,
         bytestring_to32=bytestring_to32,
@@ -629,5 +835,81 @@ def root_to_parquet(
     )
 
 
+@main.command()
+@click.argument("out_file", type=click.Path())
+@click.argument("in_file")
+@click.option(
+    "-c",
+    "--compression",
+    default=None,
+    type=str,
+    help='Compression algorithm, one of "NONE", "SNAPPY", "GZIP", "BROTLI", "LZ4", or "ZSTD". By default the compression of the input file is kept.',
+)
+@click.option(
+    "--compression-level",
+    default=None,
+    type=int,
+    help="Use a compression level particular to the chosen compressor.",
+)
+@click.option(
+    "--parquet-dictionary-encoding",
+    default=None,
+    type=bool,
+    help="Allow Parquet to pre-compress with dictionary encoding. By default the input file's choice is kept.",
+)
+@click.option(
+    "--parquet-byte-stream-split",
+    default=None,
+    type=bool,
+    help="Pre-compress floating point fields ('float32' or 'float64') with byte stream splitting. By default the input file's choice is kept.",
+)
+@click.option(
+    "--data-page-size",
+    default=None,
+    type=int,
+    help="Number of bytes in each data page.",
+)
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="Number of threads that read and encode column chunks.",
+)
+@click.option(
+    "-f",
+    "--force",
+    is_flag=True,
+    help="If True, overwrites destination file if it already exists.",
+)
+def parquet_to_parquet(
+    out_file,
+    in_file,
+    *,
+    compression=None,
+    compression_level=None,
+    parquet_dictionary_encoding=None,
+    parquet_byte_stream_split=None,
+    data_page_size=None,
+    workers=None,
+    force,
+):
+    """
+    Re-encode a Parquet file with new writer options.
+    """
+    import hepconvert.parquet_to_parquet  # pylint: disable=import-outside-toplevel
+
+    hepconvert.parquet_to_parquet(
+        out_file,
+        in_file,
+        compression=compression,
+        compression_level=compression_level,
+        parquet_dictionary_encoding=parquet_dictionary_encoding,
+        parquet_byte_stream_split=parquet_byte_stream_split,
+        data_page_size=data_page_size,
+        workers=workers,
+        force=force,
+    )
+
+
 if __name__ == "__main__":
     main()
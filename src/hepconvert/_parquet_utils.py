@@ -0,0 +1,1573 @@
+from __future__ import annotations
+
+import ast
+import base64
+import collections
+import concurrent.futures
+import fnmatch
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import os
+import posixpath
+import struct
+import tempfile
+import threading
+from pathlib import Path
+
+import awkward as ak
+import fsspec
+import fsspec.implementations.local
+import numpy as np
+from awkward.types.numpytype import primitive_to_dtype
+
+# Parquet footers are Thrift structs in the compact protocol. Only the handful of
+# fields that hold file offsets are interpreted; everything else is carried through
+# unchanged, so footers written by any Parquet writer round-trip.
+
+(
+    _STOP,
+    _TRUE,
+    _FALSE,
+    _BYTE,
+    _I16,
+    _I32,
+    _I64,
+    _DOUBLE,
+    _BINARY,
+    _LIST,
+    _SET,
+    _MAP,
+    _STRUCT,
+) = range(13)
+
+_MAGIC = b"PAR1"
+
+# Field ids from parquet-format's parquet.thrift.
+_FILE_NUM_ROWS, _FILE_ROW_GROUPS = 3, 4
+_FILE_ENCRYPTION = (8, 9)
+_RG_COLUMNS, _RG_FILE_OFFSET, _RG_ORDINAL = 1, 5, 7
+_CC_FILE_PATH, _CC_FILE_OFFSET, _CC_META_DATA = 1, 2, 3
+_CC_PAGE_INDEX = (4, 5, 6, 7)
+_RG_TOTAL_BYTE_SIZE, _RG_NUM_ROWS, _RG_TOTAL_COMPRESSED_SIZE = 2, 3, 6
+_MD_TYPE, _MD_ENCODINGS, _MD_PATH = 1, 2, 3
+_MD_CODEC, _MD_TOTAL_UNCOMPRESSED_SIZE, _MD_TOTAL_COMPRESSED_SIZE = 4, 6, 7
+_MD_DATA_PAGE_OFFSET, _MD_INDEX_PAGE_OFFSET, _MD_DICTIONARY_PAGE_OFFSET = 9, 10, 11
+_MD_BLOOM_FILTER = (14, 15)
+
+_FOOTER_READ_SIZE = 64 * 1024
+
+# Parquet physical types FLOAT and DOUBLE, and the dictionary and byte stream split
+# encodings, as numbered in parquet.thrift.
+_FLOATING_TYPES = (4, 5)
+_DICTIONARY_ENCODINGS = (2, 8)
+_BYTE_STREAM_SPLIT = 9
+
+_CODECS = {
+    "none": 0,
+    "uncompressed": 0,
+    "snappy": 1,
+    "gzip": 2,
+    "zlib": 2,
+    "deflate": 2,
+    "brotli": 4,
+    "lz4": 7,
+    "zstd": 6,
+}
+
+_CODEC_NAMES = {
+    0: "NONE",
+    1: "SNAPPY",
+    2: "GZIP",
+    4: "BROTLI",
+    5: "LZ4",
+    6: "ZSTD",
+    7: "LZ4",
+}
+
+
+def _read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_value(buf, pos, ttype):
+    if ttype in (_TRUE, _FALSE):
+        return ttype == _TRUE, pos
+    if ttype == _BYTE:
+        return buf[pos], pos + 1
+    if ttype in (_I16, _I32, _I64):
+        value, pos = _read_varint(buf, pos)
+        return (value >> 1) ^ -(value & 1), pos
+    if ttype == _DOUBLE:
+        return struct.unpack_from("<d", buf, pos)[0], pos + 8
+    if ttype == _BINARY:
+        length, pos = _read_varint(buf, pos)
+        return bytes(buf[pos : pos + length]), pos + length
+    if ttype in (_LIST, _SET):
+        header = buf[pos]
+        pos += 1
+        size, etype = header >> 4, header & 0x0F
+        if size == 15:
+            size, pos = _read_varint(buf, pos)
+        items = []
+        for _ in range(size):
+            if etype in (_TRUE, _FALSE):
+                # booleans inside containers are stored as one raw byte each
+                item, pos = buf[pos], pos + 1
+            else:
+                item, pos = _read_value(buf, pos, etype)
+            items.append(item)
+        return (etype, items), pos
+    if ttype == _MAP:
+        size, pos = _read_varint(buf, pos)
+        if size == 0:
+            return (0, 0, []), pos
+        ktype, vtype = buf[pos] >> 4, buf[pos] & 0x0F
+        pos += 1
+        items = []
+        for _ in range(size):
+            key, pos = _read_value(buf, pos, ktype)
+            value, pos = _read_value(buf, pos, vtype)
+            items.append((key, value))
+        return (ktype, vtype, items), pos
+    if ttype == _STRUCT:
+        return _read_struct(buf, pos)
+    msg = f"unrecognized Thrift compact type {ttype} in Parquet footer"
+    raise ValueError(msg)
+
+
+def _read_struct(buf, pos):
+    fields = {}
+    last = 0
+    while True:
+        header = buf[pos]
+        pos += 1
+        ttype = header & 0x0F
+        if ttype == _STOP:
+            return fields, pos
+        delta = header >> 4
+        if delta:
+            field_id = last + delta
+        else:
+            field_id, pos = _read_value(buf, pos, _I16)
+        value, pos = _read_value(buf, pos, ttype)
+        fields[field_id] = (_TRUE if ttype in (_TRUE, _FALSE) else ttype, value)
+        last = field_id
+
+
+def _write_value(out, ttype, value):
+    if ttype == _BYTE:
+        out.append(value & 0xFF)
+    elif ttype in (_I16, _I32, _I64):
+        _write_varint(out, (value << 1) ^ (value >> 63))
+    elif ttype == _DOUBLE:
+        out += struct.pack("<d", value)
+    elif ttype == _BINARY:
+        _write_varint(out, len(value))
+        out += value
+    elif ttype in (_LIST, _SET):
+        etype, items = value
+        if len(items) < 15:
+            out.append((len(items) << 4) | etype)
+        else:
+            out.append(0xF0 | etype)
+            _write_varint(out, len(items))
+        for item in items:
+            if etype in (_TRUE, _FALSE):
+                out.append(item)
+            else:
+                _write_value(out, etype, item)
+    elif ttype == _MAP:
+        ktype, vtype, items = value
+        _write_varint(out, len(items))
+        if items:
+            out.append((ktype << 4) | vtype)
+        for key, item in items:
+            _write_value(out, ktype, key)
+            _write_value(out, vtype, item)
+    elif ttype == _STRUCT:
+        _write_struct(out, value)
+    else:
+        msg = f"unrecognized Thrift compact type {ttype} in Parquet footer"
+        raise ValueError(msg)
+
+
+def _write_struct(out, fields):
+    last = 0
+    for field_id in sorted(fields):
+        ttype, value = fields[field_id]
+        if ttype == _TRUE:
+            ttype = _TRUE if value else _FALSE
+        if 0 < field_id - last <= 15:
+            out.append(((field_id - last) << 4) | ttype)
+        else:
+            out.append(ttype)
+            _write_varint(out, (field_id << 1) ^ (field_id >> 15))
+        if ttype not in (_TRUE, _FALSE):
+            _write_value(out, ttype, value)
+        last = field_id
+    out.append(_STOP)
+
+
+def read_footer(file, *, storage_options=None):
+    """
+    Reads and parses the Thrift-encoded footer (FileMetaData) of a Parquet file.
+    """
+    with fsspec.open(file, "rb", **(storage_options or {})) as f:
+        f.seek(-8, 2)
+        tail = f.read(8)
+        if tail[4:] != _MAGIC:
+            msg = f"File: {file} is not an unencrypted Parquet file."
+            raise ValueError(msg)
+        length = struct.unpack("<I", tail[:4])[0]
+        f.seek(-8 - length, 2)
+        footer, _ = _read_struct(f.read(length), 0)
+    return footer
+
+
+def parse_footer(metadata):
+    """
+    Parses the Thrift-encoded footer kept in the ``metadata`` from ``scan_footers``,
+    as ``read_footer`` would read it from the file.
+    """
+    footer, _ = _read_struct(metadata["footer"], 0)
+    return footer
+
+
+def _footer_of(data):
+    # parses the footer of a whole Parquet file held in memory
+    length = struct.unpack("<I", data[-8:-4])[0]
+    footer, _ = _read_struct(data[-8 - length : -8], 0)
+    return footer
+
+
+def _chunk_start(meta_data):
+    start = meta_data[_MD_DATA_PAGE_OFFSET][1]
+    if _MD_DICTIONARY_PAGE_OFFSET in meta_data:
+        dictionary_offset = meta_data[_MD_DICTIONARY_PAGE_OFFSET][1]
+        if 0 < dictionary_offset < start:
+            start = dictionary_offset
+    return start
+
+
+def can_copy_column_chunks(footers, compression):
+    """
+    Checks whether Parquet files can be merged by copying their column chunks: all
+    files must have the same schema and key-value metadata, and every column chunk
+    must already be compressed with ``compression``.
+    """
+    if not isinstance(compression, str) and compression not in (None, False):
+        return False
+    codec = _CODECS.get(str(compression).lower() if compression else "none")
+    if codec is None:
+        return False
+    first = footers[0]
+    for footer in footers:
+        if footer.get(2) != first.get(2) or footer.get(5) != first.get(5):
+            return False
+        if any(field_id in footer for field_id in _FILE_ENCRYPTION):
+            return False
+        for row_group in footer[_FILE_ROW_GROUPS][1][1]:
+            for column in row_group[_RG_COLUMNS][1][1]:
+                if _CC_FILE_PATH in column or _CC_META_DATA not in column:
+                    return False
+                if column[_CC_META_DATA][1][_MD_CODEC][1] != codec:
+                    return False
+    return True
+
+
+def copy_column_chunks(out_file, in_files, footers, *, storage_options=None):
+    """
+    Merges Parquet files by copying the compressed bytes of every row group into
+    ``out_file`` and writing a new footer with shifted offsets. No page is decoded.
+    Page indexes and bloom filters are not carried over.
+    """
+    merged = dict(footers[0])
+    row_groups = []
+    num_rows = 0
+    with fsspec.open(out_file, "wb", **(storage_options or {})) as out:
+        out.write(_MAGIC)
+        position = len(_MAGIC)
+        for file, footer in zip(in_files, footers):
+            num_rows += footer[_FILE_NUM_ROWS][1]
+            with fsspec.open(file, "rb") as f:
+                for row_group in footer[_FILE_ROW_GROUPS][1][1]:
+                    columns = row_group[_RG_COLUMNS][1][1]
+                    begin = min(_chunk_start(c[_CC_META_DATA][1]) for c in columns)
+                    end = max(
+                        _chunk_start(c[_CC_META_DATA][1])
+                        + c[_CC_META_DATA][1][_MD_TOTAL_COMPRESSED_SIZE][1]
+                        for c in columns
+                    )
+                    f.seek(begin)
+                    remaining = end - begin
+                    while remaining > 0:
+                        block = f.read(min(remaining, 16 * 1024 * 1024))
+                        if not block:
+                            msg = f"File: {file} is truncated."
+                            raise ValueError(msg)
+                        out.write(block)
+                        remaining -= len(block)
+                    row_groups.append(
+                        _shift_row_group(row_group, position - begin, len(row_groups))
+                    )
+                    position += end - begin
+
+        merged[_FILE_NUM_ROWS] = (_I64, num_rows)
+        merged[_FILE_ROW_GROUPS] = (_LIST, (_STRUCT, row_groups))
+        _write_footer(out, merged)
+
+
+def _write_footer(out, footer):
+    encoded = bytearray()
+    _write_struct(encoded, footer)
+    out.write(bytes(encoded))
+    out.write(struct.pack("<I", len(encoded)))
+    out.write(_MAGIC)
+
+
+def write_dataset_metadata(
+    out_file, in_files, footers, *, common_metadata=False, storage_options=None
+):
+    """
+    Writes a ``_metadata`` summary file for a dataset: one footer holding the row
+    groups of every input, with each column chunk pointing to its data file by a
+    path relative to ``out_file``. No data is read or written. If
+    ``common_metadata`` is True, a ``_common_metadata`` file holding only the schema
+    is written next to it.
+    """
+    first = footers[0]
+    for file, footer in zip(in_files, footers):
+        if footer.get(2) != first.get(2) or footer.get(5) != first.get(5):
+            msg = f"File: {file} does not have the same schema as {in_files[0]}, so it cannot be merged into one _metadata file."
+            raise ValueError(msg)
+        if any(field_id in footer for field_id in _FILE_ENCRYPTION):
+            msg = f"File: {file} is encrypted."
+            raise ValueError(msg)
+
+    fs, out_path = fsspec.core.url_to_fs(str(out_file), **(storage_options or {}))
+    directory = posixpath.dirname(out_path)
+    row_groups = []
+    num_rows = 0
+    for file, footer in zip(in_files, footers):
+        _, path = fsspec.core.url_to_fs(str(file), **(storage_options or {}))
+        relative = posixpath.relpath(path, directory).encode()
+        num_rows += footer[_FILE_NUM_ROWS][1]
+        for row_group in footer[_FILE_ROW_GROUPS][1][1]:
+            columns = [
+                {**column, _CC_FILE_PATH: (_BINARY, relative)}
+                for column in row_group[_RG_COLUMNS][1][1]
+            ]
+            row_groups.append({**row_group, _RG_COLUMNS: (_LIST, (_STRUCT, columns))})
+
+    summary = dict(first)
+    summary[_FILE_NUM_ROWS] = (_I64, num_rows)
+    summary[_FILE_ROW_GROUPS] = (_LIST, (_STRUCT, row_groups))
+    with fs.open(out_path, "wb") as out:
+        out.write(_MAGIC)
+        _write_footer(out, summary)
+    if common_metadata:
+        summary[_FILE_NUM_ROWS] = (_I64, 0)
+        summary[_FILE_ROW_GROUPS] = (_LIST, (_STRUCT, []))
+        with fs.open(posixpath.join(directory, "_common_metadata"), "wb") as out:
+            out.write(_MAGIC)
+            _write_footer(out, summary)
+
+
+def plan_transcode(
+    footer,
+    *,
+    compression=None,
+    compression_level=None,
+    dictionary=None,
+    byte_stream_split=None,
+    data_page_size=None,
+):
+    """
+    Decides which column chunks a rewrite with new writer options has to re-encode.
+    Each option is None to keep what the file has, a value for every column, or a
+    dict from column path (such as ``"jet.list.item.pt"``) to value. Returns, per
+    row group, a list with None for every column chunk that can be copied as it is
+    and the pyarrow writer options for every one that has to be re-encoded.
+    """
+    plan = []
+    for row_group in footer[_FILE_ROW_GROUPS][1][1]:
+        columns = []
+        for column in row_group[_RG_COLUMNS][1][1]:
+            meta_data = column[_CC_META_DATA][1]
+            path = ".".join(x.decode() for x in meta_data[_MD_PATH][1][1])
+            encodings = meta_data[_MD_ENCODINGS][1][1]
+            codec = meta_data[_MD_CODEC][1]
+            use_dictionary = any(e in _DICTIONARY_ENCODINGS for e in encodings)
+            use_byte_stream_split = _BYTE_STREAM_SPLIT in encodings
+            changed = data_page_size is not None
+
+            requested = _column_option(compression, path)
+            if requested is not None:
+                if str(requested).lower() not in _CODECS:
+                    msg = f"unrecognized compression algorithm: {requested}."
+                    raise ValueError(msg)
+                changed |= _CODECS[str(requested).lower()] != codec
+                codec = _CODECS[str(requested).lower()]
+            level = _column_option(compression_level, path)
+            if codec == 0:
+                level = None
+            changed |= level is not None
+            requested = _column_option(dictionary, path)
+            if requested is not None:
+                changed |= bool(requested) != use_dictionary
+                use_dictionary = bool(requested)
+            requested = _column_option(byte_stream_split, path)
+            if requested is not None and meta_data[_MD_TYPE][1] in _FLOATING_TYPES:
+                changed |= bool(requested) != use_byte_stream_split
+                use_byte_stream_split = bool(requested)
+
+            if not changed or row_group[_RG_NUM_ROWS][1] == 0:
+                columns.append(None)
+                continue
+            if codec not in _CODEC_NAMES:
+                msg = f"Cannot re-encode column {path}: its codec is not supported by pyarrow."
+                raise ValueError(msg)
+            options = {
+                "compression": _CODEC_NAMES[codec],
+                # pyarrow prefers dictionary encoding when both are asked for
+                "use_dictionary": use_dictionary and not use_byte_stream_split,
+                "use_byte_stream_split": use_byte_stream_split,
+            }
+            if level is not None:
+                options["compression_level"] = level
+            if data_page_size is not None:
+                options["data_page_size"] = data_page_size
+            columns.append(options)
+        plan.append(columns)
+    return plan
+
+
+def _column_option(option, path):
+    if isinstance(option, dict):
+        return option.get(path)
+    return option
+
+
+def transcode_column_chunks(
+    out_file, in_file, footer, plan, *, workers=None, storage_options=None
+):
+    """
+    Rewrites a Parquet file following a ``plan_transcode`` plan. Column chunks are
+    read, and re-encoded where the plan says so, in a thread pool; each one that is
+    re-encoded is decoded and written with pyarrow on its own, and its compressed
+    bytes are spliced into the output in place of the original. All other column
+    chunks are copied byte for byte, as are those that pyarrow cannot write with
+    the definition and repetition levels of the original. Row groups and the schema
+    are kept.
+    ``storage_options`` are used to open both ``in_file`` and ``out_file``.
+    """
+    if any(field_id in footer for field_id in _FILE_ENCRYPTION):
+        msg = f"File: {in_file} is encrypted."
+        raise ValueError(msg)
+    metadata = None
+    if any(options is not None for row_group in plan for options in row_group):
+        encoded = bytearray()
+        _write_struct(encoded, footer)
+        metadata = _arrow_metadata(bytes(encoded))
+    tasks = []
+    for i, (row_group, options) in enumerate(zip(footer[_FILE_ROW_GROUPS][1][1], plan)):
+        for column, column_options in zip(row_group[_RG_COLUMNS][1][1], options):
+            if _CC_FILE_PATH in column:
+                msg = f"File: {in_file} refers to column chunks in other files."
+                raise ValueError(msg)
+            if column_options is None:
+                tasks.append(
+                    functools.partial(_copy_column, in_file, column, storage_options)
+                )
+            else:
+                tasks.append(
+                    functools.partial(
+                        _encode_column,
+                        in_file,
+                        metadata,
+                        i,
+                        column,
+                        column_options,
+                        storage_options,
+                    )
+                )
+
+    chunks = read_ahead(tasks, workers=workers)
+    row_groups = []
+    with fsspec.open(out_file, "wb", **(storage_options or {})) as out:
+        out.write(_MAGIC)
+        position = len(_MAGIC)
+        for original in footer[_FILE_ROW_GROUPS][1][1]:
+            row_group = dict(original)
+            columns = []
+            for _ in original[_RG_COLUMNS][1][1]:
+                data, column, start = next(chunks)
+                columns.append(_shift_column(column, position - start))
+                out.write(data)
+                position += len(data)
+            row_group[_RG_COLUMNS] = (_LIST, (_STRUCT, columns))
+            row_group[_RG_TOTAL_BYTE_SIZE] = (
+                _I64,
+                sum(
+                    c[_CC_META_DATA][1][_MD_TOTAL_UNCOMPRESSED_SIZE][1] for c in columns
+                ),
+            )
+            row_group[_RG_TOTAL_COMPRESSED_SIZE] = (
+                _I64,
+                sum(c[_CC_META_DATA][1][_MD_TOTAL_COMPRESSED_SIZE][1] for c in columns),
+            )
+            if columns:
+                row_group[_RG_FILE_OFFSET] = (
+                    _I64,
+                    _chunk_start(columns[0][_CC_META_DATA][1]),
+                )
+            if _RG_ORDINAL in row_group:
+                row_group[_RG_ORDINAL] = (_I16, len(row_groups))
+            row_groups.append(row_group)
+        _write_footer(out, {**footer, _FILE_ROW_GROUPS: (_LIST, (_STRUCT, row_groups))})
+
+
+def _copy_column(file, column, storage_options=None):
+    meta_data = column[_CC_META_DATA][1]
+    start = _chunk_start(meta_data)
+    fs, path = fsspec.core.url_to_fs(os.fspath(file), **(storage_options or {}))
+    data = fs.cat_file(path, start, start + meta_data[_MD_TOTAL_COMPRESSED_SIZE][1])
+    return data, column, start
+
+
+@functools.lru_cache(maxsize=64)
+def _arrow_metadata(encoded):
+    # pyarrow's FileMetaData for a Thrift-encoded footer, such as the one kept by
+    # scan_footers, so that pq.ParquetFile does not read and parse it again
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+    buffer = io.BytesIO()
+    buffer.write(_MAGIC)
+    buffer.write(encoded)
+    buffer.write(struct.pack("<I", len(encoded)))
+    buffer.write(_MAGIC)
+    buffer.seek(0)
+    return pq.read_metadata(buffer)
+
+
+def _encode_column(file, metadata, row_group, column, options, storage_options=None):
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+    meta_data = column[_CC_META_DATA][1]
+    path = ".".join(x.decode() for x in meta_data[_MD_PATH][1][1])
+    with fsspec.open(file, "rb", **(storage_options or {})) as f:
+        parquet_file = pq.ParquetFile(f, metadata=metadata)
+        table = parquet_file.read_row_group(row_group, columns=[path])
+    # Reading one leaf makes the structs around it nullable, which would add
+    # definition levels, so the original nullability is put back.
+    original = parquet_file.schema_arrow
+    table = table.cast(
+        pa.schema(
+            [
+                _with_nullability(field, original.field(field.name))
+                for field in table.schema
+            ],
+            metadata=table.schema.metadata,
+        )
+    )
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, row_group_size=table.num_rows, **options)
+    data = buffer.getvalue()
+    expected = next(
+        parquet_file.schema.column(j)
+        for j in range(len(parquet_file.schema))
+        if parquet_file.schema.column(j).path == path
+    )
+    written = pq.ParquetFile(io.BytesIO(data)).schema.column(0)
+    if (written.max_definition_level, written.max_repetition_level) != (
+        expected.max_definition_level,
+        expected.max_repetition_level,
+    ):
+        # the levels, and the level histograms, would not match the schema
+        return _copy_column(file, column, storage_options)
+    ((encoded,),) = (
+        written[_RG_COLUMNS][1][1]
+        for written in _footer_of(data)[_FILE_ROW_GROUPS][1][1]
+    )
+    encoded_meta = dict(encoded[_CC_META_DATA][1])
+    if encoded_meta[_MD_TYPE] != meta_data[_MD_TYPE]:
+        msg = f"Cannot re-encode column {path}: pyarrow writes it with a different physical type."
+        raise ValueError(msg)
+    # the writer may name nested list levels differently
+    encoded_meta[_MD_PATH] = meta_data[_MD_PATH]
+    start = _chunk_start(encoded_meta)
+    chunk = data[start : start + encoded_meta[_MD_TOTAL_COMPRESSED_SIZE][1]]
+    return chunk, {**encoded, _CC_META_DATA: (_STRUCT, encoded_meta)}, start
+
+
+def _with_nullability(field, original):
+    # ``field`` with the nullability of the fields of the same name in ``original``
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+    field_type = field.type
+    if pa.types.is_struct(field_type):
+        field_type = pa.struct(
+            [
+                _with_nullability(child, original.type.field(child.name))
+                for child in field_type
+            ]
+        )
+    elif pa.types.is_large_list(field_type):
+        field_type = pa.large_list(
+            _with_nullability(field_type.value_field, original.type.value_field)
+        )
+    elif pa.types.is_list(field_type):
+        field_type = pa.list_(
+            _with_nullability(field_type.value_field, original.type.value_field)
+        )
+    return pa.field(
+        field.name, field_type, nullable=original.nullable, metadata=field.metadata
+    )
+
+
+def _shift_row_group(row_group, delta, ordinal):
+    row_group = dict(row_group)
+    columns = [_shift_column(column, delta) for column in row_group[_RG_COLUMNS][1][1]]
+    row_group[_RG_COLUMNS] = (_LIST, (_STRUCT, columns))
+    if _RG_FILE_OFFSET in row_group:
+        row_group[_RG_FILE_OFFSET] = (_I64, row_group[_RG_FILE_OFFSET][1] + delta)
+    if _RG_ORDINAL in row_group:
+        row_group[_RG_ORDINAL] = (_I16, ordinal)
+    return row_group
+
+
+def _shift_column(original, delta):
+    # Moves a column chunk by delta bytes, dropping its page index and bloom filter.
+    column = {k: v for k, v in original.items() if k not in _CC_PAGE_INDEX}
+    meta_data = {
+        k: v for k, v in column[_CC_META_DATA][1].items() if k not in _MD_BLOOM_FILTER
+    }
+    for field_id in (
+        _MD_DATA_PAGE_OFFSET,
+        _MD_INDEX_PAGE_OFFSET,
+        _MD_DICTIONARY_PAGE_OFFSET,
+    ):
+        if field_id in meta_data and meta_data[field_id][1] > 0:
+            meta_data[field_id] = (_I64, meta_data[field_id][1] + delta)
+    column[_CC_META_DATA] = (_STRUCT, meta_data)
+    if _CC_FILE_OFFSET in column and column[_CC_FILE_OFFSET][1] > 0:
+        column[_CC_FILE_OFFSET] = (_I64, column[_CC_FILE_OFFSET][1] + delta)
+    return column
+
+
+# Bumped whenever the cached footer entries change.
+_FOOTER_CACHE_VERSION = 3
+
+
+def scan_footers(files, *, workers=None, cache=None, skip_bad_files=False):
+    """
+    Reads the footers of Parquet files concurrently in a thread pool. Returns a list
+    of ``(file, metadata)`` pairs in input order, where ``metadata`` has the same
+    ``num_rows``, ``num_row_groups`` and ``col_counts`` entries as
+    ``ak.metadata_from_parquet`` and the ``form`` that ``ak.from_parquet`` reads,
+    plus the per-row-group uncompressed and compressed sizes, column min/max
+    statistics, the byte ranges of the footer and of every column chunk, and the
+    Thrift-encoded footer for ``parse_footer``. If ``cache`` is a directory, parsed footers are kept there, keyed by path, size
+    and modification time.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_scan_footer, file, cache) for file in files]
+        scanned = []
+        for file, future in zip(files, futures):
+            try:
+                scanned.append((file, future.result()))
+            except (OSError, ValueError):
+                if skip_bad_files:
+                    continue
+                msg = f"File: {file} does not exist or is corrupt."
+                raise FileNotFoundError(msg) from None
+    return scanned
+
+
+def _scan_footer(file, cache):
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+    fs, path = fsspec.core.url_to_fs(os.fspath(file))
+    entry = None
+    if cache is not None:
+        info = fs.info(path)
+        mtime = info.get("mtime", info.get("LastModified"))
+        if mtime is not None:
+            key = f"{_FOOTER_CACHE_VERSION}\0{fs.unstrip_protocol(path)}\0{info['size']}\0{mtime}"
+            entry = Path(cache) / (hashlib.sha256(key.encode()).hexdigest() + ".json")
+            try:
+                return _footer_from_json(json.loads(entry.read_text()))
+            except (OSError, ValueError, KeyError):
+                pass
+
+    with fs.open(path, "rb") as f:
+        parquet_file = pq.ParquetFile(f)
+        metadata = parquet_file.metadata
+        schema = parquet_file.schema_arrow
+        size = f.size
+        f.seek(size - 8 - metadata.serialized_size)
+        encoded = f.read(metadata.serialized_size)
+    row_groups = [metadata.row_group(i) for i in range(metadata.num_row_groups)]
+    footer = {
+        "form": _from_arrow(schema.empty_table()).layout.form,
+        "num_rows": metadata.num_rows,
+        "num_row_groups": metadata.num_row_groups,
+        "col_counts": [row_group.num_rows for row_group in row_groups],
+        "row_group_bytes": [row_group.total_byte_size for row_group in row_groups],
+        "compressed_bytes": [
+            sum(
+                row_group.column(j).total_compressed_size
+                for j in range(row_group.num_columns)
+            )
+            for row_group in row_groups
+        ],
+        "statistics": [_statistics(row_group) for row_group in row_groups],
+        # pyarrow reads at least the last 64 KiB of a file to find the footer.
+        "footer_range": [
+            max(0, size - max(_FOOTER_READ_SIZE, metadata.serialized_size + 8)),
+            size,
+        ],
+        "column_ranges": [_column_ranges(row_group) for row_group in row_groups],
+        "footer": encoded,
+    }
+
+    if entry is not None:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=entry.parent, suffix=".tmp", delete=False
+        ) as tmp:
+            json.dump(_footer_to_json(footer), tmp)
+        Path(tmp.name).replace(entry)
+    return footer
+
+
+def _statistics(row_group):
+    statistics = {}
+    for j in range(row_group.num_columns):
+        column = row_group.column(j)
+        stats = column.statistics
+        if stats is None or not stats.has_min_max:
+            continue
+        if isinstance(stats.min, (bool, int, float, str)) and isinstance(
+            stats.max, (bool, int, float, str)
+        ):
+            statistics[column.path_in_schema] = [stats.min, stats.max]
+    return statistics
+
+
+def _column_ranges(row_group):
+    ranges = []
+    for j in range(row_group.num_columns):
+        column = row_group.column(j)
+        start = column.data_page_offset
+        if column.has_dictionary_page and 0 < column.dictionary_page_offset < start:
+            start = column.dictionary_page_offset
+        ranges.append(
+            [column.path_in_schema, start, start + column.total_compressed_size]
+        )
+    return ranges
+
+
+def _footer_to_json(footer):
+    return dict(
+        footer,
+        form=footer["form"].to_dict(),
+        footer=base64.b64encode(footer["footer"]).decode(),
+    )
+
+
+def _footer_from_json(footer):
+    return dict(
+        footer,
+        form=ak.forms.from_dict(footer["form"]),
+        footer=base64.b64decode(footer["footer"]),
+    )
+
+
+def read_ahead(tasks, *, workers=None, max_pending=None):
+    """
+    Calls each of ``tasks`` (callables without arguments) and yields the results in
+    order. If ``workers`` is set, up to ``max_pending`` tasks (by default twice the
+    number of workers) run ahead of the consumer in a thread pool, which bounds the
+    number of results held in memory.
+    """
+    if not workers:
+        for task in tasks:
+            yield task()
+        return
+    tasks = iter(tasks)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    pending = collections.deque(
+        executor.submit(task)
+        for task in itertools.islice(tasks, max_pending or 2 * workers)
+    )
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for task in itertools.islice(tasks, 1):
+                pending.append(executor.submit(task))
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class ParquetFiles:
+    """
+    Keeps inputs open as ``pq.ParquetFile`` objects built from the footers kept by
+    ``scan_footers``, so that reading a row group neither opens the file nor parses
+    its footer again. Since a ParquetFile is not read from several threads at once,
+    each thread keeps its own, for up to ``max_open`` of the inputs it read last.
+    Local files are memory-mapped if ``memory_map`` is True.
+    """
+
+    def __init__(self, memory_map=False, max_open=4):
+        self.memory_map = memory_map
+        self.max_open = max_open
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = {}
+
+    def get(self, file, metadata):
+        opened = getattr(self._local, "files", None)
+        if opened is None:
+            opened = self._local.files = collections.OrderedDict()
+        key = os.fspath(file)
+        if key in opened:
+            opened.move_to_end(key)
+            return opened[key][0]
+
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+        fs, path = fsspec.core.url_to_fs(key)
+        footer = _arrow_metadata(metadata["footer"])
+        handle = None
+        if self.memory_map and isinstance(
+            fs, fsspec.implementations.local.LocalFileSystem
+        ):
+            parquet_file = pq.ParquetFile(path, memory_map=True, metadata=footer)
+        else:
+            handle = fs.open(path, "rb")
+            parquet_file = pq.ParquetFile(handle, metadata=footer)
+        opened[key] = (parquet_file, handle)
+        with self._lock:
+            self._open[id(opened[key])] = opened[key]
+        while len(opened) > self.max_open:
+            _, evicted = opened.popitem(last=False)
+            with self._lock:
+                del self._open[id(evicted)]
+            _close(*evicted)
+        return parquet_file
+
+    def close(self):
+        with self._lock:
+            entries, self._open = list(self._open.values()), {}
+        for entry in entries:
+            _close(*entry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _close(parquet_file, handle):
+    parquet_file.close()
+    if handle is not None:
+        handle.close()
+
+
+def read_row_group(
+    file,
+    row_group,
+    form=None,
+    columns=None,
+    memory_map=False,
+    *,
+    metadata=None,
+    files=None,
+):
+    """
+    Reads one row group with ``ak.from_parquet``, converted to ``form`` if given.
+    If ``columns`` is given, only those columns are read from the file. If
+    ``memory_map`` is True and the file is local, it is memory-mapped and read
+    with pyarrow directly, so that column data comes from the page cache. If
+    ``files`` (a ``ParquetFiles``) and the ``metadata`` from ``scan_footers`` are
+    given, the row group is read from the input kept open there instead, which
+    decides on memory-mapping.
+    """
+    fs, path = fsspec.core.url_to_fs(os.fspath(file))
+    if files is not None:
+        table = files.get(file, metadata).read_row_group(row_group, columns=columns)
+        array = _from_arrow(table)
+    elif memory_map and isinstance(fs, fsspec.implementations.local.LocalFileSystem):
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+        table = pq.ParquetFile(path, memory_map=True).read_row_group(
+            row_group, columns=columns
+        )
+        array = _from_arrow(table)
+    else:
+        array = ak.from_parquet(file, row_groups=[row_group], columns=columns)
+    if form is None:
+        return array
+    return conform(array, form)
+
+
+def fetch_row_group(file, metadata, row_group, columns=None, max_gap=64 * 1024):
+    """
+    Reads the bytes that decoding one row group needs, using the byte ranges in the
+    ``metadata`` from ``scan_footers``: the column chunks of the top-level
+    ``columns`` (all columns if None). The footer is not read again, since the
+    metadata holds it. Ranges less than ``max_gap`` apart
+    are read as one, and all of them are requested with a single ``cat_ranges``
+    call. Returns a dict from ``(start, stop)`` to bytes for ``decode_row_group``.
+    """
+    fs, path = fsspec.core.url_to_fs(os.fspath(file))
+    ranges = sorted(
+        (start, stop)
+        for name, start, stop in metadata["column_ranges"][row_group]
+        if columns is None
+        or any(name == field or name.startswith(field + ".") for field in columns)
+    )
+    merged = []
+    for start, stop in ranges:
+        if merged and start - merged[-1][1] <= max_gap:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    blocks = fs.cat_ranges(
+        [path] * len(merged),
+        [start for start, _ in merged],
+        [stop for _, stop in merged],
+    )
+    return {(start, stop): block for (start, stop), block in zip(merged, blocks)}
+
+
+def decode_row_group(file, metadata, row_group, parts, form, columns=None):
+    """
+    Decodes one row group from the ``parts`` fetched by ``fetch_row_group`` and
+    the footer in the ``metadata`` from ``scan_footers``, and converts it to
+    ``form``. Reads that fall outside of ``parts`` go to the file.
+    """
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+    fs, path = fsspec.core.url_to_fs(os.fspath(file))
+    size = metadata["footer_range"][1]
+    with _PrefetchedFile(parts, size, functools.partial(fs.cat_file, path)) as f:
+        table = pq.ParquetFile(
+            f, metadata=_arrow_metadata(metadata["footer"])
+        ).read_row_group(row_group, columns=columns)
+    return conform(_from_arrow(table), form)
+
+
+def _from_arrow(table):
+    # ak.to_parquet keeps record names and other parameters in the schema metadata,
+    # which ak.from_parquet restores but ak.from_arrow does not.
+    try:
+        from awkward._connect.pyarrow.table_conv import (  # pylint: disable=import-outside-toplevel
+            convert_native_arrow_table_to_awkward,
+        )
+    except ImportError:
+        return ak.from_arrow(table, generate_bitmasks=False)
+    return ak.from_arrow(
+        convert_native_arrow_table_to_awkward(table), generate_bitmasks=False
+    )
+
+
+class _PrefetchedFile(io.RawIOBase):
+    # A read-only file that serves reads from prefetched byte ranges and fetches
+    # anything else with ``fetch(start, stop)``.
+
+    def __init__(self, parts, size, fetch):
+        super().__init__()
+        self._parts = sorted(parts.items())
+        self._size = size
+        self._fetch = fetch
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def size(self):
+        return self._size
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._position = offset
+        return offset
+
+    def read(self, size=-1):
+        start = self._position
+        stop = self._size if size is None or size < 0 else min(start + size, self._size)
+        if stop <= start:
+            return b""
+        self._position = stop
+        for (begin, end), block in self._parts:
+            if begin <= start and stop <= end:
+                return block[start - begin : stop - begin]
+        return self._fetch(start, stop)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def sorted_merge(
+    metadata, form, sort_by, *, columns=None, keep_row_group=None, memory_map=False
+):
+    """
+    K-way merges inputs that are each sorted by the ``sort_by`` fields, yielding
+    batches that are sorted and follow each other in order. At most one row group
+    per input is held in memory: row-group min statistics give a lower bound for
+    the keys of each row group that has not been read yet, and a row group is only
+    read once no smaller key can remain.
+
+    ``columns`` maps each input to the columns to read from it, and row groups whose
+    statistics fail ``keep_row_group`` are never read. If no rows are read, an empty
+    array is yielded so that the output still has a schema.
+    """
+    for key in sort_by:
+        if not (form.is_record and form.has_field(key) and form.content(key).is_numpy):
+            msg = f"Cannot sort by {key!r}: must be a numeric field of every input."
+            raise ValueError(msg)
+    target = _canonical_form(form)
+
+    buffers = [None] * len(metadata)
+    next_row_group = [0] * len(metadata)
+    last_keys = [None] * len(metadata)
+    unread = []
+
+    def schedule(i):
+        meta = metadata[i][1]
+        while (
+            keep_row_group is not None
+            and next_row_group[i] < meta["num_row_groups"]
+            and not keep_row_group(meta["statistics"][next_row_group[i]])
+        ):
+            next_row_group[i] += 1
+        row_group = next_row_group[i]
+        if row_group < meta["num_row_groups"]:
+            statistics = meta["statistics"][row_group]
+            bound = tuple(statistics.get(key, (-np.inf,))[0] for key in sort_by)
+            heapq.heappush(unread, (bound, i))
+
+    def read(i):
+        file, meta = metadata[i]
+        array = read_row_group(
+            file,
+            next_row_group[i],
+            target,
+            None if columns is None else columns[i],
+            metadata=meta,
+            files=files,
+        )
+        next_row_group[i] += 1
+        keys = [ak.to_numpy(array[key]) for key in sort_by]
+        if len(array) == 0:
+            schedule(i)
+            return
+        first = tuple(k[0].item() for k in keys)
+        if not np.all(_lex_le([k[:-1] for k in keys], [k[1:] for k in keys])) or (
+            last_keys[i] is not None and first < last_keys[i]
+        ):
+            msg = f"File: {metadata[i][0]} is not sorted by {sort_by}."
+            raise ValueError(msg)
+        last_keys[i] = tuple(k[-1].item() for k in keys)
+        buffers[i] = (array, keys)
+
+    # every input may hold the next rows, so all of them are kept open
+    with ParquetFiles(memory_map, max_open=len(metadata)) as files:
+        for i in range(len(metadata)):
+            schedule(i)
+
+        empty = True
+        while unread or any(buffer is not None for buffer in buffers):
+            # Every buffered row with a key up to the smallest buffered maximum can be
+            # written once all row groups that might hold smaller keys have been read.
+            frontier = min(
+                (last_keys[i] for i, buffer in enumerate(buffers) if buffer is not None),
+                default=None,
+            )
+            while unread and (frontier is None or unread[0][0] <= frontier):
+                _, i = heapq.heappop(unread)
+                read(i)
+                if buffers[i] is not None and (frontier is None or last_keys[i] < frontier):
+                    frontier = last_keys[i]
+            if frontier is None:
+                continue
+
+            parts, part_keys = [], []
+            for i, buffer in enumerate(buffers):
+                if buffer is None:
+                    continue
+                array, keys = buffer
+                n = int(np.count_nonzero(_lex_le(keys, frontier)))
+                parts.append(array[:n])
+                part_keys.append([k[:n] for k in keys])
+                if n == len(array):
+                    buffers[i] = None
+                    schedule(i)
+                else:
+                    buffers[i] = (array[n:], [k[n:] for k in keys])
+
+            order = np.lexsort(
+                [
+                    np.concatenate([keys[j] for keys in part_keys])
+                    for j in reversed(range(len(sort_by)))
+                ]
+            )
+            empty = False
+            yield conform(ak.concatenate(parts)[order], target)
+    if empty:
+        yield ak.Array(target.length_zero_array())
+
+
+def _lex_le(keys, other):
+    """
+    Elementwise lexicographic ``keys <= other`` over parallel key columns.
+    """
+    result = keys[-1] <= other[-1]
+    for key, value in zip(keys[-2::-1], other[-2::-1]):
+        result = (key < value) | ((key == value) & result)
+    return result
+
+
+def plan_compaction(sizes, target_size, small_file_size):
+    """
+    Bin-packs the files smaller than ``small_file_size`` into groups of about
+    ``target_size`` bytes, largest first, and returns the groups that hold more than
+    one file. ``sizes`` maps each file to its size in bytes.
+    """
+    bins = []
+    for file, size in sorted(sizes.items(), key=lambda item: (-item[1], str(item[0]))):
+        if size >= small_file_size:
+            continue
+        for group in bins:
+            if group[0] + size <= target_size:
+                group[0] += size
+                group[1].append(file)
+                break
+        else:
+            bins.append([size, [file]])
+    return [sorted(files) for _, files in bins if len(files) > 1]
+
+
+def select_fields(form, keep_branches=None, drop_branches=None):
+    """
+    Returns the top-level fields of ``form`` selected by ``keep_branches`` or
+    ``drop_branches``, which are names or wildcard patterns such as ``"Jet_*"``.
+    """
+    if drop_branches and keep_branches:
+        msg = "Can specify either drop_branches or keep_branches, not both."
+        raise ValueError(msg) from None
+    patterns = drop_branches if drop_branches else keep_branches
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    matched = [
+        field
+        for field in form.fields
+        if any(fnmatch.fnmatchcase(field, pattern) for pattern in patterns or [])
+    ]
+    if drop_branches:
+        return [field for field in form.fields if field not in matched]
+    if keep_branches:
+        return matched
+    return list(form.fields)
+
+
+def project_form(form, fields):
+    """
+    Returns the record ``form`` restricted to ``fields``.
+    """
+    return ak.forms.RecordForm(
+        [form.content(field) for field in fields], fields, parameters=form.parameters
+    )
+
+
+def columns_to_read(file_form, fields):
+    """
+    Returns the ``fields`` present in an input file. ``ak.from_parquet`` returns no
+    rows when no columns are read, so one column is kept to count them.
+    """
+    present = [field for field in fields if file_form.has_field(field)]
+    return present or list(file_form.fields[:1])
+
+
+_flipped = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "==": "=="}
+_comparisons = {ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">=", ast.Eq: "=="}
+
+
+def cut_fields(cut, form):
+    """
+    Returns the top-level fields of ``form`` named in the ``cut`` expression.
+    """
+    names = {
+        node.id
+        for node in ast.walk(ast.parse(cut, mode="eval"))
+        if isinstance(node, ast.Name)
+    }
+    return [field for field in form.fields if field in names]
+
+
+def cut_ranges(cut):
+    """
+    Extracts the comparisons of a field with a number, such as ``x > 3`` or
+    ``1 <= y < 5``, that every passing entry must satisfy. Only terms combined with
+    ``&`` are required of every entry; anything else is left to the full cut.
+    """
+
+    def terms(node):
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+            return terms(node.left) + terms(node.right)
+        return [node]
+
+    def number(node):
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            value = number(node.operand)
+            return None if value is None else -value
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return None if isinstance(node.value, bool) else node.value
+        return None
+
+    ranges = []
+    for term in terms(ast.parse(cut, mode="eval").body):
+        if not isinstance(term, ast.Compare):
+            continue
+        operands = [term.left, *term.comparators]
+        for left, op, right in zip(operands[:-1], term.ops, operands[1:]):
+            if type(op) not in _comparisons:
+                continue
+            comparison = _comparisons[type(op)]
+            if isinstance(left, ast.Name) and number(right) is not None:
+                ranges.append((left.id, comparison, number(right)))
+            elif isinstance(right, ast.Name) and number(left) is not None:
+                ranges.append((right.id, _flipped[comparison], number(left)))
+    return ranges
+
+
+def may_pass(ranges, statistics):
+    """
+    Returns False if the min/max ``statistics`` of a row group show that no entry
+    can satisfy all of the ``ranges`` from ``cut_ranges``.
+    """
+    for name, op, value in ranges:
+        if name not in statistics:
+            continue
+        low, high = statistics[name]
+        if not all(
+            isinstance(x, (int, float)) and not isinstance(x, bool) for x in (low, high)
+        ):
+            continue
+        if (
+            (op == ">" and high <= value)
+            or (op == ">=" and high < value)
+            or (op == "<" and low >= value)
+            or (op == "<=" and low > value)
+            or (op == "==" and not low <= value <= high)
+        ):
+            return False
+    return True
+
+
+def apply_cut(arrays, cut, form):
+    """
+    Filters a stream of record arrays with the ``cut`` expression, evaluated with the
+    fields as variables and ``np`` as NumPy, and keeps the fields of ``form``. Empty
+    results are dropped, except that an empty array is yielded if nothing passes so
+    that the output still has a schema.
+    """
+    target = _canonical_form(form)
+    code = None if cut is None else compile(cut, "<cut>", "eval")
+    empty = True
+    for array in arrays:
+        selected = array
+        if code is not None:
+            namespace = {field: array[field] for field in array.fields}
+            mask = eval(code, {"np": np}, namespace)  # pylint: disable=eval-used
+            selected = array[ak.fill_none(mask, False)]
+        if len(selected) == 0:
+            continue
+        empty = False
+        yield conform(selected[list(form.fields)], target)
+    if empty:
+        yield ak.Array(target.length_zero_array())
+
+
+def drop_duplicates(arrays, keys, form, max_bytes):
+    """
+    Drops the rows of a stream of record arrays whose ``keys`` fields repeat a row
+    seen earlier in the stream, keeping the first. Rows are identified by a 64-bit
+    hash of their keys, kept in a NumPy open-addressing table that grows up to
+    ``max_bytes``. Distinct keys that share a 64-bit hash would be dropped too,
+    which is very unlikely.
+    """
+    for key in keys:
+        if not (form.is_record and form.has_field(key) and form.content(key).is_numpy):
+            msg = f"Cannot deduplicate by {key!r}: must be a numeric field of every input."
+            raise ValueError(msg)
+    target = _canonical_form(form)
+    table = np.zeros(min(1 << 16, _table_size(max_bytes)), dtype=np.uint64)
+    count = 0
+    for array in arrays:
+        hashes = _hash_rows([ak.to_numpy(array[key]) for key in keys])
+        unique, first = np.unique(hashes, return_index=True)
+        if 2 * (count + len(unique)) > len(table):
+            size = len(table)
+            while 2 * (count + len(unique)) > size:
+                size *= 2
+            if size > _table_size(max_bytes):
+                msg = f"Deduplicating needs more than {max_bytes} bytes for its table of keys; increase the memory ceiling."
+                raise MemoryError(msg)
+            grown = np.zeros(size, dtype=np.uint64)
+            _insert(grown, table[table != 0])
+            table = grown
+        keep = np.zeros(len(hashes), dtype=bool)
+        keep[first[_insert(table, unique)]] = True
+        kept = int(np.count_nonzero(keep))
+        # row groups with nothing new are not written, except to give a schema
+        if kept > 0 or count == 0:
+            yield conform(array[keep], target)
+        count += kept
+
+
+def _table_size(max_bytes):
+    # the largest power of two number of 8-byte slots within max_bytes
+    return 1 << max(0, (int(max_bytes) // 8).bit_length() - 1)
+
+
+def _mix(values):
+    # splitmix64 finalizer; uint64 arithmetic wraps around
+    z = values + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def _hash_rows(columns):
+    hashes = np.zeros(len(columns[0]) if columns else 0, dtype=np.uint64)
+    for column in columns:
+        if column.dtype.kind == "f":
+            bits = column.astype(np.float64).view(np.uint64)
+        else:
+            bits = column.astype(np.int64).view(np.uint64)
+        hashes = _mix(hashes ^ _mix(bits))
+    # zero marks an empty slot
+    hashes[hashes == 0] = 1
+    return hashes
+
+
+def _insert(table, hashes):
+    # Inserts distinct, non-zero hashes into a linear-probing table in place and
+    # returns a mask of those that were not in it already.
+    mask = np.uint64(len(table) - 1)
+    new = np.zeros(len(hashes), dtype=bool)
+    slots = (hashes & mask).astype(np.int64)
+    pending = np.arange(len(hashes))
+    while len(pending) > 0:
+        current = table[slots[pending]]
+        found = current == hashes[pending]
+        empty = pending[current == 0]
+        # when several hashes reach the same empty slot, the first one takes it
+        _, first = np.unique(slots[empty], return_index=True)
+        winners = empty[first]
+        table[slots[winners]] = hashes[winners]
+        new[winners] = True
+        done = found
+        done[np.isin(pending, winners)] = True
+        pending = pending[~done]
+        slots[pending] = (slots[pending] + 1) & int(mask)
+    return new
+
+
+def coalesce(arrays, target_bytes, form):
+    """
+    Re-chunks a stream of arrays into arrays of about ``target_bytes`` each, measured
+    as the in-memory size of the decoded arrays. Small arrays are joined together and
+    large ones are split by rows. Every output array is converted to the canonical
+    version of ``form``, and an empty array is yielded if all inputs are empty so
+    that the output still has a schema.
+    """
+    target = _canonical_form(form)
+    pending, pending_bytes = [], 0
+    empty = True
+    for array in arrays:
+        bytes_per_row = array.nbytes / len(array) if len(array) > 0 else 0
+        start = 0
+        while start < len(array):
+            stop = len(array)
+            if bytes_per_row > 0:
+                rows = int((target_bytes - pending_bytes) / bytes_per_row)
+                stop = min(stop, start + max(1, rows))
+            pending.append(array[start:stop])
+            pending_bytes += (stop - start) * bytes_per_row
+            start = stop
+            if start < len(array) or pending_bytes >= target_bytes:
+                empty = False
+                yield _join(pending, target)
+                pending, pending_bytes = [], 0
+    if pending:
+        yield _join(pending, target)
+    elif empty:
+        yield ak.Array(target.length_zero_array())
+
+
+def _join(arrays, form):
+    if len(arrays) == 1:
+        return conform(arrays[0], form)
+    return conform(ak.concatenate(arrays), form)
+
+
+def unify_forms(forms):
+    """
+    Computes the form that all inputs are converted to, using only the forms read
+    from the Parquet footers. Fields missing from some inputs become optional and
+    numeric types are promoted as in ``ak.concatenate``. Also returns, for each
+    input, the fields that have to be filled with None or promoted.
+    """
+    if all(form == forms[0] for form in forms):
+        return forms[0], [{"filled": [], "promoted": []} for _ in forms]
+    merged = ak.merge_union_of_records(
+        ak.concatenate([form.length_zero_array() for form in forms]),
+        axis=0,
+    )
+    form = _canonical_form(merged.layout.form)
+    changes = []
+    for input_form in forms:
+        filled, promoted = [], []
+        if form.is_record and input_form.is_record:
+            for field in form.fields:
+                if not input_form.has_field(field):
+                    filled.append(field)
+                elif input_form.content(field).type != form.content(field).type:
+                    promoted.append(field)
+        elif input_form.type != form.type:
+            promoted.append("")
+        changes.append({"filled": filled, "promoted": promoted})
+    return form, changes
+
+
+def _canonical_form(form):
+    # Every row group has to be written with identical Awkward metadata, so
+    # options and lists are normalized to a single node type.
+    if form.is_union:
+        msg = f"Parquet files cannot be merged: no common type for {form.type}."
+        raise ValueError(msg)
+    if form.is_option:
+        return ak.forms.IndexedOptionForm(
+            "i64", _canonical_form(form.content), parameters=form.parameters
+        )
+    if form.is_indexed:
+        return _canonical_form(form.content)
+    if form.is_record:
+        return ak.forms.RecordForm(
+            [_canonical_form(content) for content in form.contents],
+            form.fields,
+            parameters=form.parameters,
+        )
+    if form.is_regular:
+        return ak.forms.RegularForm(
+            _canonical_form(form.content), form.size, parameters=form.parameters
+        )
+    if form.is_list:
+        return ak.forms.ListOffsetForm(
+            "i64", _canonical_form(form.content), parameters=form.parameters
+        )
+    return form
+
+
+def conform(array, form):
+    """
+    Converts an array read from one input into ``form`` (from ``unify_forms``).
+    """
+    if array.layout.form == form:
+        return array
+    return ak.Array(_conform_layout(array.layout, form))
+
+
+def _missing(form, length):
+    return ak.contents.IndexedOptionArray(
+        ak.index.Index64(np.full(length, -1, dtype=np.int64)),
+        form.content.length_one_array(),
+        parameters=form.parameters,
+    )
+
+
+def _conform_layout(layout, form):
+    if layout.form == form:
+        return layout
+    if layout.is_indexed and not layout.is_option:
+        layout = layout.project()
+    if form.is_option:
+        if layout.is_option:
+            layout = layout.to_IndexedOptionArray64()
+            index, content = layout.index, layout.content
+        else:
+            index = ak.index.Index64(np.arange(layout.length, dtype=np.int64))
+            content = layout
+        return ak.contents.IndexedOptionArray(
+            index, _conform_layout(content, form.content), parameters=form.parameters
+        )
+    if form.is_record:
+        return ak.contents.RecordArray(
+            [
+                _conform_layout(layout.content(field), form.content(field))
+                if layout.has_field(field)
+                else _missing(form.content(field), layout.length)
+                for field in form.fields
+            ],
+            form.fields,
+            length=layout.length,
+            parameters=form.parameters,
+        )
+    if form.is_regular:
+        return ak.contents.RegularArray(
+            _conform_layout(layout.content, form.content),
+            form.size,
+            zeros_length=layout.length,
+            parameters=form.parameters,
+        )
+    if form.is_list:
+        layout = layout.to_ListOffsetArray64(True)
+        return ak.contents.ListOffsetArray(
+            layout.offsets,
+            _conform_layout(layout.content, form.content),
+            parameters=form.parameters,
+        )
+    if form.is_numpy:
+        if isinstance(layout, ak.contents.EmptyArray):
+            layout = layout.to_NumpyArray(primitive_to_dtype(form.primitive))
+        return ak.contents.NumpyArray(
+            layout.data.astype(primitive_to_dtype(form.primitive)),
+            parameters=form.parameters,
+        )
+    return layout
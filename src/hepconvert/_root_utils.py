@@ -0,0 +1,554 @@
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import os
+import queue
+import struct
+import threading
+
+import awkward as ak
+import fsspec
+import numpy as np
+import uproot
+
+from hepconvert import _utils
+
+_KEY_SMALL = struct.Struct(">ihiIhhii")
+_KEY_BIG = struct.Struct(">ihiIhhqq")
+_SMALL_KEY_LIMIT = 2**31 - 1
+
+# A chunk is held about three times over while it is written: as read, as zipped or
+# converted, and in the writer's big-endian and compressed buffers. This is a fixed
+# heuristic, not a measurement: only the chunk as read is measured (chunk_nbytes), and
+# the copies made after it are taken to be about as large, so a memory budget is met
+# only approximately.
+_MEMORY_OVERHEAD = 3
+
+
+def chunk_nbytes(chunk):
+    """
+    Number of bytes held by a chunk from ``TTree.iterate``, an array or a dict of arrays.
+    """
+    if isinstance(chunk, dict):
+        return sum(getattr(array, "nbytes", 0) for array in chunk.values())
+    return chunk.nbytes
+
+
+def split_unit(file):
+    """
+    Returns ``(path, entry_start, entry_stop, tree)`` for an input that is either a path
+    or a ``(path, entry_start, entry_stop, tree)`` work unit from ``plan_jobs``, whose
+    entries are those of the TTree ``tree``. A unit may also be given as
+    ``(path, entry_start, entry_stop)``, in which case ``tree`` is None. The entries and
+    ``tree`` are None for a path.
+    """
+    if isinstance(file, (tuple, list)) and len(file) == 4:
+        return tuple(file)
+    if isinstance(file, (tuple, list)) and len(file) == 3:
+        return (*file, None)
+    return file, None, None, None
+
+
+def unit_ranges(path, trees, entry_start, entry_stop, unit_tree):
+    """
+    Returns a dict from each of ``trees`` that a work unit (from split_unit) reads to its
+    ``(entry_start, entry_stop)``. The range applies only to ``unit_tree``, the TTree the
+    unit was planned for; the other TTrees are read whole, and only by the unit that
+    starts at entry 0 of its file, like the histograms; the other units read none of
+    their entries. A unit that does not name its TTree may only cover a file with one.
+    """
+    if entry_start is None and entry_stop is None:
+        return dict.fromkeys(trees, (None, None))
+    if unit_tree is None:
+        if len(trees) > 1:
+            msg = f"The work unit ({path}, {entry_start}, {entry_stop}) does not name which of the TTrees {trees} its entries belong to; give it as (file, entry_start, entry_stop, tree)."
+            raise ValueError(msg)
+        unit_tree = trees[0] if trees else None
+    return {
+        t: (entry_start, entry_stop)
+        if t == unit_tree
+        else (None, None)
+        if not entry_start
+        else (0, 0)
+        for t in trees
+    }
+
+
+def whole_file(tree, entry_start, entry_stop):
+    """
+    True if the range from ``entry_start`` to ``entry_stop`` (from split_unit) covers
+    all of ``tree``.
+    """
+    return not entry_start and (entry_stop is None or entry_stop >= tree.num_entries)
+
+
+def iterate(
+    tree, step_size, memory_budget=None, entry_start=None, entry_stop=None, **options
+):
+    """
+    Iterates over ``tree`` like ``tree.iterate(step_size=step_size, **options)``, from
+    ``entry_start`` to ``entry_stop`` if they are not None. If
+    ``memory_budget`` is given, the number of entries in each step is set again after
+    every chunk, so that the larger of the chunk's measured size and uproot's estimate
+    of what it reads, times _MEMORY_OVERHEAD, stays within the budget. An empty range,
+    such as a work unit gives the TTrees it was not planned for, yields one empty chunk,
+    so that the TTree is still written.
+    """
+    if entry_start is not None and entry_start == entry_stop:
+        yield tree.arrays(entry_start=entry_start, entry_stop=entry_stop, **options)
+        return
+    step_size = _utils.parse_step_size(step_size)
+    if memory_budget is None:
+        yield from tree.iterate(
+            step_size=step_size,
+            entry_start=entry_start,
+            entry_stop=entry_stop,
+            **options,
+        )
+        return
+    target = max(_utils.parse_memory_size(memory_budget) // _MEMORY_OVERHEAD, 1)
+    estimate_options = {
+        "expressions": options.get("expressions"),
+        "cut": options.get("cut"),
+    }
+    if options.get("filter_name") is not None:
+        estimate_options["filter_name"] = options["filter_name"]
+    estimated = max(tree.num_entries_for(target, **estimate_options), 1)
+    if isinstance(step_size, str):
+        step_size = tree.num_entries_for(step_size, **estimate_options)
+    num_entries = max(min(step_size, estimated), 1)
+
+    start = entry_start or 0
+    end = tree.num_entries if entry_stop is None else min(entry_stop, tree.num_entries)
+    while start < end:
+        stop = min(start + num_entries, end)
+        chunk = tree.arrays(entry_start=start, entry_stop=stop, **options)
+        yield chunk
+        per_entry = max(chunk_nbytes(chunk) / (stop - start), target / estimated)
+        num_entries = max(int(target / per_entry), 1)
+        start = stop
+
+
+def basket_capacity(tree, num_entries, step_size, basket_size=None, minimum=10):
+    """
+    Number of TBasket slots to reserve in an output TTree that will receive about
+    ``num_entries`` entries like those of ``tree``, read in steps of ``step_size`` and
+    buffered up to ``basket_size`` bytes per branch, so that its metadata does not have
+    to be rewritten. Never less than ``minimum``.
+    """
+    if not num_entries or not tree.num_entries:
+        return minimum
+    if isinstance(step_size, str):
+        step_size = tree.num_entries_for(step_size)
+    per_basket = max(step_size, 1)
+    if basket_size is not None:
+        per_entry = max(
+            (branch.uncompressed_bytes / tree.num_entries for branch in tree.branches),
+            default=0,
+        )
+        if per_entry > 0:
+            per_basket = max(per_basket, int(basket_size / per_entry))
+    return max(minimum, -(-num_entries // per_basket) + 1)
+
+
+class WriteBuffer:
+    """
+    Collects the ``how=dict`` chunks written to each output TTree and passes them on to
+    ``write(tree name, chunk)`` as one chunk once any branch of the tree holds
+    ``basket_size`` bytes, so that small chunks (such as those left by a selective cut)
+    do not each become a TBasket. If ``basket_size`` is None, chunks are written as
+    they come.
+    """
+
+    def __init__(self, write, basket_size=None):
+        self._write = write
+        self._basket_size = basket_size
+        self._chunks = collections.defaultdict(list)
+        self._nbytes = collections.defaultdict(collections.Counter)
+
+    def add(self, name, chunk):
+        if self._basket_size is None:
+            self._write(name, chunk)
+            return
+        self._chunks[name].append(chunk)
+        nbytes = self._nbytes[name]
+        for key, array in chunk.items():
+            nbytes[key] += array.nbytes
+        if max(nbytes.values(), default=0) >= self._basket_size:
+            self.flush(name)
+
+    def num_entries(self, name):
+        return sum(len(next(iter(chunk.values()), ())) for chunk in self._chunks[name])
+
+    def nbytes(self):
+        return sum(sum(nbytes.values()) for nbytes in self._nbytes.values())
+
+    def flush(self, name=None):
+        for key in [name] if name is not None else list(self._chunks):
+            chunks = self._chunks.pop(key, [])
+            self._nbytes.pop(key, None)
+            if len(chunks) == 1:
+                self._write(key, chunks[0])
+            elif len(chunks) > 1:
+                self._write(
+                    key,
+                    {
+                        branch: _concatenate([chunk[branch] for chunk in chunks])
+                        for branch in chunks[0]
+                    },
+                )
+
+
+def _concatenate(arrays):
+    if all(isinstance(array, np.ndarray) for array in arrays):
+        return np.concatenate(arrays)
+    return ak.concatenate(arrays)
+
+
+def file_size(file):
+    """
+    Size of ``file`` in bytes, or None if it does not exist.
+    """
+    fs, path = fsspec.core.url_to_fs(os.fspath(file))
+    try:
+        return fs.size(path)
+    except FileNotFoundError:
+        return None
+
+
+def balanced_subsets(sizes, n, min_count=1):
+    """
+    Splits the indexes of ``sizes`` into up to ``n`` subsets with about the same total
+    size, by assigning the largest first, each to the subset that is smallest so far.
+    Subsets with fewer than ``min_count`` indexes are then joined to the smallest of the
+    others. The indexes in each subset are sorted.
+    """
+    heap = [(0, i) for i in range(n)]
+    subsets = [[] for _ in range(n)]
+    totals = [0] * n
+    for index in sorted(range(len(sizes)), key=lambda i: -(sizes[i] or 0)):
+        total, i = heapq.heappop(heap)
+        subsets[i].append(index)
+        totals[i] = total + (sizes[index] or 0)
+        heapq.heappush(heap, (totals[i], i))
+    order = sorted(range(n), key=lambda i: totals[i])
+    for i in order:
+        if 0 < len(subsets[i]) < min_count:
+            others = [j for j in order if j != i and subsets[j]]
+            if others:
+                j = min(others, key=lambda j: totals[j])
+                subsets[j].extend(subsets[i])
+                totals[j] += totals[i]
+                subsets[i] = []
+    return [sorted(subset) for subset in subsets if subset]
+
+
+def read_ahead_files(tasks, *, depth=None, max_bytes=None, sizeof=None):
+    """
+    Calls each of ``tasks`` (callables without arguments that return an iterator, one per
+    input file) and yields the items of all of them in order. If ``depth`` is set, the
+    current task and up to ``depth`` tasks after it run in background threads, so that
+    the next files are opened and read while the consumer works on the current one. The
+    items waiting for the consumer are limited to ``max_bytes`` in total, as measured by
+    ``sizeof``, except that the current task may always hold one.
+    """
+    if not depth:
+        for task in tasks:
+            yield from task()
+        return
+    pipeline = _Pipeline(max_bytes, sizeof)
+    tasks = enumerate(tasks)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=depth + 1)
+    try:
+        pending = collections.deque(
+            executor.submit(pipeline.produce, index, task)
+            for index, task in itertools.islice(tasks, depth + 1)
+        )
+        while pending:
+            pending.popleft()
+            yield from pipeline.consume()
+            for index, task in itertools.islice(tasks, 1):
+                pending.append(executor.submit(pipeline.produce, index, task))
+    finally:
+        pipeline.close()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _Closed(Exception):
+    pass
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+class _Pipeline:
+    """
+    Per-task queues of items, filled by background threads and drained in task order,
+    with a shared limit on the bytes they hold.
+    """
+
+    def __init__(self, max_bytes, sizeof):
+        self.condition = threading.Condition()
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.queues = collections.defaultdict(collections.deque)
+        self.used = 0
+        self.current = 0
+        self.closed = False
+
+    def produce(self, index, task):
+        try:
+            for item in task():
+                self._put(index, item, self.sizeof(item) if self.sizeof else 0)
+        except _Closed:
+            return
+        except Exception as err:  # noqa: BLE001  # pylint: disable=broad-exception-caught
+            self._put(index, _Failure(err), 0, force=True)
+        self._put(index, _DONE, 0, force=True)
+
+    def _put(self, index, item, nbytes, force=False):
+        with self.condition:
+            self.condition.wait_for(
+                lambda: (
+                    self.closed
+                    or force
+                    or self.max_bytes is None
+                    or self.used + nbytes <= self.max_bytes
+                    or (index == self.current and not self.queues[index])
+                )
+            )
+            if self.closed:
+                raise _Closed
+            self.used += nbytes
+            self.queues[index].append((item, nbytes))
+            self.condition.notify_all()
+
+    def consume(self):
+        while True:
+            with self.condition:
+                queue = self.queues[self.current]
+                self.condition.wait_for(lambda: queue)  # noqa: B023
+                item, nbytes = queue.popleft()
+                self.used -= nbytes
+                if item is _DONE:
+                    del self.queues[self.current]
+                    self.current += 1
+                self.condition.notify_all()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def sync(file):
+    """
+    Flushes a file opened for writing with uproot and, if it is a local file, makes
+    sure that its contents are on disk.
+    """
+    sink = file.file.sink
+    sink.flush()
+    with contextlib.suppress(AttributeError, OSError):
+        os.fsync(sink._file.fileno())  # pylint: disable=protected-access
+
+
+def tree_layout(tree):
+    """
+    Maps each branch of the output ``tree`` (a WritableTree) to its dtype, inner shape
+    and counter branch, in the terms that can_copy_baskets compares. Returns None if
+    this version of uproot does not expose what copy_baskets needs.
+    """
+    cascading = getattr(tree, "_cascading", None)
+    if not hasattr(cascading, "_relocate"):
+        return None
+    return {
+        datum["fName"]: (
+            datum["dtype"],
+            tuple(datum["shape"]),
+            None if datum["counter"] is None else datum["counter"]["fName"],
+        )
+        for datum in cascading._branch_data  # pylint: disable=protected-access
+        if datum["kind"] != "record"
+    }
+
+
+def can_copy_baskets(tree, layout, compression):
+    """
+    Returns True if the compressed TBaskets of the input ``tree`` can be copied without
+    change into an output tree with ``layout`` (from tree_layout): the file has the
+    same ``compression``, the branches have the same names, types and counters, none
+    of them is split or has baskets embedded in its metadata, and all of them have
+    their basket boundaries at the same entries.
+    """
+    if getattr(tree.file.compression, "code", 0) != getattr(compression, "code", 0):
+        return False
+    found = {}
+    entry_offsets = None
+    for branch in tree.branches:
+        if (
+            branch.branches
+            or len(branch.member("fLeaves")) != 1
+            or branch.embedded_baskets
+        ):
+            return False
+        interpretation = branch.interpretation
+        counter = None
+        if (
+            isinstance(interpretation, uproot.interpretation.jagged.AsJagged)
+            and interpretation.header_bytes == 0
+        ):
+            counter = branch.count_branch.name
+            interpretation = interpretation.content
+        if type(interpretation) is not uproot.interpretation.numerical.AsDtype:
+            return False
+        found[branch.name] = (
+            interpretation.from_dtype.base,
+            interpretation.inner_shape,
+            counter,
+        )
+        if entry_offsets is None:
+            entry_offsets = branch.entry_offsets
+        elif branch.entry_offsets != entry_offsets:
+            return False
+    return found == layout
+
+
+def read_baskets(tree):
+    """
+    Reads the compressed TBaskets of every branch of ``tree`` (which passed
+    can_copy_baskets) without decompressing them. Returns the number of entries in
+    each basket, a dict of branch name to the raw bytes of its baskets, and a dict
+    of counter branch name to the largest count it holds.
+    """
+    names = []
+    ranges = []
+    maxima = {}
+    for branch in tree.branches:
+        seeks = branch.member("fBasketSeek")[: branch.num_baskets]
+        sizes = branch.member("fBasketBytes")[: branch.num_baskets]
+        names.extend([branch.name] * branch.num_baskets)
+        ranges.extend(
+            (int(seek), int(seek) + int(size)) for seek, size in zip(seeks, sizes)
+        )
+        if branch.count_branch is not None:
+            counter = branch.count_branch
+            maxima[counter.name] = int(counter.member("fLeaves")[0].member("fMaximum"))
+    baskets = {branch.name: [] for branch in tree.branches}
+    for name, chunk in zip(
+        names, tree.file.source.chunks(ranges, notifications=queue.Queue())
+    ):
+        chunk.wait()
+        baskets[name].append(chunk.raw_data.tobytes())
+    entries = np.diff(tree.branches[0].entry_offsets) if tree.branches else []
+    return [int(n) for n in entries], baskets, maxima
+
+
+def copy_baskets(tree, entries, baskets, maxima):
+    """
+    Appends TBaskets from read_baskets to the output ``tree`` (a WritableTree) as they
+    are, rewriting only their key headers and the basket tables of the branches.
+    Returns False, having written nothing, if baskets with 32-bit key headers would
+    land beyond 2 GiB in the output.
+    """
+    cascading = tree._cascading  # pylint: disable=protected-access
+    file = tree._file  # pylint: disable=protected-access
+    sink = file.sink
+    freesegments = cascading.freesegments
+    total = sum(len(raw) for raws in baskets.values() for raw in raws)
+    small = any(
+        _KEY_SMALL.unpack_from(raw)[1] <= 1000
+        for raws in baskets.values()
+        for raw in raws
+    )
+    if small and freesegments.fileheader.end + total > _SMALL_KEY_LIMIT:
+        return False
+
+    parent_location = cascading.directory.key.location
+    for i, num_entries in enumerate(entries):
+        _reserve_basket(cascading, file, sink)
+        uncompressed_bytes = 0
+        compressed_bytes = 0
+        for datum in cascading._branch_data:  # pylint: disable=protected-access
+            if datum["kind"] == "record":
+                continue
+            raw = baskets[datum["fName"]][i]
+            location = freesegments.allocate(len(raw), dry_run=False)
+            sink.write(location, _relocate_key(raw, location, parent_location))
+            fNbytes, _, fObjlen, _, fKeylen = _KEY_SMALL.unpack_from(raw)[:5]
+            uncompressed_bytes += fKeylen + fObjlen
+            compressed_bytes += fNbytes
+
+            datum["fTotBytes"] += fKeylen + fObjlen
+            datum["fZipBytes"] += fNbytes
+            n = cascading._num_baskets  # pylint: disable=protected-access
+            datum["fBasketBytes"][n] = fNbytes
+            datum["fBasketEntry"][n + 1] = datum["fBasketEntry"][n] + num_entries
+            datum["fBasketSeek"][n] = location
+            datum["arrays_write_stop"] = n + 1
+            if datum["fName"] in maxima:
+                datum["tleaf_maximum_value"] = max(
+                    datum["tleaf_maximum_value"], maxima[datum["fName"]]
+                )
+        cascading._num_entries += num_entries  # pylint: disable=protected-access
+        cascading._num_baskets += 1  # pylint: disable=protected-access
+        cascading._metadata["fTotBytes"] += uncompressed_bytes  # pylint: disable=protected-access
+        cascading._metadata["fZipBytes"] += compressed_bytes  # pylint: disable=protected-access
+
+    freesegments.write(sink)
+    sink.set_file_length(freesegments.fileheader.end)
+    cascading.write_updates(sink)
+    return True
+
+
+def _relocate_key(raw, location, parent_location):
+    """
+    Returns the TBasket ``raw`` with the seek fields of its key header pointing at
+    ``location`` and the directory at ``parent_location``.
+    """
+    header = _KEY_SMALL.unpack_from(raw)
+    if header[1] > 1000:
+        key_format = _KEY_BIG
+        header = _KEY_BIG.unpack_from(raw)
+    else:
+        key_format = _KEY_SMALL
+    return (
+        key_format.pack(*header[:6], location, parent_location) + raw[key_format.size :]
+    )
+
+
+def _reserve_basket(cascading, file, sink):
+    """
+    Makes room for one more basket in the basket tables of ``cascading``, growing them
+    by its resize factor as ``uproot.WritableTree.extend`` does.
+    """
+    # pylint: disable=protected-access
+    if cascading._num_baskets < cascading._basket_capacity - 1:
+        return
+    cascading._basket_capacity = max(
+        cascading._basket_capacity + 1,
+        int(np.ceil(cascading._basket_capacity * cascading._resize_factor)),
+    )
+    for datum in cascading._branch_data:
+        if datum["kind"] == "record":
+            continue
+        old_capacity = len(datum["fBasketEntry"])
+        for name in ("fBasketBytes", "fBasketEntry", "fBasketSeek"):
+            resized = np.zeros(cascading._basket_capacity, datum[name].dtype)
+            resized[:old_capacity] = datum[name]
+            datum[name] = resized
+        datum["fBasketEntry"][old_capacity] = cascading._num_entries
+    cascading._relocate(file, sink)
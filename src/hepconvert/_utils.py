@@ -1,5 +1,11 @@
 from __future__ import annotations
 
+import functools
+import hashlib
+import re
+from pathlib import Path
+
+import awkward as ak
 import numpy as np
 
 
@@ -35,6 +41,20 @@ def group_branches(tree, keep_branches):
     return groups, count_branches
 
 
+def zip_groups(chunk, groups, fieldname_separator):
+    """
+    Replaces each group of jagged branches (from group_branches) in a ``how=dict``
+    chunk with one ``ak.zip`` of them, so that they share one counter when written.
+    """
+    for group in groups:
+        if len(group) > 1:
+            idx = group[0].index(fieldname_separator)
+            chunk[group[0][0:idx]] = ak.zip(
+                {name[idx + 1 :]: chunk.pop(name) for name in group if name in chunk}
+            )
+    return chunk
+
+
 def get_counter_branches(tree):
     """
     Gets counter branches to remove them in merge etc.
@@ -96,3 +116,70 @@ def check_tqdm():
                     conda install conda-forge::tqdm"""
         raise ModuleNotFoundError(msg) from err
     return tqdm
+
+
+_memory_units = {
+    "": 1,
+    "b": 1,
+    "kb": 1000,
+    "mb": 1000**2,
+    "gb": 1000**3,
+    "tb": 1000**4,
+    "kib": 1024,
+    "mib": 1024**2,
+    "gib": 1024**3,
+    "tib": 1024**4,
+}
+
+
+def parse_memory_size(size):
+    """
+    Converts a memory size such as ``"128 MB"`` or ``"1 GiB"`` to a number of bytes.
+    Integers are taken to be a number of bytes already.
+    """
+    if isinstance(size, (int, np.integer)):
+        return int(size)
+    match = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]*)\s*", str(size))
+    if match is None or match.group(2).lower() not in _memory_units:
+        msg = f"Memory size must be an integer number of bytes or a string such as '100 MB', not {size!r}."
+        raise ValueError(msg)
+    return int(float(match.group(1)) * _memory_units[match.group(2).lower()])
+
+
+def parse_step_size(step_size):
+    """
+    Returns ``step_size`` as an int if it is a number of entries, or as a str if it is
+    a memory size such as ``"100 MB"``, for ``TTree.iterate``.
+    """
+    if isinstance(step_size, (int, np.integer)) or str(step_size).strip().isdigit():
+        return int(step_size)
+    parse_memory_size(step_size)
+    return str(step_size)
+
+
+def file_hash(path, like=None):
+    """
+    Hashes the contents of a file, as ``"<algorithm>:<hex digest>"``, with xxh3_64 if the
+    ``xxhash`` package is installed and BLAKE2b otherwise, or with the algorithm of the
+    hash ``like`` that it is to be compared with.
+    """
+    algorithm = like.split(":")[0] if like else None
+    xxhash = None
+    if algorithm != "blake2b":
+        try:
+            import xxhash  # pylint: disable=import-outside-toplevel
+        except ModuleNotFoundError as err:
+            if algorithm == "xxh3_64":
+                msg = """to compare with an xxh3_64 hash, install the 'xxhash' package with:
+                    pip install xxhash
+                            or
+                    conda install conda-forge::python-xxhash"""
+                raise ModuleNotFoundError(msg) from err
+    if xxhash is not None:
+        algorithm, hasher = "xxh3_64", xxhash.xxh3_64()
+    else:
+        algorithm, hasher = "blake2b", hashlib.blake2b()
+    with Path(path).open("rb") as file:
+        for block in iter(functools.partial(file.read, 2**20), b""):
+            hasher.update(block)
+    return f"{algorithm}:{hasher.hexdigest()}"
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+
+import uproot
+
+from hepconvert.histogram_adding import _accumulate, _accumulator, _from_accumulator
+
+_CHAIN_KEY = "hepconvert_chain"
+
+
+def iterate_chain(
+    index,
+    tree=None,
+    *,
+    entry_start=None,
+    entry_stop=None,
+    step_size="100 MB",
+    **options,
+):
+    """Iterates over the TTree ``tree`` of all the files listed in a virtual chain index, as if
+    they were one TTree. The index is written by ``merge_root`` with ``virtual=True``; files are
+    only opened when the iteration reaches them.
+
+    :param index: Name of the index file or file path.
+    :type index: path-like
+    :param tree: Name of the TTree to iterate over. May be None if the chain has only one.
+    :type tree: None or str, optional
+    :param entry_start: First entry of the chain to include, counting from the first entry of the
+        first file. If None, starts at the beginning.
+    :type entry_start: None or int, optional
+    :param entry_stop: Entry of the chain at which to stop (exclusive). If None, stops at the end.
+    :type entry_stop: None or int, optional
+    :param step_size: If an integer, the maximum number of entries to include in each iteration
+        step; if a string, the maximum memory size to include. The string must be a number
+        followed by a memory unit, such as “100 MB”. Steps do not cross file boundaries.
+    :type step_size: int or str, optional
+    :param options: Other arguments of ``uproot.TTree.iterate``, such as ``filter_name``,
+        ``expressions``, ``cut`` or ``how``.
+
+    Example:
+    --------
+        >>> hepconvert.merge_root("chain.root", ["file1.root", "file2.root"], virtual=True)
+        >>> for chunk in hepconvert.iterate_chain("chain.root", "events", step_size=1000):
+        ...     print(len(chunk))
+    """
+    records = _read_chain(index)
+    trees = list(dict.fromkeys(record["tree"] for record in records))
+    if tree is None:
+        if len(trees) != 1:
+            msg = f"The chain has TTrees {trees}; specify one with tree=."
+            raise ValueError(msg)
+        tree = trees[0]
+    elif tree not in trees:
+        msg = f"TTree {tree!r} is not in the chain, which has TTrees {trees}."
+        raise ValueError(msg)
+    records = [record for record in records if record["tree"] == tree]
+    total = sum(record["entries"] for record in records)
+    entry_start = 0 if entry_start is None else min(max(entry_start, 0), total)
+    entry_stop = total if entry_stop is None else min(max(entry_stop, 0), total)
+
+    for record in records:
+        start = max(entry_start - record["offset"], 0)
+        stop = min(entry_stop - record["offset"], record["entries"])
+        if start >= stop:
+            continue
+        with uproot.open(record["path"]) as file:
+            if file[tree].num_entries != record["entries"]:
+                msg = f"File {record['path']} has changed since the chain index {index} was written."
+                raise ValueError(msg)
+            yield from file[tree].iterate(
+                step_size=step_size, entry_start=start, entry_stop=stop, **options
+            )
+
+
+def plan_jobs(files, n_jobs, *, tree=None, by="entries"):
+    """Splits the entries of the TTree ``tree`` in ``files`` into ``n_jobs`` jobs of about the same
+    size, as if the files were one TTree, so that whole files do not leave a long tail of slow
+    jobs. Only the TTree metadata of each file is read.
+
+    Each job is a list of ``(file, entry_start, entry_stop, tree)`` work units, which
+    ``merge_root`` takes in its list of files, and ``copy_root`` and ``root_to_parquet`` take as
+    ``in_file``. The entries are those of ``tree`` only. Histograms and any other TTrees are only
+    added whole from the unit that starts at entry 0 of its file, so that the outputs of the jobs
+    can be merged without counting them twice.
+
+    :param files: List of local ROOT files, in order, or a directory to search for them.
+    :type files: str or list of str
+    :param n_jobs: Number of jobs. Some are empty if there are fewer entries than jobs.
+    :type n_jobs: int
+    :param tree: Name of the TTree to split. May be None if the files have only one.
+    :type tree: None or str, optional
+    :param by: "entries" to give each job the same number of entries, or "bytes" to give each
+        job the same compressed size, taking the entries of a file to be the same size.
+    :type by: str, optional
+
+    Example:
+    --------
+        >>> jobs = hepconvert.plan_jobs(["file1.root", "file2.root"], 10)
+        >>> hepconvert.merge_root("job0.root", jobs[0])
+    """
+    if n_jobs < 1:
+        msg = f"n_jobs must be at least 1, not {n_jobs}."
+        raise ValueError(msg)
+    if by not in ("entries", "bytes"):
+        msg = f"by must be 'entries' or 'bytes', not {by!r}."
+        raise ValueError(msg)
+    if not isinstance(files, list) and not isinstance(files, tuple):
+        files = sorted(Path(files).glob("**/*.root"))
+
+    sizes = []
+    for file in files:
+        with uproot.open(file) as f:
+            name = tree
+            if name is None:
+                trees = f.keys(filter_classname="TTree", cycle=False, recursive=False)
+                if len(trees) != 1:
+                    msg = f"{file} has TTrees {trees}; specify one with tree=."
+                    raise ValueError(msg)
+                name = trees[0]
+            num_entries = f[name].num_entries
+            if num_entries > 0:
+                weight = num_entries if by == "entries" else f[name].member("fZipBytes")
+                sizes.append((file, name, num_entries, max(weight, 1)))
+
+    total = sum(weight for _, _, _, weight in sizes)
+    bounds = [total * (i + 1) / n_jobs for i in range(n_jobs)]
+    jobs = [[] for _ in range(n_jobs)]
+    job = 0
+    done = 0.0
+    for file, name, num_entries, weight in sizes:
+        per_entry = weight / num_entries
+        start = 0
+        while start < num_entries:
+            while job < n_jobs - 1 and done + per_entry / 2 >= bounds[job]:
+                job += 1
+            if job == n_jobs - 1:
+                stop = num_entries
+            else:
+                stop = start + max(round((bounds[job] - done) / per_entry), 1)
+                stop = min(stop, num_entries)
+            jobs[job].append((file, start, stop, name))
+            done += (stop - start) * per_entry
+            start = stop
+    return jobs
+
+
+def _write_chain(destination, files, *, keep_trees, drop_trees, skip_bad_files):
+    """Supporting function for merge_root.
+
+    Writes a virtual chain index of ``files``: a TObjString of the JSON list of each input's
+    absolute path, TTree name, number of entries, offset of its first entry in the chain and
+    fingerprint of its branch names and types, along with the sums of the histograms. Only the
+    metadata of the TTrees is read.
+    """
+    records = []
+    offsets = {}
+    fingerprints = {}
+    hists = {}
+    trees = None
+    for name in files:
+        try:
+            file = uproot.open(name)
+        except FileNotFoundError:
+            if skip_bad_files:
+                continue
+            msg = f"File: {name} does not exist or is corrupt."
+            raise FileNotFoundError(msg) from None
+        with file:
+            if trees is None:
+                trees = _chain_trees(file, keep_trees, drop_trees)
+            for t in trees:
+                fingerprint = _fingerprint(file[t])
+                if fingerprints.setdefault(t, fingerprint) != fingerprint:
+                    msg = f"TTree {t} in {name} does not have the same branches and types as in the other files, so they cannot be chained."
+                    raise ValueError(msg)
+                records.append(
+                    {
+                        "path": str(Path(name).resolve()),
+                        "tree": t,
+                        "entries": file[t].num_entries,
+                        "offset": offsets.get(t, 0),
+                        "fingerprint": fingerprint,
+                    }
+                )
+                offsets[t] = offsets.get(t, 0) + file[t].num_entries
+            for key in file.keys(
+                filter_classname=["TH*", "TProfile"], cycle=False, recursive=False
+            ):
+                hists[key] = _accumulate(hists.get(key), _accumulator(file[key]))
+
+    with uproot.recreate(destination) as out_file:
+        out_file[_CHAIN_KEY] = json.dumps({"inputs": records})
+        for key, summed in hists.items():
+            out_file[key] = _from_accumulator(summed)
+
+
+def _read_chain(index):
+    """
+    Reads the list of inputs in a virtual chain index written by merge_root.
+    """
+    with uproot.open(index) as file:
+        if _CHAIN_KEY not in file:
+            msg = f"{index} is not a chain index written by merge_root(virtual=True)."
+            raise ValueError(msg)
+        return json.loads(str(file[_CHAIN_KEY]))["inputs"]
+
+
+def _chain_trees(file, keep_trees, drop_trees):
+    """
+    Names of the TTrees of ``file`` to chain, given merge_root's keep_trees and drop_trees.
+    """
+    if drop_trees and keep_trees:
+        msg = "Can specify either drop_trees or keep_trees, not both."
+        raise ValueError(msg) from None
+    trees = file.keys(filter_classname="TTree", cycle=False, recursive=False)
+    if not keep_trees and not drop_trees:
+        return trees
+    selected = file.keys(
+        filter_name=keep_trees or drop_trees,
+        filter_classname="TTree",
+        cycle=False,
+        recursive=False,
+    )
+    if not selected:
+        msg = f"{keep_trees or drop_trees} does not match any TTree in ROOT file {file.file_path}"
+        raise ValueError(msg)
+    if keep_trees:
+        return selected
+    return [t for t in trees if t not in selected]
+
+
+def _fingerprint(tree):
+    """
+    Short hash of the names and types of the branches of ``tree``.
+    """
+    typenames = sorted(tree.typenames(recursive=True).items())
+    return hashlib.sha256(json.dumps(typenames).encode()).hexdigest()[:16]
@@ -2,10 +2,9 @@ from __future__ import annotations
 
 from pathlib import Path
 
-import awkward as ak
 import uproot
 
-from hepconvert import _utils
+from hepconvert import _root_utils, _utils
 from hepconvert._utils import filter_branches, get_counter_branches, group_branches
 from hepconvert.histogram_adding import _hadd_1d, _hadd_2d, _hadd_3d
 
@@ -32,14 +31,17 @@ def copy_root(
     resize_factor=10.0,
     counter_name=lambda counted: "n" + counted,
     step_size="100 MB",
+    memory_budget=None,
+    basket_size=None,
     compression="ZLIB",
     compression_level=1,
 ):
     """
     :param out_file: Name of the output file or file path.
     :type out_file: path-like
-    :param in_file: Local ROOT file to copy.
-    :type in_file: str
+    :param in_file: Local ROOT file to copy, or a ``(file, entry_start, entry_stop, tree)`` work unit from
+        ``hepconvert.plan_jobs`` to copy only those entries of ``tree`` (and the histograms and other TTrees only if ``entry_start`` is 0).
+    :type in_file: str or (str, int, int, str)
     :param keep_branches: To keep only certain branches and remove all others. To remove certain branches from all TTrees in the file,
         pass a list of names of branches to keep, wildcarding accepted ("Jet_*"). If removing branches from one of multiple trees, pass a dict of structure: {tree: [branch1, branch2]}
         to keep only branch1 and branch2 in ttree "tree". Defaults to None. Command line option: ``--keep-branches``.
@@ -90,6 +92,16 @@ def copy_root(
         a string, the maximum memory size to include. The string must be a number followed by a memory unit, such as “100 MB”.
         Defaults to \100. Command line option: ``--step-size``.
     :type step_size: int or str, optional
+    :param memory_budget: If not None, the memory (a number of bytes or a string such as "500 MB") that
+        each chunk may take while it is read, zipped and written; the number of entries per step is set
+        again from the size of the last chunk, taken to be held about three times over while it is written (a
+        fixed heuristic, so the budget is approximate). Defaults to None. Command line option: ``--memory-budget``.
+    :type memory_budget: None, int, or str, optional
+    :param basket_size: If not None, chunks are collected until one of the branches holds this many
+        (uncompressed) bytes, such as "1 MB", and then written at once, so that small chunks, for instance
+        those left by a selective ``cut``, do not each become a TBasket. ``initial_basket_capacity`` is raised
+        to the number of TBaskets expected from the entries of the input. Defaults to None. Command line option: ``--basket-size``.
+    :type basket_size: None, int, or str, optional
     :param compression: Sets compression level for root file to write to. Can be one of "ZLIB", "LZMA", "LZ4", or "ZSTD".
         Defaults to "ZLIB". Command line option: ``--compression``.
     :type compression: str
@@ -137,7 +149,6 @@ def copy_root(
                 compression_code, compression_level
             ),
         )
-        first = (True,)
     else:
         of = uproot.recreate(
             out_file,
@@ -145,21 +156,23 @@ def copy_root(
                 compression_code, compression_level
             ),
         )
-        first = (True,)
 
-    try:  # is this legal?
-        step_size = int(step_size)
-    except ValueError:
-        step_size = str(step_size)
+    step_size = _utils.parse_step_size(step_size)
+    if basket_size is not None:
+        basket_size = _utils.parse_memory_size(basket_size)
 
+    in_file, entry_start, entry_stop, unit_tree = _root_utils.split_unit(in_file)
     try:
         f = uproot.open(in_file)
     except FileNotFoundError:
         msg = "file: ", in_file, " does not exist or is corrupt."
         raise FileNotFoundError(msg) from None
 
-    hist_keys = f.keys(
-        filter_classname=["TH*", "TProfile"], cycle=False, recursive=False
+    # Histograms of a file split into work units are copied with its first unit.
+    hist_keys = (
+        []
+        if entry_start
+        else f.keys(filter_classname=["TH*", "TProfile"], cycle=False, recursive=False)
     )
 
     for key in hist_keys:  # just pass to hadd??
@@ -227,60 +240,46 @@ def copy_root(
             tqdm = _utils.check_tqdm()
             progress_bar = tqdm.tqdm(desc="Trees copied")
             progress_bar.reset(total=number_of_items)
+    ranges = _root_utils.unit_ranges(in_file, trees, entry_start, entry_stop, unit_tree)
     for t in trees:  # pylint: disable=too-many-nested-blocks
         tree = f[t]
         count_branches = get_counter_branches(tree)
         kb = filter_branches(tree, keep_branches, drop_branches, count_branches)
         groups, count_branches = group_branches(tree, kb)
-        first = True
-        for chunk in tree.iterate(
-            step_size=step_size,
-            how=dict,
-            filter_name=lambda b: b in kb,
-            expressions=expressions,
-            cut=cut,
-        ):
-            for group in groups:
-                if (len(group)) > 1:
-                    chunk.update(
-                        {
-                            group[0][0 : (group[0].index(fieldname_separator))]: ak.zip(
-                                {
-                                    name[
-                                        group[0].index(fieldname_separator) + 1 :
-                                    ]: array
-                                    for name, array in zip(
-                                        ak.fields(chunk), ak.unzip(chunk)
-                                    )
-                                    if name in group
-                                }
-                            )
-                        }
-                    )
-                    for key in group:
-                        if key in kb:
-                            del chunk[key]
-            if first:
-                first = False
-                branch_types = {name: array.type for name, array in chunk.items()}
+        capacity = _root_utils.basket_capacity(
+            tree, tree.num_entries, step_size, basket_size, initial_basket_capacity
+        )
+
+        def write(name, chunk, capacity=capacity):
+            if name not in of:
                 of.mktree(
-                    tree.name,
-                    branch_types,
+                    name,
+                    {key: array.type for key, array in chunk.items()},
                     title=title,
                     counter_name=counter_name,
                     field_name=field_name,
-                    initial_basket_capacity=initial_basket_capacity,
+                    initial_basket_capacity=capacity,
                     resize_factor=resize_factor,
                 )
-                try:
-                    of[tree.name].extend(chunk)
-                except AssertionError:
-                    msg = "Are the branch-names correct?"
-            else:
-                try:
-                    of[tree.name].extend(chunk)
-                except AssertionError:
-                    msg = "Are the branch-names correct?"
+            try:
+                of[name].extend(chunk)
+            except AssertionError:
+                msg = "Are the branch-names correct?"
+                raise ValueError(msg) from None
+
+        buffer = _root_utils.WriteBuffer(write, basket_size)
+        for chunk in _root_utils.iterate(
+            tree,
+            step_size,
+            memory_budget,
+            *ranges[t],
+            how=dict,
+            filter_name=lambda b: b in kb,
+            expressions=expressions,
+            cut=cut,
+        ):
+            buffer.add(tree.name, _utils.zip_groups(chunk, groups, fieldname_separator))
+        buffer.flush()
         if len(trees) > 1 and progress_bar is not False and progress_bar is not None:
             progress_bar.update(n=1)
     f.close()
@@ -342,6 +342,113 @@ def _hadd_3d(summed_hists, file, key, first, *, n_key=None):
     ) from None
 
 
+_STATS = {
+    1: ("fEntries", "fTsumw", "fTsumw2", "fTsumwx", "fTsumwx2"),
+    2: (
+        "fEntries",
+        "fTsumw",
+        "fTsumw2",
+        "fTsumwx",
+        "fTsumwx2",
+        "fTsumwy",
+        "fTsumwy2",
+        "fTsumwxy",
+    ),
+    3: (
+        "fEntries",
+        "fTsumw",
+        "fTsumw2",
+        "fTsumwx",
+        "fTsumwx2",
+        "fTsumwy",
+        "fTsumwy2",
+        "fTsumwxy",
+        "fTsumwz",
+        "fTsumwz2",
+        "fTsumwxz",
+        "fTsumwyz",
+    ),
+}
+
+
+def _accumulator(hist):
+    """Supporting function for merge_root.
+
+    Copies the contents, variances (both with flow bins, flattened in ROOT's bin order),
+    statistics and binning of a histogram into NumPy arrays, so that histograms can be
+    summed with _accumulate and serialized once with _from_accumulator.
+
+    :param hist: Histogram read from a ROOT file.
+    :type hist: uproot TH1, TH2, or TH3
+    """
+    axes = "xyz"[: len(hist.axes)]
+    return {
+        "name": hist.member("fName"),
+        "title": hist.member("fTitle"),
+        "axes": [
+            (
+                hist.member(f"f{axis.upper()}axis").member("fNbins"),
+                hist.axis(axis=axis).low,
+                hist.axis(axis=axis).high,
+            )
+            for axis in axes
+        ],
+        "values": np.ravel(hist.values(flow=True), order="F").astype(np.float64),
+        "variances": np.ravel(hist.variances(flow=True), order="F").astype(np.float64),
+        "stats": np.array(
+            [hist.member(name) for name in _STATS[len(axes)]], dtype=np.float64
+        ),
+    }
+
+
+def _accumulate(summed, other):
+    """Supporting function for merge_root.
+
+    Adds the accumulator ``other`` into ``summed`` in place and returns ``summed``.
+
+    :param summed: Accumulator from _accumulator, or None to start from ``other``.
+    :type summed: dict or None
+    :param other: Accumulator from _accumulator.
+    :type other: dict
+    """
+    if summed is None:
+        return other
+    if summed["axes"] != other["axes"]:
+        msg = f"Bins must be the same for histograms to be added, not {summed['axes']} and {other['axes']}"
+        raise ValueError(msg)
+    summed["values"] += other["values"]
+    summed["variances"] += other["variances"]
+    summed["stats"] += other["stats"]
+    return summed
+
+
+def _from_accumulator(summed):
+    """Supporting function for merge_root.
+
+    Builds the histogram to write from an accumulator.
+
+    :param summed: Accumulator from _accumulator.
+    :type summed: dict
+    """
+    axes = [
+        uproot.writing.identify.to_TAxis(f"f{name}axis", "", nbins, low, high)
+        for name, (nbins, low, high) in zip("XYZ", summed["axes"])
+    ]
+    to_histogram = (
+        uproot.writing.identify.to_TH1x,
+        uproot.writing.identify.to_TH2x,
+        uproot.writing.identify.to_TH3x,
+    )[len(axes) - 1]
+    return to_histogram(
+        summed["name"],
+        summed["title"],
+        summed["values"],
+        *summed["stats"],
+        summed["variances"],
+        *axes,
+    )
+
+
 def add_histograms(
     destination,
     files,
@@ -1,17 +1,27 @@
 from __future__ import annotations
 
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import itertools
+import json
+import os
+import tempfile
 from pathlib import Path
 
 import awkward as ak
+import numpy as np
 import uproot
 
-from hepconvert import _utils
+from hepconvert import _parquet_utils, _root_utils, _utils
 from hepconvert._utils import (
     filter_branches,
     get_counter_branches,
     group_branches,
 )
-from hepconvert.histogram_adding import _hadd_1d, _hadd_2d, _hadd_3d
+from hepconvert.chain import _write_chain
+from hepconvert.histogram_adding import _accumulate, _accumulator, _from_accumulator
 
 
 def merge_parquet(
@@ -43,6 +53,23 @@ def merge_parquet(
     parquet_extra_options=None,
     storage_options=None,
     skip_bad_files=False,
+    fast_copy=False,
+    footer_workers=None,
+    footer_cache=None,
+    decode_workers=None,
+    decode_queue_size=None,
+    sort_by=None,
+    row_group_bytes=None,
+    keep_branches=None,
+    drop_branches=None,
+    cut=None,
+    metadata_only=False,
+    common_metadata=False,
+    prefetch_workers=None,
+    prefetch_depth=None,
+    memory_map=False,
+    dedup_by=None,
+    dedup_memory="1 GB",
 ):
     """Merges Parquet files together.
 
@@ -169,6 +196,81 @@ def merge_parquet(
             `fsspec.core.url_to_fs <https://filesystem-spec.readthedocs.io/en/latest/api.html#fsspec.core.url_to_fs>`__
             to open a remote file for writing.
         :type storage_options: None or dict
+        :param skip_bad_files: If True, skips corrupt or non-existent files without exiting.
+        :type skip_bad_files: bool, optional
+        :param fast_copy: If True and all input files have the same schema and are already
+            compressed with ``compression``, the compressed column chunks are copied into the
+            output byte for byte and only the footer is rewritten. The other writer options
+            do not apply to a fast copy. Falls back to decoding and re-encoding otherwise.
+        :type fast_copy: bool, optional
+        :param footer_workers: Number of threads used to read the input file footers.
+            If None, the ``concurrent.futures.ThreadPoolExecutor`` default is used.
+        :type footer_workers: None or int, optional
+        :param footer_cache: Directory in which parsed footers are cached, keyed by file
+            path, size and modification time, so that repeated merges over the same inputs
+            do not read the footers again. If None, nothing is cached.
+        :type footer_cache: None or path-like, optional
+        :param decode_workers: Number of threads that read and decode input row groups ahead
+            of the writer. Row groups are still written in input order. If None, row groups
+            are decoded one at a time by the writing thread.
+        :type decode_workers: None or int, optional
+        :param decode_queue_size: Maximum number of decoded row groups waiting to be written,
+            which bounds memory use. Defaults to twice ``decode_workers``.
+        :type decode_queue_size: None or int, optional
+        :param sort_by: Names of numeric fields that every input file is already sorted by,
+            such as ``["run", "luminosityBlock", "event"]``. If given, the inputs are k-way
+            merged so that the output is sorted by these fields as well, holding about one
+            row group per input in memory. Row-group statistics are used to read each row
+            group only when it is needed. ``fast_copy`` and ``decode_workers`` do not apply.
+        :type sort_by: None, str, or list of str, optional
+        :param row_group_bytes: If not None, input row groups are joined or split so that each
+            output row group holds about this many bytes of uncompressed data (measured as the
+            in-memory size of the decoded arrays), such as ``"128 MB"``. ``row_group_size``
+            still caps the number of entries in a row group. ``fast_copy`` does not apply.
+        :type row_group_bytes: None, int, or str, optional
+        :param keep_branches: To keep only certain columns and remove all others, pass a list of
+            names of top-level fields to keep, wildcarding accepted ("Jet_*"). Columns that are
+            not kept are never read from the input files. Defaults to None.
+        :type keep_branches: list of str or str, optional
+        :param drop_branches: To remove columns, pass a list of names of top-level fields to
+            remove, wildcarding accepted ("Jet_*"). Defaults to None.
+        :type drop_branches: list of str or str, optional
+        :param cut: If not None, only entries passing this expression are written, such as
+            ``"(nMuon >= 2) & (MET_pt > 50)"``. The expression is evaluated with each field as a
+            variable and ``np`` as NumPy. Comparisons of a field with a number that are joined
+            by ``&`` are checked against the row-group min/max statistics, and row groups that
+            cannot pass are skipped without being read.
+        :type cut: None or str, optional
+        :param metadata_only: If True, the input files are left as they are and ``out_file``
+            becomes a ``_metadata`` summary file holding the row-group metadata of every input,
+            with relative paths to the data files, so that readers can treat the inputs as one
+            dataset. No data is read or written. All inputs must have the same schema, and the
+            options that change the data do not apply.
+        :type metadata_only: bool, optional
+        :param common_metadata: If True with ``metadata_only``, a ``_common_metadata`` file
+            holding only the schema is also written in the directory of ``out_file``.
+        :type common_metadata: bool, optional
+        :param prefetch_workers: If not None, the byte ranges of upcoming row groups (their
+            column chunks and the file footer, as laid out in the footers) are read ahead of
+            decoding by this many concurrent requests, across files. This hides the latency
+            of remote storage. Does not apply to ``sort_by``.
+        :type prefetch_workers: None or int, optional
+        :param prefetch_depth: Maximum number of fetched row groups waiting to be decoded,
+            which bounds memory use. Defaults to twice ``prefetch_workers``.
+        :type prefetch_depth: None or int, optional
+        :param memory_map: If True, local input files are memory-mapped, so that column data
+            is read from the page cache instead of being copied into new buffers. Remote
+            inputs and ``prefetch_workers`` are not affected.
+        :type memory_map: bool, optional
+        :param dedup_by: Names of numeric fields that identify a row, such as
+            ``["run", "luminosityBlock", "event"]``. If given, rows whose keys were already
+            written are dropped while streaming, keeping the first occurrence in input order.
+            Keys are compared by a 64-bit hash. ``fast_copy`` does not apply.
+        :type dedup_by: None, str, or list of str, optional
+        :param dedup_memory: Memory ceiling for the table of key hashes used by ``dedup_by``,
+            as a number of bytes or a string such as "1 GB". Each distinct key takes 16 to 32
+            bytes. A ``MemoryError`` is raised if the table would need more.
+        :type dedup_memory: int or str, optional
 
         Examples:
         ---------
@@ -185,7 +287,7 @@ def merge_parquet(
     """
     if not isinstance(in_files, list) and not isinstance(in_files, tuple):
         path = Path(in_files)
-        in_files = sorted(path.glob("**/*.root"))
+        in_files = sorted(path.glob("**/*.parquet"))
     if len(in_files) < 2:
         msg = f"Must have at least 2 files to merge, not {len(in_files)} files."
         raise AttributeError(msg)
@@ -193,24 +295,159 @@ def merge_parquet(
     if Path.is_file(path) and not force:
         raise FileExistsError
 
-    data = False
-    for file in in_files:
-        try:
-            ak.metadata_from_parquet(file)
-        except FileNotFoundError:
-            if skip_bad_files:
-                continue
-            msg = "File: {file} does not exist or is corrupt."
-            raise FileNotFoundError(msg) from None
-        if isinstance(data, bool):
-            data = ak.from_parquet(file)
+    metadata = _parquet_utils.scan_footers(
+        in_files,
+        workers=footer_workers,
+        cache=footer_cache,
+        skip_bad_files=skip_bad_files,
+    )
+
+    if metadata_only:
+        _parquet_utils.write_dataset_metadata(
+            out_file,
+            [file for file, _ in metadata],
+            [_parquet_utils.parse_footer(meta) for _, meta in metadata],
+            common_metadata=common_metadata,
+            storage_options=storage_options,
+        )
+        return
+
+    if isinstance(sort_by, str):
+        sort_by = [sort_by]
+    if isinstance(dedup_by, str):
+        dedup_by = [dedup_by]
+
+    selecting = keep_branches or drop_branches or cut is not None
+    if (
+        fast_copy
+        and not sort_by
+        and not dedup_by
+        and row_group_bytes is None
+        and not selecting
+    ):
+        footers = [_parquet_utils.parse_footer(meta) for _, meta in metadata]
+        if _parquet_utils.can_copy_column_chunks(footers, compression):
+            _parquet_utils.copy_column_chunks(
+                out_file,
+                [file for file, _ in metadata],
+                footers,
+                storage_options=storage_options,
+            )
+            return
+
+    # Plan the output schema from the footers, then stream one input row group
+    # at a time through a single writer, decoding up to decode_queue_size row
+    # groups ahead of it.
+    form, changes = _parquet_utils.unify_forms([meta["form"] for _, meta in metadata])
+    # the decoders read each input through one ParquetFile, built from its scanned footer
+    files = _parquet_utils.ParquetFiles(memory_map)
+    columns, keep_row_group = None, None
+    if selecting:
+        # Read only the kept columns plus those needed by the cut, sort and dedup keys,
+        # and skip row groups whose statistics rule out the cut.
+        fields = _parquet_utils.select_fields(form, keep_branches, drop_branches)
+        out_form = _parquet_utils.project_form(form, fields)
+        needed = (
+            (_parquet_utils.cut_fields(cut, form) if cut is not None else [])
+            + (sort_by or [])
+            + (dedup_by or [])
+        )
+        fields = fields + [f for f in form.fields if f in needed and f not in fields]
+        form = _parquet_utils.project_form(form, fields)
+        columns = [
+            _parquet_utils.columns_to_read(meta["form"], fields) for _, meta in metadata
+        ]
+        if cut is not None:
+            ranges = _parquet_utils.cut_ranges(cut)
+            keep_row_group = functools.partial(_parquet_utils.may_pass, ranges)
+    if sort_by:
+        row_groups = _parquet_utils.sorted_merge(
+            metadata,
+            form,
+            sort_by,
+            columns=columns,
+            keep_row_group=keep_row_group,
+            memory_map=memory_map,
+        )
+    else:
+        plan = [
+            (
+                file,
+                meta,
+                i,
+                None if columns is None else columns[j],
+                form
+                if selecting
+                or change["filled"]
+                or change["promoted"]
+                or meta["form"] != form
+                else None,
+            )
+            for j, ((file, meta), change) in enumerate(zip(metadata, changes))
+            for i in range(meta["num_row_groups"])
+            if keep_row_group is None or keep_row_group(meta["statistics"][i])
+        ]
+        if prefetch_workers:
+            # Fetch the byte ranges of upcoming row groups concurrently, ahead of
+            # the decoders, so that round trips to remote storage overlap.
+            fetched = _parquet_utils.read_ahead(
+                (
+                    functools.partial(
+                        _parquet_utils.fetch_row_group, file, meta, i, read_columns
+                    )
+                    for file, meta, i, read_columns, _ in plan
+                ),
+                workers=prefetch_workers,
+                max_pending=prefetch_depth,
+            )
+            tasks = (
+                functools.partial(
+                    _parquet_utils.decode_row_group,
+                    file,
+                    meta,
+                    i,
+                    parts,
+                    form,
+                    read_columns,
+                )
+                for (file, meta, i, read_columns, _), parts in zip(plan, fetched)
+            )
         else:
-            data = ak.merge_union_of_records(
-                ak.concatenate((data, ak.from_parquet(file))), axis=0
+            tasks = (
+                functools.partial(
+                    _parquet_utils.read_row_group,
+                    file,
+                    i,
+                    target,
+                    read_columns,
+                    metadata=meta,
+                    files=files,
+                )
+                for file, meta, i, read_columns, target in plan
             )
+        row_groups = _parquet_utils.read_ahead(
+            tasks, workers=decode_workers, max_pending=decode_queue_size
+        )
+    if selecting and dedup_by:
+        # Cut before deduplicating, so that rows the cut drops take no slots in the
+        # table of keys, and drop the key columns afterwards.
+        row_groups = _parquet_utils.apply_cut(row_groups, cut, form)
+        cut = None
+    if dedup_by:
+        row_groups = _parquet_utils.drop_duplicates(
+            row_groups, dedup_by, form, _utils.parse_memory_size(dedup_memory)
+        )
+    if selecting:
+        row_groups = _parquet_utils.apply_cut(row_groups, cut, out_form)
+        form = out_form
+    if row_group_bytes is not None:
+        row_groups = _parquet_utils.coalesce(
+            row_groups, _utils.parse_memory_size(row_group_bytes), form
+        )
 
-        ak.to_parquet(
-            data,
+    with files:
+        ak.to_parquet_row_groups(
+            row_groups,
             out_file,
             list_to32=list_to32,
             string_to32=string_to32,
@@ -237,6 +474,128 @@ def merge_parquet(
         )
 
 
+def compact_parquet(
+    directory,
+    *,
+    target_size="512 MB",
+    small_file_size=None,
+    workers=None,
+    remove_inputs=True,
+    compression="zstd",
+    compression_level=None,
+    row_group_size=64 * 1024 * 1024,
+    row_group_bytes=None,
+    storage_options=None,
+):
+    """Compacts the small Parquet files of a directory into fewer, larger files.
+
+    Args:
+        :param directory: Directory to compact. Subdirectories (such as partitions) are
+            compacted separately, and files are never merged across directories.
+        :type directory: path-like
+        :param target_size: Size that each merged file should reach, as a number of bytes or
+            a string such as "512 MB". Defaults to "512 MB". Command line option: ``--target-size``.
+        :type target_size: int or str, optional
+        :param small_file_size: Files at least this large are left untouched. Defaults to
+            ``target_size``. Command line option: ``--small-file-size``.
+        :type small_file_size: None, int, or str, optional
+        :param workers: Number of groups merged at the same time, each in its own process.
+            If None, the ``concurrent.futures.ProcessPoolExecutor`` default is used. If 1,
+            groups are merged one after another in this process. Command line option: ``--workers``.
+        :type workers: None or int, optional
+        :param remove_inputs: If True, the files of a group are deleted once they have been
+            merged. Defaults to True. Command line option: ``--keep-inputs``.
+        :type remove_inputs: bool, optional
+        :param compression: Compression algorithm name, passed to ``merge_parquet``.
+            Command line option: ``--compression``.
+        :type compression: None, str, or dict
+        :param compression_level: Compression level, passed to ``merge_parquet``.
+            Command line option: ``--compression-level``.
+        :type compression_level: None, int, or dict
+        :param row_group_size: Maximum number of entries in each row group, passed to ``merge_parquet``.
+        :type row_group_size: int or None
+        :param row_group_bytes: Target size of each row group, passed to ``merge_parquet``.
+            Command line option: ``--row-group-bytes``.
+        :type row_group_bytes: None, int, or str, optional
+        :param storage_options: Any additional options to pass to ``merge_parquet``.
+        :type storage_options: None or dict
+
+    Returns the list of files that were written.
+
+        Examples:
+        ---------
+        Merges the files below 128 MB in "dataset/" into files of about 512 MB.
+
+            >>> hepconvert.compact_parquet("dataset/", small_file_size="128 MB")
+
+        Command Line Instructions:
+        --------------------------
+        This function can be run from the command line. Use command
+
+        .. code-block:: bash
+
+            hepconvert compact-parquet [options] [DIRECTORY]
+
+    """
+    target_size = _utils.parse_memory_size(target_size)
+    small_file_size = (
+        target_size
+        if small_file_size is None
+        else _utils.parse_memory_size(small_file_size)
+    )
+    path = Path(directory)
+    if not path.is_dir():
+        msg = f"Directory: {directory} does not exist."
+        raise FileNotFoundError(msg)
+
+    # Summary files such as _metadata and hidden files are not data files.
+    sizes = collections.defaultdict(dict)
+    for file in path.glob("**/*.parquet"):
+        if not file.name.startswith(("_", ".")) and file.is_file():
+            sizes[file.parent][file] = file.stat().st_size
+    groups = [
+        group
+        for parent in sorted(sizes)
+        for group in _parquet_utils.plan_compaction(
+            sizes[parent], target_size, small_file_size
+        )
+    ]
+
+    jobs = []
+    for group in groups:
+        name = hashlib.sha256(
+            "\0".join(file.name for file in group).encode()
+        ).hexdigest()
+        out_file = group[0].parent / f"compacted-{name[:16]}.parquet"
+        jobs.append((out_file, group))
+    merge = functools.partial(
+        _compact_group,
+        remove_inputs=remove_inputs,
+        compression=compression,
+        compression_level=compression_level,
+        row_group_size=row_group_size,
+        row_group_bytes=row_group_bytes,
+        storage_options=storage_options,
+    )
+    if workers == 1 or len(jobs) < 2:
+        return [merge(out_file, group) for out_file, group in jobs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(merge, out_file, group) for out_file, group in jobs]
+        return [future.result() for future in futures]
+
+
+def _compact_group(out_file, in_files, *, remove_inputs, **options):
+    # Readers skip hidden files, so the output only appears once it is complete,
+    # and the inputs are only removed after that.
+    temporary = out_file.parent / f".{out_file.name}.tmp"
+    merge_parquet(temporary, in_files, force=True, **options)
+    temporary.replace(out_file)
+    if remove_inputs:
+        for file in in_files:
+            file.unlink()
+    return out_file
+
+
 def merge_root(
     destination,
     files,
@@ -255,19 +614,35 @@ def merge_root(
     resize_factor=10.0,
     counter_name=lambda counted: "n" + counted,
     step_size="100 MB",
+    memory_budget=None,
+    basket_size=None,
     force=False,
     append=False,
     compression="zlib",
     compression_level=1,
     skip_bad_files=False,
+    prefetch_files=0,
+    prefetch_memory="1 GB",
+    fast_merge=False,
+    max_output_bytes=None,
+    max_output_entries=None,
+    workers=None,
+    fan_in=2,
+    scratch_dir=None,
+    journal=False,
+    resume=False,
+    manifest=False,
+    virtual=False,
 ):
     """Merges TTrees together, and adds values in histograms from local ROOT files, and writes them to a new ROOT file. Similar to ROOT's hadd function.
 
     :param destination: Name of the output file or file path.
     :type destination: path-like
     :param files: List of local ROOT files to merge.
-        May contain glob patterns.
-    :type files: str or list of str
+        May contain glob patterns. Items may also be ``(file, entry_start, entry_stop, tree)`` work
+        units from ``hepconvert.plan_jobs``, to merge only those entries of ``tree``; histograms and
+        the other TTrees are added whole from the unit that starts at entry 0 of its file.
+    :type files: str, list of str, or list of (str, int, int, str)
     :param keep_branches: To keep only certain branches and remove all others. To remove certain branches from all TTrees in the file,
         pass a list of names of branches to keep, wildcarding accepted ("Jet_*"). If removing branches from one of multiple trees, pass a dict of structure: {tree: [branch1, branch2]}
         to keep only branch1 and branch2 in ttree "tree". Defaults to None. Command line option: ``--keep-branches``.
@@ -307,11 +682,29 @@ def merge_root(
         a number followed by a memory unit, such as “100 MB”. Recommended to be >100 kB.
         Command line option: ``--step-size``.
     :type step_size: int or str
+    :param memory_budget: If not None, the memory (a number of bytes or a string such as
+        "500 MB") that each chunk may take while it is read, zipped and written. The first
+        step is the smaller of ``step_size`` and uproot's estimate for the budget; after
+        that, the number of entries per step is set again from the size of the last chunk.
+        The chunk is taken to be held about three times over while it is written, a fixed
+        heuristic, so the budget is approximate. Command line option: ``--memory-budget``.
+    :type memory_budget: None, int, or str, optional
+    :param basket_size: If not None, chunks are collected for each output TTree until one of
+        its branches holds this many (uncompressed) bytes, such as "1 MB", and then written
+        at once, so that small chunks, for instance those left by a selective ``cut``, do not
+        each become a TBasket. ``initial_basket_capacity`` is raised to the number of TBaskets
+        expected from the entries of the inputs. Command line option: ``--basket-size``.
+    :type basket_size: None, int, or str, optional
     :param force: If True, overwrites destination file if it exists. Force and append
         cannot both be True. Command line option: ``--force``.
     :type force: bool, optional
     :param append: If True, appends data to an existing file. Force and append
-        cannot both be True. Command line option: ``--append``.
+        cannot both be True. The inputs recorded in the manifest of ``destination`` (see
+        ``manifest``) are skipped if they have not changed since; the entries and histograms
+        already in ``destination`` are copied (as compressed TBaskets where possible) with
+        those of the other inputs into a new file, which then replaces ``destination``. If a
+        recorded input has changed, ``destination`` is merged again from all of ``files``.
+        Command line option: ``--append``.
     :type append: bool, optional
     :param compression: Sets compression level for root file to write to. Can be one of
         "ZLIB", "LZMA", "LZ4", or "ZSTD". By default the compression algorithm is "ZLIB".
@@ -323,6 +716,78 @@ def merge_root(
     :param skip_bad_files: If True, skips corrupt or non-existent files without exiting.
         Command line option: ``--skip-bad-files``.
     :type skip_bad_files: bool, optional
+    :param prefetch_files: Number of input files that are opened and read in background
+        threads ahead of the one being written, so that reading overlaps with zipping and
+        compression. If 0, inputs are read one after another. Command line option: ``--prefetch-files``.
+    :type prefetch_files: int, optional
+    :param prefetch_memory: Maximum size of the chunks read ahead and waiting to be written,
+        as a number of bytes or a string such as "1 GB". Command line option: ``--prefetch-memory``.
+    :type prefetch_memory: int or str, optional
+    :param fast_merge: If True, TTrees are merged the way ROOT's hadd does it: the compressed
+        TBaskets of each input are copied into the output tree without being decompressed,
+        and only the basket tables and entry counts are updated. This applies when there is
+        no ``cut``, ``expressions`` or branch filtering, and only to inputs whose TTree has
+        the same branches, types and compression as the output, with aligned baskets. Other
+        inputs are read and written as usual. Command line option: ``--fast-merge``.
+    :type fast_merge: bool, optional
+    :param max_output_bytes: If not None, once the output file reaches this size (a number of
+        bytes or a string such as "2 GB"), the next input is written to a new file, named
+        like ROOT's ``TTree::ChangeFile`` does: ``destination``, then ``destination_1``,
+        ``destination_2``, and so on. Files are only rolled over between inputs, so each one
+        holds whole inputs and the sums of exactly their histograms, and may exceed the
+        limit by up to one input. Chunks buffered for ``basket_size`` count at their
+        uncompressed size. Command line option: ``--max-output-bytes``.
+    :type max_output_bytes: None, int, or str, optional
+    :param max_output_entries: If not None, rolls over to a new file in the same way once any
+        TTree in the output file has this many entries. Command line option: ``--max-output-entries``.
+    :type max_output_entries: None or int, optional
+    :param workers: If greater than 1 (and there are at least 4 inputs), merges in this many
+        processes. The inputs are split into ``workers`` subsets of about the same total size,
+        assigning the largest files first, and each subset is merged into an intermediate file
+        in ``scratch_dir``. The intermediate files are then merged ``fan_in`` at a time, with
+        ``fast_merge``, until the last ones are merged into ``destination``. Entries are not in
+        the order of ``files``, and ``counter_name`` and ``field_name`` must be picklable if given.
+        Command line option: ``--workers``.
+    :type workers: None or int, optional
+    :param fan_in: Number of intermediate files merged together at each level of a parallel
+        merge. Command line option: ``--fan-in``.
+    :type fan_in: int, optional
+    :param scratch_dir: Directory for the intermediate files of a parallel merge, which are
+        deleted as soon as they have been merged. If None, the system's temporary directory
+        is used. Command line option: ``--scratch-dir``.
+    :type scratch_dir: None or path-like, optional
+    :param journal: If True, a journal is kept next to the output, at ``destination`` + ".journal".
+        After each input, the buffered chunks are written, the output file is flushed to disk,
+        the name of the input is appended to the journal, and a state file, at ``destination`` +
+        ".journal.state", is replaced with the number of inputs committed, the entries filled
+        in each TTree and the sums of the histograms so far. The journal and state file are
+        deleted when the merge finishes. Command line option: ``--journal``.
+    :type journal: bool, optional
+    :param resume: If True and a journal from an interrupted merge into ``destination`` exists,
+        the inputs it records are skipped: the entries they filled are copied from the
+        interrupted output (as compressed TBaskets where possible) into a new ``destination``,
+        their histogram sums are taken from the journal, and the merge continues with the
+        other inputs. If the journal has no committed input, the merge starts from the
+        beginning; if there is no journal, ``destination`` must not exist unless ``force``. Implies
+        ``journal``. Cannot be used with ``append``, ``max_output_bytes``, ``max_output_entries``
+        or ``workers``. Command line option: ``--resume``.
+    :type resume: bool, optional
+    :param manifest: If True, a manifest of the merged inputs is written into ``destination``
+        as a TObjString named "hepconvert_manifest": a JSON record of each input's absolute
+        path, size, modification time, content hash (xxh3_64 if the ``xxhash`` package is
+        installed, otherwise BLAKE2b) and the range of entries it filled in each TTree. Always
+        written when ``append`` is True. Hashing reads each merged input once more in full,
+        after it has been merged; an appended input whose modification time changed but not
+        its size is read in full again to compare its hash. ``manifest`` and ``append`` cannot be used with
+        ``max_output_bytes``, ``max_output_entries`` or ``workers``. Command line option: ``--manifest``.
+    :type manifest: bool, optional
+    :param virtual: If True, no data are copied: ``destination`` is written as a small index of
+        the inputs, with each input's absolute path, TTree names, numbers of entries, offsets of
+        their first entries in the chain and fingerprints of their branch names and types, along
+        with the sums of the histograms. Only TTree metadata and histograms are read. Iterate over
+        the chain with ``hepconvert.iterate_chain``, which also takes ``cut``, ``expressions``
+        and branch filters. Command line option: ``--virtual``.
+    :type virtual: bool, optional
 
     Example:
     --------
@@ -349,79 +814,167 @@ def merge_root(
     else:
         msg = f"unrecognized compression algorithm: {compression}. Only ZLIB, LZMA, LZ4, and ZSTD are accepted."
         raise ValueError(msg)
+
+    if not isinstance(files, list) and not isinstance(files, tuple):
+        path = Path(files)
+        files = sorted(path.glob("**/*.root"))
+
+    units = any(_root_utils.split_unit(file)[1] is not None for file in files)
+    if len(files) <= 1 and not append and not units:
+        msg = "Only one file was input. Use copy_root to copy a ROOT file."
+        raise ValueError(msg) from None
+
+    if units and (append or manifest or virtual):
+        msg = "append, manifest and virtual take whole files, not (file, entry_start, entry_stop, tree) work units."
+        raise ValueError(msg)
+
+    if virtual:
+        if cut is not None or expressions is not None or keep_branches or drop_branches:
+            msg = "cut, expressions, keep_branches and drop_branches cannot be applied to a virtual chain. Pass them to iterate_chain instead."
+            raise ValueError(msg)
+        if Path.is_file(Path(destination)) and not force:
+            raise FileExistsError
+        _write_chain(
+            destination,
+            files,
+            keep_trees=keep_trees,
+            drop_trees=drop_trees,
+            skip_bad_files=skip_bad_files,
+        )
+        return
+
+    journal_path = Path(f"{destination}.journal") if journal or resume else None
+    if (journal_path is not None or append or manifest) and (
+        max_output_bytes is not None
+        or max_output_entries is not None
+        or (workers is not None and workers > 1)
+    ):
+        msg = "journal, resume, append and manifest cannot be used with max_output_bytes, max_output_entries or workers."
+        raise ValueError(msg)
+    if journal_path is not None and append:
+        msg = "journal and resume cannot be used with append."
+        raise ValueError(msg)
+
+    if workers is not None and workers > 1 and len(files) >= 4:
+        if Path.is_file(Path(destination)) and not force and not append:
+            raise FileExistsError
+        _merge_root_parallel(
+            destination,
+            files,
+            workers=workers,
+            fan_in=fan_in,
+            scratch_dir=scratch_dir,
+            first_level={
+                "keep_branches": keep_branches,
+                "drop_branches": drop_branches,
+                "keep_trees": keep_trees,
+                "drop_trees": drop_trees,
+                "cut": cut,
+                "expressions": expressions,
+                "step_size": step_size,
+                "skip_bad_files": skip_bad_files,
+                "prefetch_files": prefetch_files,
+                "prefetch_memory": prefetch_memory,
+                "fast_merge": fast_merge,
+            },
+            last_level={
+                "force": force,
+                "append": append,
+                "progress_bar": progress_bar,
+                "max_output_bytes": max_output_bytes,
+                "max_output_entries": max_output_entries,
+            },
+            every_level={
+                "fieldname_separator": fieldname_separator,
+                "title": title,
+                "field_name": field_name,
+                "initial_basket_capacity": initial_basket_capacity,
+                "resize_factor": resize_factor,
+                "counter_name": counter_name,
+                "memory_budget": memory_budget,
+                "basket_size": basket_size,
+                "compression": compression,
+                "compression_level": compression_level,
+            },
+        )
+        return
+
     path = Path(destination)
+    output = path
+    partial = Path(f"{destination}.partial")
+    previous = None
+    committed, state = [], None
+    recorded = {}
+    remaining = files
+    if resume:
+        if journal_path.is_file():
+            committed, state = _read_journal(journal_path)
+            # without a committed input, the output holds nothing to keep
+            force = True
+        elif Path.is_file(path) and not force:
+            msg = f"Cannot resume a merge into {destination}: there is no journal {journal_path}. Pass force=True to overwrite it."
+            raise FileExistsError(msg)
+    if state is not None:
+        # An interrupted resume leaves the output of the first run in partial.
+        if not partial.is_file():
+            path.replace(partial)
+        previous = partial
+        done = set(committed)
+        remaining = [file for file in files if str(file) not in done]
     if Path.is_file(path):
         if not force and not append:
             raise FileExistsError
         if force and append:
             msg = "Cannot append to an empty file. Either force or append can be true."
             raise ValueError(msg)
-        if append:
-            out_file = uproot.update(
-                destination,
-                compression=uproot.compression.Compression.from_code_pair(
-                    compression_code, compression_level
-                ),
-            )
-            first = False
+    elif append:
+        msg = f"File {destination} not found. Can only append to existing files."
+        raise FileNotFoundError(msg)
+    if append:
+        recorded = _read_manifest(path)
+        new, changed, touched = _compare_manifest(files, recorded)
+        output = Path(f"{destination}.append")
+        if changed:
+            # The entries and histogram sums of a changed input cannot be taken out of
+            # the destination, so it is merged again from all of the inputs.
+            recorded = {}
+        elif new:
+            previous = path
+            remaining = new
         else:
-            out_file = uproot.recreate(
-                destination,
-                compression=uproot.compression.Compression.from_code_pair(
-                    compression_code, compression_level
-                ),
-            )
-            first = True
-    else:
-        if append:
-            msg = f"File {destination} not found. Can only append to existing files."
-            raise FileNotFoundError(msg)
-        out_file = uproot.recreate(
-            destination,
-            compression=uproot.compression.Compression.from_code_pair(
-                compression_code, compression_level
-            ),
-        )
-        first = True
-
-    try:  # is this legal?
-        step_size = int(step_size)
-    except ValueError:
-        step_size = str(step_size)
-
-    if not isinstance(files, list) and not isinstance(files, tuple):
-        path = Path(files)
-        files = sorted(path.glob("**/*.root"))
+            if touched:
+                # keeps the refreshed modification times, so that the touched inputs
+                # are not hashed again by the next append
+                with uproot.update(path) as file:
+                    del file[_MANIFEST_KEY]
+                    file[_MANIFEST_KEY] = json.dumps(
+                        {"inputs": list(recorded.values())}
+                    )
+            return
 
-    if len(files) <= 1:
-        msg = "Only one file was input. Use copy_root to copy a ROOT file."
-        raise ValueError(msg) from None
+    out_file = uproot.recreate(
+        output,
+        compression=uproot.compression.Compression.from_code_pair(
+            compression_code, compression_level
+        ),
+    )
 
-    try:
-        f = uproot.open(files[0])
-    except FileNotFoundError:
-        if skip_bad_files:
-            for file in files:
-                try:
-                    f = uproot.open(file)
-                    break
-                except FileNotFoundError:
-                    continue
+    step_size = _utils.parse_step_size(step_size)
 
+    f = None
+    for file in files:
+        try:
+            f = uproot.open(_root_utils.split_unit(file)[0])
+            break
+        except FileNotFoundError:
+            if not skip_bad_files:
+                break
+    if f is None:
         msg = f"File: {files[0]} does not exist or is corrupt."
         raise FileNotFoundError(msg) from None
     hist_keys = f.keys(
         filter_classname=["TH*", "TProfile"], cycle=False, recursive=False
     )
-    for key in f.keys(cycle=False, recursive=False):
-        if key in hist_keys:
-            if len(f[key].axes) == 1:
-                h_sum = _hadd_1d(destination, f, key, True)
-                out_file[key] = h_sum
-            elif len(f[key].axes) == 2:
-                out_file[key] = _hadd_2d(destination, f, key, True)
-            else:
-                out_file[key] = _hadd_3d(destination, f, key, True)
 
     trees = f.keys(filter_classname="TTree", cycle=False, recursive=False)
 
@@ -473,143 +1026,580 @@ def merge_root(
                     destination,
                 )
                 raise ValueError(msg)
-    if progress_bar is not False:
-        number_of_items = len(files)
+    if basket_size is not None:
+        basket_size = _utils.parse_memory_size(basket_size)
+    branches = {}
+    groups = {}
+    capacities = {}
+    for t in trees:
+        tree = f[t]
+        count_branches = get_counter_branches(tree)
+        branches[t] = filter_branches(
+            tree, keep_branches, drop_branches, count_branches
+        )
+        groups[t], _ = group_branches(tree, branches[t])
+        num_entries = tree.num_entries * len(files)
+        if max_output_entries is not None:
+            num_entries = min(num_entries, int(max_output_entries))
+        capacities[t] = _root_utils.basket_capacity(
+            tree, num_entries, step_size, basket_size, initial_basket_capacity
+        )
+
+    written = set()
+    entries = collections.Counter()
+
+    def mktree(t, chunk):
+        written.add(t)
+        out_file.mktree(
+            t,
+            {name: array.type for name, array in chunk.items()},
+            title=title,
+            counter_name=counter_name,
+            field_name=field_name,
+            initial_basket_capacity=capacities.get(t, initial_basket_capacity),
+            resize_factor=resize_factor,
+        )
+
+    def write(t, chunk):
+        if t not in written:
+            mktree(t, chunk)
+        try:
+            out_file[t].extend(chunk)
+        except AssertionError:
+            msg = "TTrees must have the same structure to be merged. Are the branch_names correct?"
+            raise ValueError(msg) from None
+        entries[t] += len(next(iter(chunk.values()), ()))
+
+    buffer = _root_utils.WriteBuffer(write, basket_size)
+
+    layouts = {}
+    empties = {}
+    if (
+        fast_merge
+        and cut is None
+        and expressions is None
+        and not keep_branches
+        and not drop_branches
+    ):
+        for t in trees:
+            num_baskets = max((b.num_baskets for b in f[t].branches), default=0)
+            capacities[t] = max(capacities[t], num_baskets * len(files) + 1)
+            empties[t] = _utils.zip_groups(
+                f[t].arrays(
+                    filter_name=branches[t].__contains__, entry_stop=0, how=dict
+                ),
+                groups[t],
+                fieldname_separator,
+            )
+            mktree(t, empties[t])
+            layouts[t] = _root_utils.tree_layout(out_file[t])
+    f.close()
+
+    hists = {}
+    if previous is not None:
+        with uproot.open(previous) as p:
+            if state is not None:
+                stops = {t: stop for t, (_, stop) in state["entries"].items()}
+                hists = state["histograms"]
+            else:
+                stops = {
+                    t: p[t].num_entries
+                    for t in p.keys(
+                        filter_classname="TTree", cycle=False, recursive=False
+                    )
+                }
+                hists = {
+                    key: _accumulator(p[key])
+                    for key in p.keys(
+                        filter_classname=["TH*", "TProfile"],
+                        cycle=False,
+                        recursive=False,
+                    )
+                }
+            for t, stop in stops.items():
+                _restore(
+                    p[t], stop, buffer, mktree, out_file, step_size, fieldname_separator
+                )
+        buffer.flush()
+        for t, stop in stops.items():
+            entries[t] = stop
+        if state is not None:
+            _root_utils.sync(out_file)
+            partial.unlink()
+
+    if journal_path is not None:
+        # drops the names of inputs appended after the last commit
+        _replace_file(
+            journal_path, "".join(json.dumps(name) + "\n" for name in committed)
+        )
+        if state is None:
+            _journal_state(journal_path).unlink(missing_ok=True)
+    start = dict(entries)
+
+    if progress_bar is not False and progress_bar is not None:
+        number_of_items = len(remaining)
         if progress_bar is True:
             tqdm = _utils.check_tqdm()
             progress_bar = tqdm.tqdm(desc="Files added")
         progress_bar.reset(number_of_items)
-    for t in trees:
-        branch_types = None
-        tree = f[t]
-        count_branches = get_counter_branches(tree)
-        kb = filter_branches(tree, keep_branches, drop_branches, count_branches)
-        groups, count_branches = group_branches(tree, kb)
-        first = True
-        for chunk in tree.iterate(
+
+    tasks = [
+        functools.partial(
+            _read_input,
+            file,
+            trees,
+            hist_keys,
+            branches,
             step_size=step_size,
-            how=dict,
-            filter_name=lambda b: b in kb,  # noqa: B023
+            memory_budget=memory_budget,
             cut=cut,
             expressions=expressions,
-        ):
-            for group in groups:
-                if (len(group)) > 1:
-                    chunk.update(
-                        {
-                            group[0][0 : (group[0].index(fieldname_separator))]: ak.zip(
-                                {
-                                    name[
-                                        group[0].index(fieldname_separator) + 1 :
-                                    ]: array
-                                    for name, array in zip(
-                                        ak.fields(chunk), ak.unzip(chunk)
-                                    )
-                                    if name in group
-                                }
-                            )
-                        }
-                    )
-                for key in group:
-                    del chunk[key]
-            if branch_types is None:
-                branch_types = {name: array.type for name, array in chunk.items()}
-            if first:
-                first = False
-                out_file.mktree(
-                    tree.name,
-                    branch_types,
-                    title=title,
-                    counter_name=counter_name,
-                    field_name=field_name,
-                    initial_basket_capacity=initial_basket_capacity,
-                    resize_factor=resize_factor,
+            skip_bad_files=skip_bad_files,
+            layouts=layouts,
+            compression=out_file.file.compression,
+        )
+        for file in remaining
+    ]
+    full = False
+    num_outputs = 1
+    for kind, value in _root_utils.read_ahead_files(
+        tasks,
+        depth=prefetch_files,
+        max_bytes=_utils.parse_memory_size(prefetch_memory),
+        sizeof=_input_nbytes,
+    ):
+        if kind == "histograms":
+            if full:
+                buffer.flush()
+                for key, summed in hists.items():
+                    out_file[key] = _from_accumulator(summed)
+                out_file.close()
+                numbered = _numbered_output(destination, num_outputs)
+                if Path.is_file(numbered) and not force:
+                    msg = f"File {numbered} already exists. To overwrite it, set force=True."
+                    raise FileExistsError(msg)
+                out_file = uproot.recreate(
+                    numbered,
+                    compression=uproot.compression.Compression.from_code_pair(
+                        compression_code, compression_level
+                    ),
                 )
-                try:
-                    out_file[tree.name].extend(chunk)
-                except AssertionError:
-                    msg = "TTrees must have the same structure to be merged. Are the branch_names correct?"
-
+                num_outputs += 1
+                hists = {}
+                written.clear()
+                entries.clear()
+                full = False
+                for t, empty in empties.items():
+                    mktree(t, empty)
+            for key, summed in value.items():
+                hists[key] = _accumulate(hists.get(key), summed)
+        elif kind == "chunk":
+            t, chunk = value
+            buffer.add(t, _utils.zip_groups(chunk, groups[t], fieldname_separator))
+        elif kind == "baskets":
+            t, file, baskets = value
+            buffer.flush(t)
+            if _root_utils.copy_baskets(out_file[t], *baskets):
+                entries[t] += sum(baskets[0])
             else:
-                try:
-                    out_file[tree.name].extend(chunk)
-                except AssertionError:
-                    msg = "TTrees must have the same structure to be merged. Are the branch_names correct?"
-        if progress_bar is not False:
-            progress_bar.update(n=1)
-        f.close()
-
-    for file in files[1:]:
+                with uproot.open(file) as f:
+                    for chunk in _root_utils.iterate(
+                        f[t],
+                        step_size,
+                        memory_budget,
+                        how=dict,
+                        filter_name=branches[t].__contains__,
+                    ):
+                        buffer.add(
+                            t, _utils.zip_groups(chunk, groups[t], fieldname_separator)
+                        )
+        else:
+            if journal_path is not None:
+                buffer.flush()
+                _root_utils.sync(out_file)
+            stops = {t: entries[t] + buffer.num_entries(t) for t in {*entries, *trees}}
+            ranges = {t: (start.get(t, 0), stop) for t, stop in stops.items()}
+            start = stops
+            if journal_path is not None:
+                committed.append(str(value))
+                _append_journal(journal_path, committed, ranges, hists)
+            if append or manifest:
+                record = _manifest_record(value, ranges)
+                recorded[record["path"]] = record
+            full = (
+                max_output_entries is not None
+                and max((entries[t] + buffer.num_entries(t) for t in trees), default=0)
+                >= max_output_entries
+            ) or (
+                max_output_bytes is not None
+                and Path(out_file.file_path).stat().st_size + buffer.nbytes()
+                >= _utils.parse_memory_size(max_output_bytes)
+            )
+            if progress_bar is not False and progress_bar is not None:
+                progress_bar.update(n=1)
+
+    buffer.flush()
+    for key, summed in hists.items():
+        out_file[key] = _from_accumulator(summed)
+    if append or manifest:
+        out_file[_MANIFEST_KEY] = json.dumps({"inputs": list(recorded.values())})
+    out_file.close()
+    if output != path:
+        output.replace(path)
+    if journal_path is not None:
+        _journal_state(journal_path).unlink()
+        journal_path.unlink()
+
+
+_MANIFEST_KEY = "hepconvert_manifest"
+
+
+def _manifest_record(file, ranges):
+    """
+    Describes an input of merge_root for the manifest of the destination: its absolute
+    path, size, modification time and content hash, and the range of entries it filled
+    in each TTree. Hashing reads the whole input once more.
+    """
+    stat = Path(file).stat()
+    return {
+        "path": str(Path(file).resolve()),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "hash": _utils.file_hash(file),
+        "entries": ranges,
+    }
+
+
+def _read_manifest(path):
+    """
+    Reads the manifest written by merge_root into the file at ``path``, as a dict from
+    absolute input path to record, or an empty dict if the file has no manifest.
+    """
+    with uproot.open(path) as file:
+        if _MANIFEST_KEY not in file:
+            return {}
+        manifest = json.loads(str(file[_MANIFEST_KEY]))
+    return {record["path"]: record for record in manifest["inputs"]}
+
+
+def _compare_manifest(files, recorded):
+    """
+    Returns the inputs in ``files`` that are not in the manifest ``recorded``, the ones
+    that changed since they were recorded, and whether any were only touched. Inputs
+    with the recorded size and modification time are taken to be unchanged without
+    reading them; the others are read in full to compare their content hash, and if
+    only touched, their records are updated with the new modification time.
+    """
+    new = []
+    changed = []
+    touched = False
+    for file in files:
+        record = recorded.get(str(Path(file).resolve()))
+        if record is None:
+            new.append(file)
+            continue
         try:
-            f = uproot.open(file)
+            stat = Path(file).stat()
         except FileNotFoundError:
-            if skip_bad_files:
-                continue
-            msg = "File: {file} does not exist or is corrupt."
-            raise FileNotFoundError(msg) from None
+            continue
+        if stat.st_size != record["size"]:
+            changed.append(file)
+        elif stat.st_mtime_ns != record["mtime"]:
+            if _utils.file_hash(file, like=record["hash"]) != record["hash"]:
+                changed.append(file)
+            else:
+                record["mtime"] = stat.st_mtime_ns
+                touched = True
+    return new, changed, touched
+
+
+def _restore(tree, stop, buffer, mktree, out_file, step_size, fieldname_separator):
+    """
+    Copies the first ``stop`` entries of ``tree``, from the output of an interrupted
+    merge_root, into the output tree of the same name: as compressed TBaskets if they
+    end at a TBasket boundary, otherwise by reading and writing them.
+    """
+    count_branches = get_counter_branches(tree)
+    branches = filter_branches(tree, None, None, count_branches)
+    groups, _ = group_branches(tree, branches)
+    empty = _utils.zip_groups(
+        tree.arrays(filter_name=branches.__contains__, entry_stop=0, how=dict),
+        groups,
+        fieldname_separator,
+    )
+    if tree.name not in out_file:
+        mktree(tree.name, empty)
+    layout = _root_utils.tree_layout(out_file[tree.name])
+    if layout and _root_utils.can_copy_baskets(tree, layout, out_file.file.compression):
+        num_entries, baskets, maxima = _root_utils.read_baskets(tree)
+        cumulative = list(itertools.accumulate(num_entries, initial=0))
+        if stop in cumulative:
+            keep = cumulative.index(stop)
+            if _root_utils.copy_baskets(
+                out_file[tree.name],
+                num_entries[:keep],
+                {name: raw[:keep] for name, raw in baskets.items()},
+                maxima,
+            ):
+                return
+    for chunk in tree.iterate(
+        step_size=step_size,
+        entry_stop=stop,
+        how=dict,
+        filter_name=branches.__contains__,
+    ):
+        buffer.add(tree.name, _utils.zip_groups(chunk, groups, fieldname_separator))
 
-        for key in f.keys(cycle=False, recursive=False):
-            if key in hist_keys:
-                if len(f[key].axes) == 1:
-                    h_sum = _hadd_1d(destination, f, key, False)
-                elif len(f[key].axes) == 2:
-                    h_sum = _hadd_2d(destination, f, key, False)
-                else:
-                    h_sum = _hadd_3d(destination, f, key, False)
 
-                out_file[key] = h_sum
+def _append_journal(path, committed, ranges, hists):
+    """
+    Commits an input of merge_root: appends the last of the names of ``committed``
+    inputs to the journal, then replaces the state file with the entries filled so far
+    and the sums of the histograms. Replacing the state file is the commit, so that a
+    name appended to the journal without it is ignored.
+    """
+    with Path(path).open("a", encoding="utf-8") as journal_file:
+        journal_file.write(json.dumps(committed[-1]) + "\n")
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+    state = {
+        "committed": len(committed),
+        "entries": ranges,
+        "histograms": {
+            key: {
+                **summed,
+                "values": summed["values"].tolist(),
+                "variances": summed["variances"].tolist(),
+                "stats": summed["stats"].tolist(),
+            }
+            for key, summed in hists.items()
+        },
+    }
+    _replace_file(_journal_state(path), json.dumps(state))
 
-        writable_hists = {}
-        for t in trees:
+
+def _read_journal(path):
+    """
+    Reads the names of the inputs committed in a merge_root journal and the state at
+    the last commit, with its histogram sums as accumulators. The state is None if no
+    input was committed.
+    """
+    if not _journal_state(path).is_file():
+        return [], None
+    state = json.loads(_journal_state(path).read_text(encoding="utf-8"))
+    committed = []
+    with Path(path).open(encoding="utf-8") as journal_file:
+        for line in itertools.islice(journal_file, state["committed"]):
+            committed.append(json.loads(line))
+    if len(committed) != state["committed"]:
+        msg = f"The journal {path} has fewer inputs than its state file; it cannot be resumed."
+        raise ValueError(msg)
+    for summed in state["histograms"].values():
+        summed["axes"] = [tuple(axis) for axis in summed["axes"]]
+        for name in ("values", "variances", "stats"):
+            summed[name] = np.array(summed[name], dtype=np.float64)
+    return committed, state
+
+
+def _journal_state(path):
+    return Path(f"{path}.state")
+
+
+def _replace_file(path, text):
+    """
+    Atomically replaces the contents of ``path`` with ``text``, on disk.
+    """
+    temporary = Path(f"{path}.tmp")
+    with temporary.open("w", encoding="utf-8") as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    temporary.replace(path)
+
+
+def _read_input(
+    file,
+    trees,
+    hist_keys,
+    branches,
+    *,
+    step_size,
+    memory_budget,
+    cut,
+    expressions,
+    skip_bad_files,
+    layouts,
+    compression,
+):
+    """
+    Opens one input of merge_root, a path or a ``(path, entry_start, entry_stop, tree)``
+    work unit, and yields ``("histograms", {key: accumulator})``,
+    then, for each TTree, either ``("baskets", (tree name, file, baskets))`` if its
+    compressed TBaskets can be copied into the output tree with layout
+    ``layouts[tree name]``, or ``("chunk", (tree name, chunk))`` for each of its
+    chunks, then ``("file", file)``. Runs in a background thread if merge_root
+    prefetches.
+    """
+    path, entry_start, entry_stop, unit_tree = _root_utils.split_unit(file)
+    ranges = _root_utils.unit_ranges(path, trees, entry_start, entry_stop, unit_tree)
+    try:
+        f = uproot.open(path)
+    except FileNotFoundError:
+        if skip_bad_files:
+            return
+        msg = f"File: {path} does not exist or is corrupt."
+        raise FileNotFoundError(msg) from None
+    with f:
+        # A file split into several work units has its histograms added only once.
+        yield (
+            "histograms",
+            {
+                key: _accumulator(f[key])
+                for key in f.keys(cycle=False, recursive=False)
+                if key in hist_keys and not entry_start
+            },
+        )
+        for t, (start, stop) in ranges.items():
             tree = f[t]
-            writable_hists = []
-            for key in hist_keys:
-                if len(f[key].axes) == 1:
-                    writable_hists[key] = _hadd_1d(destination, out_file, key, False)
-
-                elif len(f[key].axes) == 2:
-                    writable_hists[key] = _hadd_2d(destination, out_file, key, False)
-
-                else:
-                    writable_hists[key] = _hadd_3d(destination, out_file, key, False)
-            if len(trees) > 1:
-                count_branches = get_counter_branches(tree)
-                kb = filter_branches(tree, keep_branches, drop_branches, count_branches)
-            for chunk in uproot.iterate(
+            if (
+                layouts.get(t)
+                and _root_utils.whole_file(tree, start, stop)
+                and _root_utils.can_copy_baskets(tree, layouts[t], compression)
+            ):
+                yield "baskets", (t, path, _root_utils.read_baskets(tree))
+                continue
+            for chunk in _root_utils.iterate(
                 tree,
-                step_size=step_size,
+                step_size,
+                memory_budget,
+                start,
+                stop,
                 how=dict,
-                filter_name=lambda b: b in kb,  # noqa: B023
+                filter_name=branches[t].__contains__,
+                cut=cut,
+                expressions=expressions,
             ):
-                for group in groups:
-                    if len(group) > 1:
-                        chunk.update(
-                            {
-                                group[0][
-                                    0 : (group[0].index(fieldname_separator))
-                                ]: ak.zip(
-                                    {
-                                        name[
-                                            group[0].index(fieldname_separator) + 1 :
-                                        ]: array
-                                        for name, array in zip(
-                                            ak.fields(chunk), ak.unzip(chunk)
-                                        )
-                                        if name in group
-                                    }
-                                )
-                            }
-                        )
-                    for key in group:
-                        del chunk[key]
-                try:
-                    out_file[tree.name].extend(chunk)
-
-                except AssertionError:
-                    msg = "TTrees must have the same structure to be merged"
-
-            for key in hist_keys:
-                out_file[key] = writable_hists[key]
-        if progress_bar is not False:
-            progress_bar.update(n=1)
-        f.close()
+                yield "chunk", (t, chunk)
+    yield "file", file
+
+
+def _merge_root_parallel(
+    destination,
+    files,
+    *,
+    workers,
+    fan_in,
+    scratch_dir,
+    first_level,
+    last_level,
+    every_level,
+):
+    """
+    Merges ``files`` in a tree of merge_root calls run in ``workers`` processes:
+    balanced subsets of the inputs into intermediate files, those ``fan_in`` at a
+    time, and the last ones into ``destination``.
+    """
+    if fan_in < 2:
+        msg = f"fan_in must be at least 2, not {fan_in}."
+        raise ValueError(msg)
+    # only the options that differ from merge_root's defaults are sent to the workers,
+    # since some defaults (counter_name, field_name) cannot be pickled
+    defaults = merge_root.__kwdefaults__
+    every_level = {
+        name: value for name, value in every_level.items() if value != defaults[name]
+    }
+    sizes = [_root_utils.file_size(_root_utils.split_unit(file)[0]) for file in files]
+    if first_level["skip_bad_files"]:
+        files = [file for file, size in zip(files, sizes) if size is not None]
+        sizes = [size for size in sizes if size is not None]
+    subsets = _root_utils.balanced_subsets(
+        sizes, min(workers, len(files) // 2), min_count=2
+    )
+    if len(subsets) < 2:
+        merge_root(destination, files, **first_level, **last_level, **every_level)
+        return
+    # nested, since parenthesized context managers need Python 3.10
+    with tempfile.TemporaryDirectory(  # noqa: SIM117
+        dir=scratch_dir, prefix="hepconvert-merge-"
+    ) as scratch:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            names = _ScratchNames(scratch)
+            parts = _merge_level(
+                executor,
+                [[files[i] for i in subset] for subset in subsets],
+                names,
+                {**first_level, **every_level, "force": True},
+            )
+            while len(parts) > fan_in:
+                groups = [parts[i : i + fan_in] for i in range(0, len(parts), fan_in)]
+                parts = _merge_level(
+                    executor,
+                    groups,
+                    names,
+                    {**every_level, "force": True, "fast_merge": True},
+                )
+            merge_root(
+                destination,
+                parts,
+                **last_level,
+                **every_level,
+                fast_merge=True,
+            )
+
+
+class _ScratchNames:
+    """
+    Iterator over the names of the intermediate files of a parallel merge_root.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.counter = itertools.count()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.directory / f"part-{next(self.counter)}.root"
+
+
+def _merge_level(executor, groups, names, options):
+    """
+    Merges each group of files into the next of ``names`` in ``executor`` (a group of
+    one is passed through as it is), deletes the intermediate files that were merged,
+    and returns the resulting files.
+    """
+    parts = []
+    futures = []
+    for group in groups:
+        if len(group) == 1:
+            parts.append(group[0])
+        else:
+            parts.append(next(names))
+            futures.append(
+                (executor.submit(merge_root, parts[-1], group, **options), group)
+            )
+    for future, group in futures:
+        future.result()
+        for file in group:
+            if Path(file).parent == names.directory:
+                Path(file).unlink()
+    return parts
+
+
+def _numbered_output(destination, number):
+    """
+    Name of the ``number``-th file that merge_root rolls over to, following ROOT's
+    ``TTree::ChangeFile``: ``out.root``, ``out_1.root``, ``out_2.root``, ...
+    """
+    path = Path(destination)
+    return path.with_name(f"{path.stem}_{number}{path.suffix}")
+
+
+def _input_nbytes(item):
+    kind, value = item
+    if kind == "chunk":
+        return _root_utils.chunk_nbytes(value[1])
+    if kind == "baskets":
+        return sum(len(raw) for raws in value[2][1].values() for raw in raws)
+    return 0
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from hepconvert import _parquet_utils
+
+
+def parquet_to_parquet(
+    out_file,
+    in_file,
+    *,
+    force=False,
+    compression=None,
+    compression_level=None,
+    parquet_dictionary_encoding=None,
+    parquet_byte_stream_split=None,
+    data_page_size=None,
+    workers=None,
+    storage_options=None,
+):
+    """Re-encodes a Parquet file with new writer options, keeping its schema and row groups.
+
+    Every option defaults to None, which keeps what the input file has. Column chunks whose
+    options do not change are copied byte for byte; the others are decoded and encoded again,
+    in parallel.
+
+    :param out_file: Name of the output file or file path.
+    :type out_file: path-like
+    :param in_file: Parquet file to re-encode.
+    :type in_file: path-like
+    :param force: If True, overwrites destination file if it exists. Command line option: ``--force``.
+    :type force: boolean, optional
+    :param compression: Compression algorithm name, one of "NONE", "SNAPPY", "GZIP", "BROTLI",
+        "LZ4", or "ZSTD". If a dict, the keys are column paths (such as ``"jet.list.item.pt"``)
+        and the values are algorithm names, to compress each column differently. Command line
+        option: ``--compression``.
+    :type compression: None, str, or dict
+    :param compression_level: Compression level, passed to pyarrow. If given, every compressed
+        column (or every column in the dict) is encoded again, since Parquet files do not record
+        the level they were written with. Command line option: ``--compression-level``.
+    :type compression_level: None, int, or dict
+    :param parquet_dictionary_encoding: If True, allow Parquet to pre-compress with dictionary
+        encoding; if False, do not. A dict maps column paths to bool. Command line option:
+        ``--parquet-dictionary-encoding``.
+    :type parquet_dictionary_encoding: None, bool, or dict
+    :param parquet_byte_stream_split: If True, pre-compress floating point columns with byte
+        stream splitting; if False, do not. A dict maps column paths to bool. Command line
+        option: ``--parquet-byte-stream-split``.
+    :type parquet_byte_stream_split: None, bool, or dict
+    :param data_page_size: Number of bytes in each data page. If given, every column is encoded
+        again. Command line option: ``--data-page-size``.
+    :type data_page_size: None or int
+    :param workers: Number of threads that read and encode column chunks. If None, the
+        ``concurrent.futures.ThreadPoolExecutor`` default is used. Command line option: ``--workers``.
+    :type workers: None or int, optional
+    :param storage_options: Any additional options to pass to
+        `fsspec.core.url_to_fs <https://filesystem-spec.readthedocs.io/en/latest/api.html#fsspec.core.url_to_fs>`__
+        to open remote input and output files.
+    :type storage_options: None or dict
+
+    Example:
+    --------
+        >>> hepconvert.parquet_to_parquet("out.parquet", "in.parquet", compression="zstd", compression_level=9)
+
+    Command Line Instructions:
+    --------------------------
+    This function can be run from the command line. Use command
+
+    .. code-block:: bash
+
+        hepconvert parquet-to-parquet [options] [OUT_FILE] [IN_FILE]
+
+    """
+    path = Path(out_file)
+    if Path.is_file(path) and not force:
+        msg = f"File {path} already exists. To overwrite it, set force=True."
+        raise FileExistsError(msg)
+    try:
+        footer = _parquet_utils.read_footer(in_file, storage_options=storage_options)
+    except FileNotFoundError:
+        msg = f"File: {in_file} does not exist or is corrupt."
+        raise FileNotFoundError(msg) from None
+
+    plan = _parquet_utils.plan_transcode(
+        footer,
+        compression=compression,
+        compression_level=compression_level,
+        dictionary=parquet_dictionary_encoding,
+        byte_stream_split=parquet_byte_stream_split,
+        data_page_size=data_page_size,
+    )
+    _parquet_utils.transcode_column_chunks(
+        out_file,
+        in_file,
+        footer,
+        plan,
+        workers=workers,
+        storage_options=storage_options,
+    )
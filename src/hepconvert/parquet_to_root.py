@@ -2,10 +2,9 @@ from __future__ import annotations
 
 from pathlib import Path
 
-import awkward as ak
 import uproot
 
-from hepconvert import _utils
+from hepconvert import _parquet_utils, _utils
 
 
 def parquet_to_root(
@@ -24,6 +23,8 @@ def parquet_to_root(
     resize_factor=10.0,
     compression="ZLIB",
     compression_level=1,
+    footer_cache=None,
+    memory_map=False,
 ):
     """Converts a Parquet file into a ROOT file. Data is stored in one TTree, which has a name defined by argument ``name``.
 
@@ -56,6 +57,12 @@ def parquet_to_root(
     :type compression_level: int, optional
     :param force: If True, overwrites destination file if it exists. Command line option: ``--force``.
     :type force: boolean, optional
+    :param footer_cache: Directory in which the parsed Parquet footer is cached, keyed by file
+        path, size and modification time. If None, nothing is cached.
+    :type footer_cache: None or path-like, optional
+    :param memory_map: If True and ``file`` is local, it is memory-mapped, so that column data
+        is read from the page cache instead of being copied into new buffers. Command line option: ``--memory-map``.
+    :type memory_map: bool, optional
 
     Example:
     --------
@@ -106,7 +113,7 @@ def parquet_to_root(
                 compression_code, compression_level
             ),
         )
-    metadata = ak.metadata_from_parquet(file)
+    ((_, metadata),) = _parquet_utils.scan_footers([file], cache=footer_cache)
     if progress_bar is not False:
         number_of_items = metadata["num_row_groups"]
         if progress_bar is True:
@@ -115,23 +122,28 @@ def parquet_to_root(
             progress_bar = tqdm.tqdm(desc="Row-groups written")
         progress_bar.reset(number_of_items)
 
-    chunk = ak.from_parquet(file, row_groups=[0])
-    if not branch_types:
-        branch_types = {name: chunk[name].type for name in chunk.fields}
-    out_file.mktree(
-        name,
-        branch_types,
-        title=title,
-        counter_name=counter_name,
-        field_name=field_name,
-        initial_basket_capacity=initial_basket_capacity,
-        resize_factor=resize_factor,
-    )
-    out_file[name].extend({name: chunk[name] for name in chunk.fields})
-    if progress_bar:
-        progress_bar.update(n=1)
-
-    for i in range(1, metadata["num_row_groups"]):
-        out_file[name].extend(ak.from_parquet(file, row_groups=[i]))
+    # one ParquetFile, built from the scanned footer, serves every row group
+    with _parquet_utils.ParquetFiles(memory_map) as files:
+        chunk = _parquet_utils.read_row_group(file, 0, metadata=metadata, files=files)
+        if not branch_types:
+            branch_types = {name: chunk[name].type for name in chunk.fields}
+        out_file.mktree(
+            name,
+            branch_types,
+            title=title,
+            counter_name=counter_name,
+            field_name=field_name,
+            initial_basket_capacity=initial_basket_capacity,
+            resize_factor=resize_factor,
+        )
+        out_file[name].extend({name: chunk[name] for name in chunk.fields})
         if progress_bar:
             progress_bar.update(n=1)
+
+        for i in range(1, metadata["num_row_groups"]):
+            chunk = _parquet_utils.read_row_group(
+                file, i, metadata=metadata, files=files
+            )
+            out_file[name].extend({name: chunk[name] for name in chunk.fields})
+            if progress_bar:
+                progress_bar.update(n=1)
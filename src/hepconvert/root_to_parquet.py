@@ -6,6 +6,8 @@ import awkward as ak
 import uproot
 from numpy import union1d
 
+from hepconvert import _root_utils
+
 
 def root_to_parquet(
     in_file=None,
@@ -18,6 +20,7 @@ def root_to_parquet(
     expressions=None,
     force=False,
     step_size="100 MB",
+    memory_budget=None,
     list_to32=False,
     string_to32=True,
     bytestring_to32=True,
@@ -43,8 +46,10 @@ def root_to_parquet(
 ):
     """Converts ROOT to Parquet file using Uproot and awkward.to_parquet. Data read from 1 tree, converted to single Parquet file.
 
-    :param in_file: Local ROOT file to convert to Parquet. May contain glob patterns.
-    :type in_file: path-like
+    :param in_file: Local ROOT file to convert to Parquet. May contain glob patterns. May also be a
+        ``(file, entry_start, entry_stop, tree)`` work unit from ``hepconvert.plan_jobs``, to convert only those
+        entries of ``tree``, which must then match the ``tree`` argument if that is given.
+    :type in_file: path-like or (path-like, int, int, str)
     :param out_file: Name of the output file or file path.
     :type out_file: path-like
     :param tree: If there are multiple trees in the ROOT file, specify the name of one to write to Parquet.
@@ -64,6 +69,11 @@ def root_to_parquet(
         a string, the maximum memory size to include. The string must be a number followed by a memory unit, such as “100 MB”.
         Defaults to '100 MB'. Command line options: ``-s`` or ``--step-size``.
     :type step_size: int or str, optional
+    :param memory_budget: If not None, the memory (a number of bytes or a string such as "500 MB") that
+        each chunk may take while it is read and converted to Arrow; the number of entries per step is set
+        again from the size of the last chunk, taken to be held about three times over while it is converted (a
+        fixed heuristic, so the budget is approximate). Defaults to None. Command line option: ``--memory-budget``.
+    :type memory_budget: None, int, or str, optional
     :param list_to32: If True, convert Awkward lists into 32-bit Arrow lists if they're small enough, even if it means an extra conversion.
         Otherwise, signed 32-bit ak.types.ListType maps to Arrow ListType, signed 64-bit ak.types.ListType maps to Arrow LargeListType, and
         unsigned 32-bit ak.types.ListType picks whichever Arrow type its values fit into. Command line option ``--list-to32``.
@@ -201,6 +211,14 @@ def root_to_parquet(
     if Path.is_file(path) and not force:
         raise FileExistsError
 
+    in_file, entry_start, entry_stop, unit_tree = _root_utils.split_unit(in_file)
+    if unit_tree is not None:
+        if tree and tree != unit_tree:
+            msg = (
+                f"The work unit's entries belong to TTree {unit_tree!r}, not {tree!r}."
+            )
+            raise ValueError(msg)
+        tree = unit_tree
     try:
         f = uproot.open(in_file)
     except FileNotFoundError:
@@ -214,18 +232,17 @@ def root_to_parquet(
             raise AttributeError(msg) from None
         tree = trees[0]
 
-    try:  # is this legal?
-        step_size = int(step_size)
-    except ValueError:
-        step_size = str(step_size)
-
     filter_b = _filter_branches(f[tree], keep_branches, drop_branches)
     # if there's a counter, rid of that too...
     ak.to_parquet_row_groups(
         (
             i
-            for i in f[tree].iterate(
-                step_size=step_size,
+            for i in _root_utils.iterate(
+                f[tree],
+                step_size,
+                memory_budget,
+                entry_start,
+                entry_stop,
                 filter_name=filter_b,
                 cut=cut,
                 expressions=expressions,
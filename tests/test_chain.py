@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import awkward as ak
+import numpy as np
+import pytest
+import uproot
+
+import hepconvert
+
+
+def _write_inputs(tmp_path, n_entries=(100, 250, 50)):
+    files = []
+    start = 0
+    for i, n in enumerate(n_entries):
+        name = Path(tmp_path) / f"input{i}.root"
+        with uproot.recreate(name) as file:
+            file.mktree("events", {"x": "int64", "y": "float64"})
+            file["events"].extend({"x": np.arange(start, start + n), "y": np.ones(n)})
+            file["hx"] = np.histogram(np.arange(n) % 10, bins=10, range=(0, 10))
+        files.append(name)
+        start += n
+    return files
+
+
+def test_virtual_chain(tmp_path):
+    files = _write_inputs(tmp_path)
+    index = Path(tmp_path) / "chain.root"
+    hepconvert.merge_root(index, files, virtual=True)
+
+    with uproot.open(index) as file:
+        assert "events" not in file
+        expected = sum(uproot.open(name)["hx"].values() for name in files)
+        assert file["hx"].values().tolist() == expected.tolist()
+
+    chunks = list(hepconvert.iterate_chain(index, step_size=60, filter_name="x"))
+    assert ak.concatenate(chunks).x.tolist() == list(range(400))
+    assert max(len(chunk) for chunk in chunks) == 60
+
+    sliced = hepconvert.iterate_chain(
+        index, "events", entry_start=90, entry_stop=360, cut="x % 2 == 0", how=dict
+    )
+    assert np.concatenate([chunk["x"] for chunk in sliced]).tolist() == list(
+        range(90, 360, 2)
+    )
+
+    with pytest.raises(ValueError, match="cannot be applied to a virtual chain"):
+        hepconvert.merge_root(index, files, virtual=True, force=True, cut="x > 1")
+
+
+def test_virtual_chain_schema(tmp_path):
+    files = _write_inputs(tmp_path)
+    with uproot.recreate(files[1]) as file:
+        file.mktree("events", {"x": "int32"})
+        file["events"].extend({"x": np.arange(3, dtype=np.int32)})
+    with pytest.raises(ValueError, match="cannot be chained"):
+        hepconvert.merge_root(Path(tmp_path) / "chain.root", files, virtual=True)
+
+
+def test_plan_jobs(tmp_path):
+    files = _write_inputs(tmp_path)
+    jobs = hepconvert.plan_jobs(files, 4)
+    assert jobs == [
+        [(files[0], 0, 100, "events")],
+        [(files[1], 0, 100, "events")],
+        [(files[1], 100, 200, "events")],
+        [(files[1], 200, 250, "events"), (files[2], 0, 50, "events")],
+    ]
+    by_bytes = hepconvert.plan_jobs(files, 3, by="bytes")
+    assert sum(stop - start for job in by_bytes for _, start, stop, _ in job) == 400
+
+    outputs = []
+    for i, job in enumerate(jobs):
+        outputs.append(Path(tmp_path) / f"job{i}.root")
+        hepconvert.merge_root(outputs[-1], job)
+    hepconvert.merge_root(Path(tmp_path) / "all.root", outputs)
+    with uproot.open(Path(tmp_path) / "all.root") as file:
+        assert file["events"]["x"].array().tolist() == list(range(400))
+        expected = sum(uproot.open(name)["hx"].values() for name in files)
+        assert file["hx"].values().tolist() == expected.tolist()
+
+    hepconvert.copy_root(Path(tmp_path) / "copy.root", jobs[2][0])
+    with uproot.open(Path(tmp_path) / "copy.root") as file:
+        assert file["events"]["x"].array().tolist() == list(range(200, 300))
+        assert "hx" not in file
+
+    hepconvert.root_to_parquet(
+        in_file=jobs[3][0], out_file=Path(tmp_path) / "unit.parquet"
+    )
+    assert ak.from_parquet(Path(tmp_path) / "unit.parquet").x.tolist() == list(
+        range(300, 350)
+    )
+
+
+def test_plan_jobs_trees(tmp_path):
+    files = []
+    for i in range(2):
+        name = Path(tmp_path) / f"input{i}.root"
+        with uproot.recreate(name) as file:
+            file.mktree("events", {"x": "int64"})
+            file["events"].extend({"x": np.arange(i * 100, i * 100 + 100)})
+            file.mktree("runs", {"run": "int64"})
+            file["runs"].extend({"run": np.arange(i * 3, i * 3 + 3)})
+        files.append(name)
+    jobs = hepconvert.plan_jobs(files, 4, tree="events")
+    assert all(unit[3] == "events" for job in jobs for unit in job)
+
+    # the ranges cut only the planned TTree; the other is added whole, once per file
+    outputs = []
+    for i, job in enumerate(jobs):
+        outputs.append(Path(tmp_path) / f"job{i}.root")
+        hepconvert.merge_root(outputs[-1], job)
+    hepconvert.merge_root(Path(tmp_path) / "all.root", outputs)
+    with uproot.open(Path(tmp_path) / "all.root") as file:
+        assert file["events"]["x"].array().tolist() == list(range(200))
+        assert file["runs"]["run"].array().tolist() == list(range(6))
+
+    hepconvert.copy_root(Path(tmp_path) / "copy.root", jobs[1][0])
+    with uproot.open(Path(tmp_path) / "copy.root") as file:
+        assert file["events"]["x"].array().tolist() == list(range(50, 100))
+        assert file["runs"].num_entries == 0
+
+    hepconvert.root_to_parquet(
+        in_file=jobs[2][0], out_file=Path(tmp_path) / "unit.parquet"
+    )
+    assert ak.from_parquet(Path(tmp_path) / "unit.parquet").x.tolist() == list(
+        range(100, 150)
+    )
+    with pytest.raises(ValueError, match="belong to TTree 'events'"):
+        hepconvert.root_to_parquet(
+            in_file=jobs[2][0],
+            out_file=Path(tmp_path) / "runs.parquet",
+            tree="runs",
+        )
+    with pytest.raises(ValueError, match="does not name which"):
+        hepconvert.copy_root(Path(tmp_path) / "old.root", (files[0], 0, 50))
@@ -275,3 +275,19 @@ def test_keep_tree_and_branch(tmp_path):
     )
     file = uproot.open(skhep_testdata.data_path("uproot-HZZ.root"))
     assert "events" not in file.keys()
+
+
+def test_basket_size(tmp_path):
+    with uproot.recreate(Path(tmp_path) / "in.root") as file:
+        file.mktree("events", {"x": "int64", "y": "float64"})
+        file["events"].extend({"x": range(10000), "y": [0.5] * 10000})
+    hepconvert.copy_root(
+        Path(tmp_path) / "copy.root",
+        Path(tmp_path) / "in.root",
+        step_size=100,
+        cut="x % 100 == 0",
+        basket_size="100 kB",
+    )
+    tree = uproot.open(Path(tmp_path) / "copy.root")["events"]
+    assert tree["x"].array().tolist() == list(range(0, 10000, 100))
+    assert tree["x"].num_baskets == 1
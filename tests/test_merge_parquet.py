@@ -1,11 +1,17 @@
 from __future__ import annotations
 
+import functools
+import time
 from pathlib import Path
 
 import awkward as ak
+import fsspec
+import numpy as np
+import pyarrow.parquet as pq
 import pytest
 
-from hepconvert import merge, root_to_parquet
+import hepconvert
+from hepconvert import _parquet_utils, merge, root_to_parquet
 
 skhep_testdata = pytest.importorskip("skhep_testdata")
 
@@ -110,3 +116,691 @@ def HZZ_test(tmp_path):
     test = ak.from_parquet(Path(tmp_path / "/merged_hzz.parquet"))
     for key in new_arrays.fields:
         assert ak.all(new_arrays[key] == test[key])
+
+
+def test_streaming(tmp_path, monkeypatch):
+    for i in range(3):
+        ak.to_parquet(
+            ak.Array(
+                {
+                    "x": [i * 10 + j for j in range(10)],
+                    "y": [[j] * j for j in range(10)],
+                }
+            ),
+            Path(tmp_path / f"in{i}.parquet"),
+            row_group_size=4,
+        )
+    opened = []
+    original_parquet_file = pq.ParquetFile
+
+    def parquet_file(source, *args, **kwargs):
+        if kwargs.get("metadata") is not None:
+            opened.append(source)
+        return original_parquet_file(source, *args, **kwargs)
+
+    monkeypatch.setattr(pq, "ParquetFile", parquet_file)
+    merge.merge_parquet(
+        Path(tmp_path / "merged.parquet"),
+        [Path(tmp_path / f"in{i}.parquet") for i in range(3)],
+        force=True,
+    )
+    # each input is opened once from its scanned footer, not once per row group
+    assert len(opened) == 3
+    metadata = ak.metadata_from_parquet(Path(tmp_path / "merged.parquet"))
+    assert metadata["num_row_groups"] == 9
+    array = ak.from_parquet(Path(tmp_path / "merged.parquet"))
+    assert array["x"].tolist() == list(range(30))
+    assert array["y"].tolist() == [[j] * j for j in range(10)] * 3
+
+
+def test_fast_copy(tmp_path, monkeypatch):
+    for i in range(3):
+        ak.to_parquet(
+            ak.Array(
+                {
+                    "x": [i * 10 + j for j in range(10)],
+                    "y": [[j * 0.5] * j for j in range(10)],
+                    "z": ["abc"[: j % 4] for j in range(10)],
+                }
+            ),
+            Path(tmp_path / f"in{i}.parquet"),
+            row_group_size=4,
+            parquet_dictionary_encoding=True,
+        )
+    # the footers are parsed from the scan, not read again
+    monkeypatch.setattr(_parquet_utils, "read_footer", None)
+    merge.merge_parquet(
+        Path(tmp_path / "merged.parquet"),
+        [Path(tmp_path / f"in{i}.parquet") for i in range(3)],
+        force=True,
+        fast_copy=True,
+    )
+    metadata = pq.read_metadata(Path(tmp_path / "merged.parquet"))
+    assert metadata.num_rows == 30
+    assert metadata.num_row_groups == 9
+    assert metadata.row_group(8).column(0).statistics.max == 29
+    array = ak.from_parquet(Path(tmp_path / "merged.parquet"))
+    assert (
+        array.type.content
+        == ak.from_parquet(Path(tmp_path / "in0.parquet")).type.content
+    )
+    assert array["x"].tolist() == list(range(30))
+    assert array["y"].tolist() == [[j * 0.5] * j for j in range(10)] * 3
+    assert array["z"].tolist() == ["abc"[: j % 4] for j in range(10)] * 3
+
+    # the column chunks are copied without being decoded
+    with Path(tmp_path / "in1.parquet").open("rb") as f:
+        column = pq.read_metadata(f).row_group(0).column(0)
+        f.seek(column.data_page_offset)
+        original = f.read(column.total_compressed_size)
+    with Path(tmp_path / "merged.parquet").open("rb") as f:
+        column = metadata.row_group(3).column(0)
+        f.seek(column.data_page_offset)
+        assert f.read(column.total_compressed_size) == original
+
+
+def test_fast_copy_fallback(tmp_path):
+    ak.to_parquet(ak.Array({"x": [1, 2]}), Path(tmp_path / "in0.parquet"))
+    ak.to_parquet(
+        ak.Array({"x": [3, 4]}), Path(tmp_path / "in1.parquet"), compression="snappy"
+    )
+    merge.merge_parquet(
+        Path(tmp_path / "merged.parquet"),
+        [Path(tmp_path / "in0.parquet"), Path(tmp_path / "in1.parquet")],
+        force=True,
+        fast_copy=True,
+    )
+    metadata = pq.read_metadata(Path(tmp_path / "merged.parquet"))
+    assert metadata.row_group(1).column(0).compression == "ZSTD"
+    assert ak.from_parquet(Path(tmp_path / "merged.parquet"))["x"].tolist() == [
+        1,
+        2,
+        3,
+        4,
+    ]
+
+
+def test_schema_unification(tmp_path):
+    ak.to_parquet(
+        ak.Array({"a": [1, 2], "b": [1, 2], "c": [[1], [2, 3]]}),
+        Path(tmp_path / "in0.parquet"),
+    )
+    ak.to_parquet(
+        ak.Array({"a": [7.5, 8.0, 9.0], "b": [3, None, 5]}),
+        Path(tmp_path / "in1.parquet"),
+    )
+    ak.to_parquet(ak.Array({"a": [10], "d": [1]}), Path(tmp_path / "in2.parquet"))
+    in_files = [Path(tmp_path / f"in{i}.parquet") for i in range(3)]
+
+    form, changes = _parquet_utils.unify_forms(
+        [ak.metadata_from_parquet(file)["form"] for file in in_files]
+    )
+    assert form.fields == ["a", "b", "c", "d"]
+    assert changes == [
+        {"filled": ["d"], "promoted": ["a", "b", "c"]},
+        {"filled": ["c", "d"], "promoted": []},
+        {"filled": ["b", "c"], "promoted": ["a", "d"]},
+    ]
+
+    merge.merge_parquet(Path(tmp_path / "merged.parquet"), in_files, force=True)
+    array = ak.from_parquet(Path(tmp_path / "merged.parquet"))
+    assert (
+        str(array.type.content)
+        == "{a: float64, b: ?int64, c: option[var * int64], d: ?int64}"
+    )
+    assert array.tolist() == [
+        {"a": 1.0, "b": 1, "c": [1], "d": None},
+        {"a": 2.0, "b": 2, "c": [2, 3], "d": None},
+        {"a": 7.5, "b": 3, "c": None, "d": None},
+        {"a": 8.0, "b": None, "c": None, "d": None},
+        {"a": 9.0, "b": 5, "c": None, "d": None},
+        {"a": 10.0, "b": None, "c": None, "d": 1},
+    ]
+
+
+def test_footer_cache(tmp_path, monkeypatch):
+    in_files = []
+    for i in range(4):
+        ak.to_parquet(
+            ak.Array({"x": list(range(i, i + 5))}),
+            Path(tmp_path / f"in{i}.parquet"),
+            row_group_size=2,
+        )
+        in_files.append(Path(tmp_path / f"in{i}.parquet"))
+    cache = Path(tmp_path / "cache")
+
+    scanned = _parquet_utils.scan_footers(in_files, workers=2, cache=cache)
+    assert [file for file, _ in scanned] == in_files
+    assert len(list(cache.glob("*.json"))) == 4
+    footer = scanned[3][1]
+    assert footer["num_rows"] == 5
+    assert footer["col_counts"] == [2, 2, 1]
+    assert footer["statistics"][1] == {"x": [5, 6]}
+
+    # cached footers are used without reading the files
+    def fail(*args, **kwargs):
+        raise AssertionError
+
+    monkeypatch.setattr(pq, "ParquetFile", fail)
+    assert _parquet_utils.scan_footers(in_files, cache=cache)[3][1] == footer
+    monkeypatch.undo()
+    merge.merge_parquet(Path(tmp_path / "merged.parquet"), in_files, footer_cache=cache)
+
+    # a rewritten file is read again
+    ak.to_parquet(ak.Array({"x": [1, 2, 3]}), Path(tmp_path / "in3.parquet"))
+    assert _parquet_utils.scan_footers(in_files, cache=cache)[3][1]["num_rows"] == 3
+    assert ak.from_parquet(Path(tmp_path / "merged.parquet"))["x"].tolist() == [
+        x for i in range(4) for x in range(i, i + 5)
+    ]
+
+
+def test_read_ahead():
+    started = []
+
+    def task(i):
+        started.append(i)
+        time.sleep(0.001 * (i % 3))
+        return i
+
+    results = _parquet_utils.read_ahead(
+        (functools.partial(task, i) for i in range(20)), workers=4, max_pending=3
+    )
+    for expected, result in enumerate(results):
+        assert result == expected
+        # no more than max_pending tasks run ahead of the consumer
+        assert len(started) <= expected + 1 + 3
+
+
+def test_decode_workers(tmp_path):
+    in_files = []
+    for i in range(5):
+        ak.to_parquet(
+            ak.Array({"x": list(range(i * 7, i * 7 + 7)), "y": [[i]] * 7}),
+            Path(tmp_path / f"in{i}.parquet"),
+            row_group_size=3,
+        )
+        in_files.append(Path(tmp_path / f"in{i}.parquet"))
+    merge.merge_parquet(Path(tmp_path / "merged.parquet"), in_files, decode_workers=3)
+    array = ak.from_parquet(Path(tmp_path / "merged.parquet"))
+    assert array["x"].tolist() == list(range(35))
+    assert array["y"].tolist() == [[i] for i in range(5) for _ in range(7)]
+
+
+def test_sort_by(tmp_path):
+    rng = np.random.default_rng(12345)
+    in_files, expected = [], []
+    for i in range(4):
+        run = np.sort(rng.integers(1, 4, 50))
+        event = rng.integers(0, 1000, 50)
+        order = np.lexsort((event, run))
+        array = ak.Array(
+            {"run": run[order], "event": event[order], "source": np.full(50, i)}
+        )
+        ak.to_parquet(array, Path(tmp_path / f"in{i}.parquet"), row_group_size=7)
+        in_files.append(Path(tmp_path / f"in{i}.parquet"))
+        expected.extend(zip(run[order].tolist(), event[order].tolist()))
+    # a file that only holds late entries
+    ak.to_parquet(
+        ak.Array({"run": [9, 9], "event": [1, 2], "source": [4, 4]}),
+        Path(tmp_path / "late.parquet"),
+    )
+    in_files.append(Path(tmp_path / "late.parquet"))
+    expected.extend([(9, 1), (9, 2)])
+
+    merge.merge_parquet(
+        Path(tmp_path / "merged.parquet"), in_files, sort_by=["run", "event"]
+    )
+    array = ak.from_parquet(Path(tmp_path / "merged.parquet"))
+    assert list(zip(array["run"].tolist(), array["event"].tolist())) == sorted(expected)
+
+    # the late file is only read at the end
+    scanned = _parquet_utils.scan_footers(in_files)
+    form, _ = _parquet_utils.unify_forms([meta["form"] for _, meta in scanned])
+    batches = _parquet_utils.sorted_merge(scanned, form, ["run", "event"])
+    assert 4 not in next(batches)["source"].tolist()
+
+    with pytest.raises(ValueError, match="not sorted"):
+        merge.merge_parquet(
+            Path(tmp_path / "merged.parquet"),
+            in_files,
+            sort_by="event",
+            force=True,
+        )
+
+    # fields missing from some inputs, including lists, are kept
+    ak.to_parquet(
+        ak.Array({"x": [3, 4, 6], "q": [[1], [2, 3], []]}),
+        Path(tmp_path / "jagged.parquet"),
+    )
+    ak.to_parquet(ak.Array({"x": [1, 2]}), Path(tmp_path / "flat.parquet"))
+    mixed = [Path(tmp_path / "jagged.parquet"), Path(tmp_path / "flat.parquet")]
+    merge.merge_parquet(Path(tmp_path / "mixed.parquet"), mixed, sort_by="x")
+    array = ak.from_parquet(Path(tmp_path / "mixed.parquet"))
+    assert array["x"].tolist() == [1, 2, 3, 4, 6]
+    assert array["q"].tolist() == [None, None, [1], [2, 3], []]
+
+    # empty inputs still give an output with their schema
+    ak.to_parquet(
+        ak.Array({"x": np.zeros(0, dtype=np.int64)}), Path(tmp_path / "empty.parquet")
+    )
+    merge.merge_parquet(
+        Path(tmp_path / "empty_merged.parquet"),
+        [Path(tmp_path / "empty.parquet")] * 2,
+        sort_by="x",
+    )
+    array = ak.from_parquet(Path(tmp_path / "empty_merged.parquet"))
+    assert len(array) == 0
+    assert array.fields == ["x"]
+
+
+def test_row_group_bytes(tmp_path):
+    in_files = []
+    for i in range(10):
+        ak.to_parquet(
+            ak.Array(
+                {
+                    "x": np.arange(i * 100, i * 100 + 100, dtype=np.int64),
+                    "y": [[float(j)] * (j % 3) for j in range(100)],
+                }
+            ),
+            Path(tmp_path / f"in{i}.parquet"),
+            row_group_size=10,
+        )
+        in_files.append(Path(tmp_path / f"in{i}.parquet"))
+
+    merge.merge_parquet(
+        Path(tmp_path / "merged.parquet"), in_files, row_group_bytes="8 kB"
+    )
+    metadata = ak.metadata_from_parquet(Path(tmp_path / "merged.parquet"))
+    # 100 small input row groups are coalesced into a handful of large ones
+    assert 2 < metadata["num_row_groups"] < 100
+    array = ak.from_parquet(Path(tmp_path / "merged.parquet"))
+    assert array["x"].tolist() == list(range(1000))
+    assert array["y"].tolist() == [[float(j)] * (j % 3) for j in range(100)] * 10
+
+    # input row groups larger than the target are split
+    chunks = list(
+        _parquet_utils.coalesce(
+            [ak.Array({"x": np.arange(1000, dtype=np.int64)})],
+            800,
+            ak.forms.RecordForm([ak.forms.NumpyForm("int64")], ["x"]),
+        )
+    )
+    assert [len(chunk) for chunk in chunks] == [100] * 10
+    assert ak.concatenate(chunks)["x"].tolist() == list(range(1000))
+
+    with pytest.raises(ValueError, match="Memory size"):
+        merge.merge_parquet(
+            Path(tmp_path / "merged.parquet"),
+            in_files,
+            row_group_bytes="lots",
+            force=True,
+        )
+
+    # fields missing from some inputs, including lists, are kept
+    ak.to_parquet(
+        ak.Array({"x": [1, 2, 3], "q": [[1], [2, 3], []]}),
+        Path(tmp_path / "jagged.parquet"),
+    )
+    ak.to_parquet(ak.Array({"x": [4, 5]}), Path(tmp_path / "flat.parquet"))
+    merge.merge_parquet(
+        Path(tmp_path / "mixed.parquet"),
+        [Path(tmp_path / "jagged.parquet"), Path(tmp_path / "flat.parquet")],
+        row_group_bytes=16,
+    )
+    array = ak.from_parquet(Path(tmp_path / "mixed.parquet"))
+    assert array["x"].tolist() == [1, 2, 3, 4, 5]
+    assert array["q"].tolist() == [[1], [2, 3], [], None, None]
+
+    # a cut that passes nothing still gives an output with the schema
+    merge.merge_parquet(
+        Path(tmp_path / "empty.parquet"),
+        in_files,
+        row_group_bytes="8 kB",
+        cut="x < 0",
+    )
+    array = ak.from_parquet(Path(tmp_path / "empty.parquet"))
+    assert len(array) == 0
+    assert array.fields == ["x", "y"]
+
+
+def test_select_and_cut(tmp_path, monkeypatch):
+    in_files = []
+    for i in range(4):
+        ak.to_parquet(
+            ak.Array(
+                {
+                    "x": np.arange(i * 20, i * 20 + 20, dtype=np.int64),
+                    "y": [[float(j)] * (j % 3) for j in range(20)],
+                    "Jet_pt": np.arange(20, dtype=np.float64),
+                    "Jet_eta": np.zeros(20),
+                }
+            ),
+            Path(tmp_path / f"in{i}.parquet"),
+            row_group_size=5,
+        )
+        in_files.append(Path(tmp_path / f"in{i}.parquet"))
+
+    merge.merge_parquet(
+        Path(tmp_path / "kept.parquet"), in_files, keep_branches=["x", "Jet_*"]
+    )
+    array = ak.from_parquet(Path(tmp_path / "kept.parquet"))
+    assert array.fields == ["x", "Jet_pt", "Jet_eta"]
+    assert array["x"].tolist() == list(range(80))
+
+    read = []
+    original = _parquet_utils.read_row_group
+
+    def read_row_group(file, row_group, form=None, columns=None, **kwargs):
+        read.append(columns)
+        return original(file, row_group, form, columns, **kwargs)
+
+    monkeypatch.setattr(_parquet_utils, "read_row_group", read_row_group)
+    merge.merge_parquet(
+        Path(tmp_path / "cut.parquet"),
+        in_files,
+        drop_branches="Jet_*",
+        cut="(x >= 30) & (x < 45) & (np.abs(x) % 2 == 0)",
+    )
+    array = ak.from_parquet(Path(tmp_path / "cut.parquet"))
+    assert array.fields == ["x", "y"]
+    assert array["x"].tolist() == list(range(30, 45, 2))
+    # only the row groups holding 30 <= x < 45 are read, and never the dropped columns
+    assert len(read) == 3
+    assert all(columns == ["x", "y"] for columns in read)
+
+    # a cut on a dropped column reads it without writing it
+    merge.merge_parquet(
+        Path(tmp_path / "sorted.parquet"),
+        in_files,
+        keep_branches="x",
+        cut="Jet_pt > 17",
+        sort_by="x",
+    )
+    array = ak.from_parquet(Path(tmp_path / "sorted.parquet"))
+    assert array.fields == ["x"]
+    assert array["x"].tolist() == [18, 19, 38, 39, 58, 59, 78, 79]
+
+    # fields missing from some inputs, including lists, survive the cut
+    ak.to_parquet(
+        ak.Array({"x": [1, 2, 3], "q": [[1], [2, 3], []], "r": [{"l": [1]}] * 3}),
+        Path(tmp_path / "jagged.parquet"),
+    )
+    ak.to_parquet(ak.Array({"x": [4, 5]}), Path(tmp_path / "flat.parquet"))
+    mixed = [Path(tmp_path / "jagged.parquet"), Path(tmp_path / "flat.parquet")]
+    merge.merge_parquet(Path(tmp_path / "mixed.parquet"), mixed, cut="x > 1")
+    array = ak.from_parquet(Path(tmp_path / "mixed.parquet"))
+    assert array["q"].tolist() == [[2, 3], [], None, None]
+    merge.merge_parquet(
+        Path(tmp_path / "mixed.parquet"), mixed, cut="x == 4", force=True
+    )
+    array = ak.from_parquet(Path(tmp_path / "mixed.parquet"))
+    assert array.tolist() == [{"x": 4, "q": None, "r": None}]
+
+    assert _parquet_utils.cut_ranges("(1 <= x < 5) & (-2 > y) | (z == 1)") == []
+    assert _parquet_utils.cut_ranges("(1 <= x < 5) & (-2 > y)") == [
+        ("x", ">=", 1),
+        ("x", "<", 5),
+        ("y", "<", -2),
+    ]
+
+
+def test_metadata_only(tmp_path, monkeypatch):
+    ds = pytest.importorskip("pyarrow.dataset")
+    Path(tmp_path / "data" / "part").mkdir(parents=True)
+    in_files = []
+    for i in range(3):
+        in_files.append(Path(tmp_path / "data" / "part" / f"in{i}.parquet"))
+        ak.to_parquet(
+            ak.Array({"x": list(range(i * 10, i * 10 + 10)), "y": [[i]] * 10}),
+            in_files[-1],
+            row_group_size=4,
+        )
+    before = [file.read_bytes() for file in in_files]
+
+    # the footers are parsed from the scan, not read again
+    monkeypatch.setattr(_parquet_utils, "read_footer", None)
+    merge.merge_parquet(
+        Path(tmp_path / "data" / "_metadata"),
+        in_files,
+        metadata_only=True,
+        common_metadata=True,
+    )
+    assert [file.read_bytes() for file in in_files] == before
+    summary = pq.read_metadata(Path(tmp_path / "data" / "_metadata"))
+    assert summary.num_rows == 30
+    assert summary.num_row_groups == 9
+    assert summary.row_group(8).column(0).file_path == "part/in2.parquet"
+    assert pq.read_metadata(Path(tmp_path / "data" / "_common_metadata")).num_rows == 0
+
+    table = ds.parquet_dataset(str(tmp_path / "data" / "_metadata")).to_table()
+    assert table.column("x").to_pylist() == list(range(30))
+
+    ak.to_parquet(ak.Array({"x": [1.5]}), Path(tmp_path / "other.parquet"))
+    with pytest.raises(ValueError, match="same schema"):
+        merge.merge_parquet(
+            Path(tmp_path / "data" / "_metadata"),
+            [*in_files, Path(tmp_path / "other.parquet")],
+            metadata_only=True,
+            force=True,
+        )
+
+
+def test_compact_parquet(tmp_path):
+    Path(tmp_path / "run=2").mkdir()
+    expected = []
+    for i in range(6):
+        array = ak.Array({"x": list(range(i * 10, i * 10 + 10))})
+        ak.to_parquet(array, Path(tmp_path / f"small{i}.parquet"))
+        expected.extend(array["x"].tolist())
+    for i in range(2):
+        ak.to_parquet(
+            ak.Array({"x": [100 + i]}), Path(tmp_path / "run=2" / f"small{i}.parquet")
+        )
+    ak.to_parquet(
+        ak.Array({"x": np.arange(100_000)}),
+        Path(tmp_path / "large.parquet"),
+        compression="none",
+    )
+    large = Path(tmp_path / "large.parquet").read_bytes()
+    small = Path(tmp_path / "small0.parquet").stat().st_size
+
+    groups = _parquet_utils.plan_compaction(
+        {f"f{i}": size for i, size in enumerate([10, 10, 10, 40, 30, 100])}, 50, 100
+    )
+    assert groups == [["f0", "f3"], ["f1", "f2", "f4"]]
+
+    written = hepconvert.compact_parquet(
+        tmp_path,
+        target_size=3 * small + 100,
+        small_file_size=10 * small,
+        workers=2,
+    )
+    assert len(written) == 3
+    assert Path(tmp_path / "large.parquet").read_bytes() == large
+    top = sorted(Path(tmp_path).glob("*.parquet"))
+    assert len(top) == 3
+    assert (
+        sorted(
+            x
+            for file in top
+            if file.name != "large.parquet"
+            for x in ak.from_parquet(file)["x"].tolist()
+        )
+        == expected
+    )
+    (partition,) = Path(tmp_path / "run=2").glob("*.parquet")
+    assert sorted(ak.from_parquet(partition)["x"].tolist()) == [100, 101]
+
+
+def test_prefetch(tmp_path, monkeypatch):
+    fsspec = pytest.importorskip("fsspec")
+    memory = fsspec.filesystem("memory")
+    rng = np.random.default_rng(42)
+    in_files = []
+    for i in range(4):
+        in_files.append(f"memory://prefetch/in{i}.parquet")
+        ak.to_parquet(
+            ak.Array(
+                {
+                    "x": np.arange(i * 100, i * 100 + 100),
+                    "y": [[float(j)] * (j % 4) for j in range(100)],
+                    "z": ak.with_name(ak.zip({"a": np.arange(100)}), "Thing"),
+                    "w": rng.random((100, 100)),
+                }
+            ),
+            in_files[-1],
+            row_group_size=25,
+        )
+
+    merge.merge_parquet(
+        Path(tmp_path / "merged.parquet"),
+        in_files,
+        prefetch_workers=3,
+        prefetch_depth=4,
+        decode_workers=2,
+    )
+    array = ak.from_parquet(Path(tmp_path / "merged.parquet"))
+    assert array["x"].tolist() == list(range(400))
+    assert array["y"].tolist() == [[float(j)] * (j % 4) for j in range(100)] * 4
+    assert array.type.content == ak.from_parquet(in_files[0]).type.content
+
+    # everything that decoding needs comes from the prefetched byte ranges
+    ((file, meta),) = _parquet_utils.scan_footers(in_files[1:2])
+    parts = _parquet_utils.fetch_row_group(file, meta, 2, ["x"], max_gap=0)
+    # only the column chunk is fetched, since the scan holds the footer
+    ((_, start, stop),) = (r for r in meta["column_ranges"][2] if r[0] == "x")
+    assert list(parts) == [(start, stop)]
+
+    def cat_file(*args, **kwargs):
+        raise AssertionError
+
+    monkeypatch.setattr(type(memory), "cat_file", cat_file)
+    array = _parquet_utils.decode_row_group(
+        file, meta, 2, parts, _parquet_utils.project_form(meta["form"], ["x"]), ["x"]
+    )
+    assert array["x"].tolist() == list(range(150, 175))
+    memory.rm("/prefetch", recursive=True)
+
+
+def test_memory_map(tmp_path, monkeypatch):
+    in_files = []
+    for i in range(3):
+        in_files.append(Path(tmp_path / f"in{i}.parquet"))
+        ak.to_parquet(
+            ak.Array(
+                {
+                    "x": list(range(i * 10, i * 10 + 10)),
+                    "z": ak.with_name(ak.zip({"a": np.arange(10)}), "Thing"),
+                }
+            ),
+            in_files[-1],
+            row_group_size=4,
+        )
+    mapped = []
+    original_parquet_file = pq.ParquetFile
+
+    def parquet_file(source, *args, **kwargs):
+        if kwargs.get("metadata") is not None:
+            mapped.append(kwargs.get("memory_map", False))
+        return original_parquet_file(source, *args, **kwargs)
+
+    monkeypatch.setattr(pq, "ParquetFile", parquet_file)
+    merge.merge_parquet(Path(tmp_path / "merged.parquet"), in_files, memory_map=True)
+    array = ak.from_parquet(Path(tmp_path / "merged.parquet"))
+    assert array["x"].tolist() == list(range(30))
+    assert array.type.content == ak.from_parquet(in_files[0]).type.content
+    # local inputs are memory-mapped
+    assert mapped == [True] * 3
+
+    # other filesystems fall back to reading through fsspec
+    fs = fsspec.filesystem("memory")
+    remote = []
+    for i, file in enumerate(in_files):
+        fs.pipe(f"/memory_map/in{i}.parquet", file.read_bytes())
+        remote.append(f"memory://memory_map/in{i}.parquet")
+    mapped.clear()
+    try:
+        merge.merge_parquet(Path(tmp_path / "remote.parquet"), remote, memory_map=True)
+    finally:
+        fs.rm("/memory_map", recursive=True)
+    assert mapped == [False] * 3
+    assert ak.from_parquet(Path(tmp_path / "remote.parquet"))["x"].tolist() == list(
+        range(30)
+    )
+
+
+def test_dedup_by(tmp_path):
+    rng = np.random.default_rng(7)
+    in_files, seen, expected = [], set(), []
+    for i in range(5):
+        run = rng.integers(1, 3, 200)
+        event = rng.integers(0, 300, 200)
+        for key in zip(run.tolist(), event.tolist()):
+            if key not in seen:
+                seen.add(key)
+                expected.append(key)
+        ak.to_parquet(
+            ak.Array({"run": run, "event": event, "pt": rng.random(200)}),
+            Path(tmp_path / f"in{i}.parquet"),
+            row_group_size=50,
+        )
+        in_files.append(Path(tmp_path / f"in{i}.parquet"))
+
+    merge.merge_parquet(
+        Path(tmp_path / "merged.parquet"),
+        in_files,
+        dedup_by=["run", "event"],
+        dedup_memory="32 kB",
+        drop_branches=["run"],
+    )
+    array = ak.from_parquet(Path(tmp_path / "merged.parquet"))
+    assert array.fields == ["event", "pt"]
+    assert array["event"].tolist() == [event for _, event in expected]
+
+    with pytest.raises(MemoryError):
+        merge.merge_parquet(
+            Path(tmp_path / "merged.parquet"),
+            in_files,
+            dedup_by=["run", "event"],
+            dedup_memory=1024,
+            force=True,
+        )
+
+    # rows dropped by the cut take no slots in the table
+    merge.merge_parquet(
+        Path(tmp_path / "merged.parquet"),
+        in_files,
+        dedup_by=["run", "event"],
+        dedup_memory=1024,
+        cut="event < 20",
+        force=True,
+    )
+    array = ak.from_parquet(Path(tmp_path / "merged.parquet"))
+    assert list(zip(array["run"].tolist(), array["event"].tolist())) == [
+        key for key in expected if key[1] < 20
+    ]
+
+    # fields missing from some inputs, including lists, are kept
+    ak.to_parquet(
+        ak.Array({"x": [1, 2, 2], "q": [[1], [2, 3], []]}),
+        Path(tmp_path / "jagged.parquet"),
+    )
+    ak.to_parquet(ak.Array({"x": [2, 5]}), Path(tmp_path / "flat.parquet"))
+    merge.merge_parquet(
+        Path(tmp_path / "mixed.parquet"),
+        [Path(tmp_path / "jagged.parquet"), Path(tmp_path / "flat.parquet")],
+        dedup_by="x",
+    )
+    array = ak.from_parquet(Path(tmp_path / "mixed.parquet"))
+    assert array.tolist() == [
+        {"x": 1, "q": [1]},
+        {"x": 2, "q": [2, 3]},
+        {"x": 5, "q": None},
+    ]
+
+    table = np.zeros(8, dtype=np.uint64)
+    hashes = np.array([3, 11, 19, 5], dtype=np.uint64)
+    assert _parquet_utils._insert(table, hashes).tolist() == [True] * 4
+    assert _parquet_utils._insert(table, hashes[1:3]).tolist() == [False] * 2
+    assert sorted(table[table != 0].tolist()) == [3, 5, 11, 19]
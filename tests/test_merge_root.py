@@ -1,13 +1,17 @@
 from __future__ import annotations
 
+import json
+import os
 from pathlib import Path
 
 import awkward as ak
 import numpy as np
 import pytest
 import uproot
+from click.testing import CliRunner
 
-from hepconvert import merge
+from hepconvert import _root_utils, _utils, merge
+from hepconvert.__main__ import main
 
 skhep_testdata = pytest.importorskip("skhep_testdata")
 
@@ -193,3 +197,312 @@ def test_branchtypes(tmp_path):
         assert ak.all(
             new_file["tree1"]["y"].array() == [14, 15, 16, 71, 18, 14, 15, 16, 71, 18]
         )
+
+
+def _write_inputs(tmp_path, n_files=4, n_entries=1000, start=0, compression=None):
+    files = []
+    for i in range(start, start + n_files):
+        name = Path(tmp_path) / f"input{i}.root"
+        rng = np.random.default_rng(i)
+        counts = rng.integers(0, 4, n_entries)
+        jets = ak.zip(
+            {
+                "pt": ak.unflatten(rng.random(counts.sum()), counts),
+                "eta": ak.unflatten(rng.random(counts.sum()), counts),
+            }
+        )
+        with uproot.recreate(name, compression=compression or uproot.ZLIB(1)) as file:
+            file.mktree("events", {"Jet": jets.type, "x": "int64"})
+            file["events"].extend(
+                {"Jet": jets, "x": np.arange(n_entries) + i * n_entries}
+            )
+            file["hx"] = np.histogram(rng.normal(size=100), bins=10, range=(-3, 3))
+        files.append(name)
+    return files
+
+
+def test_prefetch(tmp_path):
+    files = _write_inputs(tmp_path)
+    merge.merge_root(tmp_path / "sequential.root", files, step_size=100)
+    merge.merge_root(
+        tmp_path / "prefetched.root",
+        files,
+        step_size=100,
+        prefetch_files=2,
+        prefetch_memory="10 kB",
+    )
+    sequential = uproot.open(tmp_path / "sequential.root")
+    prefetched = uproot.open(tmp_path / "prefetched.root")
+    assert prefetched["events"].keys() == sequential["events"].keys()
+    assert prefetched["events"]["x"].array().tolist() == list(range(4000))
+    assert ak.all(
+        prefetched["events"]["Jet_pt"].array() == sequential["events"]["Jet_pt"].array()
+    )
+    assert prefetched["hx"].values().tolist() == sequential["hx"].values().tolist()
+    expected = sum(uproot.open(file)["hx"].values() for file in files)
+    assert prefetched["hx"].values().tolist() == expected.tolist()
+
+    with pytest.raises(FileNotFoundError, match="does not exist or is corrupt"):
+        merge.merge_root(
+            tmp_path / "missing.root",
+            [*files, tmp_path / "nonexistent.root"],
+            prefetch_files=2,
+        )
+
+
+def test_fast_merge(tmp_path):
+    files = _write_inputs(tmp_path, n_files=3)
+    files += _write_inputs(tmp_path, n_files=1, start=3, compression=uproot.LZMA(1))
+
+    merge.merge_root(tmp_path / "slow.root", files)
+    merge.merge_root(
+        tmp_path / "fast.root",
+        files,
+        fast_merge=True,
+        initial_basket_capacity=2,
+        prefetch_files=1,
+    )
+    slow = uproot.open(tmp_path / "slow.root")
+    fast = uproot.open(tmp_path / "fast.root")
+    assert fast["events"].keys() == slow["events"].keys()
+    # three inputs copied one basket each, the LZMA one was recompressed
+    assert fast["events"]["x"].num_baskets == 4
+    assert fast["events"]["x"].array().tolist() == list(range(4000))
+    for key in slow["events"].keys():
+        assert ak.all(fast["events"][key].array() == slow["events"][key].array())
+    assert fast["hx"].values().tolist() == slow["hx"].values().tolist()
+
+
+def test_histogram_accumulators(tmp_path):
+    files = []
+    expected = 0
+    for i in range(3):
+        rng = np.random.default_rng(i)
+        h2 = np.histogram2d(
+            rng.normal(size=100), rng.normal(size=100), bins=(4, 3), range=[(-2, 2)] * 2
+        )
+        expected = expected + h2[0]
+        with uproot.recreate(tmp_path / f"hists{i}.root") as file:
+            file["h2"] = h2
+            file.mktree("events", {"x": "int64"})
+            file["events"].extend({"x": np.arange(10)})
+        files.append(tmp_path / f"hists{i}.root")
+
+    merge.merge_root(tmp_path / "merged.root", files)
+    with uproot.open(tmp_path / "merged.root") as file:
+        assert sorted(file.keys()) == ["events;1", "h2;1"]
+        assert file["h2"].values().tolist() == expected.tolist()
+        assert file["h2"].variances().tolist() == expected.tolist()
+        assert file["h2"].member("fEntries") == expected.sum()
+
+
+def test_max_output_entries(tmp_path):
+    files = _write_inputs(tmp_path, n_files=5)
+    for fast_merge in (False, True):
+        merge.merge_root(
+            tmp_path / "split.root",
+            files,
+            max_output_entries=2000,
+            fast_merge=fast_merge,
+            force=True,
+        )
+        outputs = ["split.root", "split_1.root", "split_2.root"]
+        assert sorted(path.name for path in tmp_path.glob("split*.root")) == outputs
+        for output, inputs in zip(outputs, [files[:2], files[2:4], files[4:]]):
+            with uproot.open(tmp_path / output) as file:
+                assert file["events"]["x"].array().tolist() == [
+                    x
+                    for path in inputs
+                    for x in uproot.open(path)["events"]["x"].array()
+                ]
+                expected = sum(uproot.open(path)["hx"].values() for path in inputs)
+                assert file["hx"].values().tolist() == expected.tolist()
+
+    (tmp_path / "split.root").unlink()
+    with pytest.raises(FileExistsError, match=r"split_1\.root"):
+        merge.merge_root(tmp_path / "split.root", files, max_output_bytes="1 kB")
+
+    # chunks still buffered count towards the size
+    merge.merge_root(
+        tmp_path / "buffered.root",
+        files,
+        max_output_bytes="50 kB",
+        basket_size="100 MB",
+    )
+    outputs = sorted(tmp_path.glob("buffered*.root"))
+    assert len(outputs) > 1
+    assert sum(uproot.open(path)["events"].num_entries for path in outputs) == 5000
+
+
+def test_workers(tmp_path):
+    files = _write_inputs(tmp_path, n_files=7, n_entries=200)
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+    merge.merge_root(
+        tmp_path / "parallel.root",
+        files,
+        workers=3,
+        fan_in=2,
+        scratch_dir=scratch,
+        cut="x % 2 == 0",
+        counter_name=merge.merge_root.__kwdefaults__["counter_name"],
+    )
+    assert list(scratch.iterdir()) == []
+    with uproot.open(tmp_path / "parallel.root") as file:
+        assert sorted(file["events"]["x"].array().tolist()) == list(range(0, 1400, 2))
+        assert file["events"].keys() == ["x", "nJet", "Jet_pt", "Jet_eta"]
+        expected = sum(uproot.open(path)["hx"].values() for path in files)
+        assert file["hx"].values().tolist() == expected.tolist()
+
+    # the command line leaves the defaults, which are not picklable, to merge_root
+    result = CliRunner().invoke(
+        main,
+        ["merge-root", "--workers", "2", str(tmp_path / "cli.root")]
+        + [str(path) for path in files],
+    )
+    assert result.exit_code == 0, result.output
+    with uproot.open(tmp_path / "cli.root") as file:
+        assert sorted(file["events"]["x"].array().tolist()) == list(range(1400))
+        assert file["events"].keys() == ["x", "nJet", "Jet_pt", "Jet_eta"]
+
+
+def test_memory_budget(tmp_path):
+    files = _write_inputs(tmp_path, n_files=2, n_entries=5000)
+    merge.merge_root(tmp_path / "budget.root", files, memory_budget="100 kB")
+    merge.merge_root(tmp_path / "unlimited.root", files)
+    budget = uproot.open(tmp_path / "budget.root")["events"]
+    unlimited = uproot.open(tmp_path / "unlimited.root")["events"]
+    assert budget["x"].array().tolist() == list(range(10000))
+    assert ak.all(budget["Jet_pt"].array() == unlimited["Jet_pt"].array())
+    assert budget["x"].num_baskets > unlimited["x"].num_baskets
+    steps = [
+        stop - start
+        for start, stop in map(
+            budget["x"].basket_entry_start_stop, range(budget["x"].num_baskets)
+        )
+    ]
+    assert max(steps) < 5000
+
+    # the number of entries per step scales with the budget
+    with uproot.open(files[0]) as file:
+        tree = file["events"]
+        lengths = {
+            budget: [
+                len(chunk["x"])
+                for chunk in _root_utils.iterate(
+                    tree, "100 MB", budget, filter_name=["x", "Jet_pt"], how=dict
+                )
+            ]
+            for budget in (30_000, 120_000)
+        }
+    small, large = (lengths[budget][1] for budget in (30_000, 120_000))
+    assert 3 < large / small < 5
+
+
+def test_basket_size(tmp_path):
+    files = _write_inputs(tmp_path, n_files=3, n_entries=2000)
+    merge.merge_root(
+        tmp_path / "unbuffered.root", files, step_size=100, cut="x % 10 == 0"
+    )
+    merge.merge_root(
+        tmp_path / "buffered.root",
+        files,
+        step_size=100,
+        cut="x % 10 == 0",
+        basket_size="1 MB",
+    )
+    unbuffered = uproot.open(tmp_path / "unbuffered.root")["events"]
+    buffered = uproot.open(tmp_path / "buffered.root")["events"]
+    assert buffered["x"].array().tolist() == list(range(0, 6000, 10))
+    assert ak.all(buffered["Jet_pt"].array() == unbuffered["Jet_pt"].array())
+    assert unbuffered["x"].num_baskets == 60
+    assert buffered["x"].num_baskets == 1
+    assert buffered["x"].member("fMaxBaskets") == 10
+
+    merge.merge_root(tmp_path / "capacity.root", files, step_size=100)
+    capacity = uproot.open(tmp_path / "capacity.root")["events"]
+    assert capacity["x"].num_baskets == 60
+    # reserved up front, not grown from 10 to 100 by resize_factor
+    assert 60 <= capacity["x"].member("fMaxBaskets") < 100
+
+
+def test_resume(tmp_path):
+    files = _write_inputs(tmp_path)
+    late = tmp_path / "late.root"
+    inputs = [files[0], files[1], late, files[2], files[3]]
+    with pytest.raises(FileNotFoundError, match=r"late\.root"):
+        merge.merge_root(tmp_path / "out.root", [files[0], late], journal=True)
+    journal = tmp_path / "out.root.journal"
+    state = tmp_path / "out.root.journal.state"
+    assert journal.read_text().splitlines() == [json.dumps(str(files[0]))]
+    assert json.loads(state.read_text())["entries"] == {"events": [0, 1000]}
+    # as if the first run had been stopped before the second input was committed
+    journal.write_text(journal.read_text() + json.dumps(str(files[1])) + "\n")
+
+    _write_inputs(tmp_path, n_files=1, start=4)[0].rename(late)
+    merge.merge_root(tmp_path / "out.root", inputs, step_size=300, resume=True)
+    merge.merge_root(tmp_path / "expected.root", inputs, step_size=300)
+    assert not journal.exists()
+    assert not state.exists()
+    assert not (tmp_path / "out.root.partial").exists()
+    out = uproot.open(tmp_path / "out.root")
+    expected = uproot.open(tmp_path / "expected.root")
+    assert out["events"]["x"].array().tolist() == [
+        *range(2000),
+        *range(4000, 5000),
+        *range(2000, 4000),
+    ]
+    assert ak.all(
+        out["events"]["Jet_pt"].array() == expected["events"]["Jet_pt"].array()
+    )
+    assert out["hx"].values().tolist() == expected["hx"].values().tolist()
+    assert out["hx"].member("fEntries") == expected["hx"].member("fEntries")
+
+    # without a journal, an existing output is not taken for an interrupted merge
+    with pytest.raises(FileExistsError, match="no journal"):
+        merge.merge_root(tmp_path / "out.root", files, resume=True)
+    # a journal without a committed input starts from the beginning
+    journal.write_text("")
+    merge.merge_root(tmp_path / "out.root", files, step_size=300, resume=True)
+    with uproot.open(tmp_path / "out.root") as file:
+        assert file["events"]["x"].array().tolist() == list(range(4000))
+
+
+def test_append_manifest(tmp_path, monkeypatch):
+    files = _write_inputs(tmp_path, n_files=3)
+    out = tmp_path / "out.root"
+    merge.merge_root(out, files[:2], step_size=300, manifest=True)
+    recorded = merge._read_manifest(out)
+    assert sorted(recorded) == sorted(str(file.resolve()) for file in files[:2])
+    assert recorded[str(files[1].resolve())]["entries"] == {"events": [1000, 2000]}
+
+    merge.merge_root(out, files, step_size=300, append=True)
+    with uproot.open(out) as file:
+        assert file["events"]["x"].array().tolist() == list(range(3000))
+        expected = sum(uproot.open(name)["hx"].values() for name in files)
+        assert file["hx"].values().tolist() == expected.tolist()
+        assert file.keys(cycle=False) == ["events", "hx", "hepconvert_manifest"]
+    assert len(merge._read_manifest(out)) == 3
+    assert not (tmp_path / "out.root.append").exists()
+
+    os.utime(files[0])
+    merge.merge_root(out, files, append=True)
+    assert uproot.open(out)["events"].num_entries == 3000
+    # the refreshed modification time is kept, so the input is not hashed again
+    recorded = merge._read_manifest(out)
+    assert recorded[str(files[0].resolve())]["mtime"] == files[0].stat().st_mtime_ns
+    assert uproot.open(out).keys(cycle=False).count("hepconvert_manifest") == 1
+    monkeypatch.setattr(_utils, "file_hash", None)
+    merge.merge_root(out, files, append=True)
+    monkeypatch.undo()
+
+    (tmp_path / "changed").mkdir()
+    rewritten = _write_inputs(tmp_path / "changed", n_files=1, n_entries=500, start=1)
+    rewritten[0].replace(files[1])
+    merge.merge_root(out, files, append=True)
+    with uproot.open(out) as file:
+        assert file["events"]["x"].array().tolist() == [
+            *range(1000),
+            *range(500, 1000),
+            *range(2000, 3000),
+        ]
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import awkward as ak
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+
+import hepconvert
+
+
+def _chunk_bytes(file, row_group, column):
+    meta = pq.ParquetFile(file).metadata.row_group(row_group).column(column)
+    start = meta.data_page_offset
+    if meta.has_dictionary_page and 0 < meta.dictionary_page_offset < start:
+        start = meta.dictionary_page_offset
+    with Path(file).open("rb") as f:
+        f.seek(start)
+        return f.read(meta.total_compressed_size)
+
+
+def test_transcode(tmp_path):
+    rng = np.random.default_rng(3)
+    array = ak.Array(
+        {
+            "x": np.arange(1000),
+            "y": [[float(j)] * (j % 4) for j in range(1000)],
+            "jet": ak.zip({"pt": rng.random(1000), "eta": rng.normal(size=1000)}),
+            "jets": [
+                [{"pt": float(j), "eta": -float(j)}] * (j % 3) for j in range(1000)
+            ],
+            "name": [str(j % 7) for j in range(1000)],
+        }
+    )
+    ak.to_parquet(
+        array,
+        Path(tmp_path / "in.parquet"),
+        compression="zstd",
+        row_group_size=300,
+        parquet_dictionary_encoding=True,
+    )
+
+    hepconvert.parquet_to_parquet(
+        Path(tmp_path / "out.parquet"),
+        Path(tmp_path / "in.parquet"),
+        compression={"x": "snappy", "jet.pt": "gzip", "jets.list.item.pt": "gzip"},
+        parquet_byte_stream_split={"jet.eta": True},
+        workers=4,
+    )
+    out = ak.from_parquet(Path(tmp_path / "out.parquet"))
+    assert out.tolist() == array.tolist()
+    assert out.type == ak.from_parquet(Path(tmp_path / "in.parquet")).type
+
+    metadata = pq.ParquetFile(Path(tmp_path / "out.parquet")).metadata
+    assert metadata.num_row_groups == 4
+    columns = [
+        metadata.row_group(0).column(j).path_in_schema
+        for j in range(metadata.num_columns)
+    ]
+    for i in range(metadata.num_row_groups):
+        for j, path in enumerate(columns):
+            column = metadata.row_group(i).column(j)
+            if path == "x":
+                assert column.compression == "SNAPPY"
+            elif path in ("jet.pt", "jets.list.item.pt"):
+                assert column.compression == "GZIP"
+            elif path == "jet.eta":
+                assert "BYTE_STREAM_SPLIT" in column.encodings
+            else:
+                # untouched columns are copied byte for byte
+                assert column.compression == "ZSTD"
+                assert _chunk_bytes(tmp_path / "out.parquet", i, j) == _chunk_bytes(
+                    tmp_path / "in.parquet", i, j
+                )
+
+    with pytest.raises(FileExistsError):
+        hepconvert.parquet_to_parquet(
+            Path(tmp_path / "out.parquet"), Path(tmp_path / "in.parquet")
+        )
+    hepconvert.parquet_to_parquet(
+        Path(tmp_path / "out.parquet"),
+        Path(tmp_path / "in.parquet"),
+        compression="lz4",
+        data_page_size=1024,
+        force=True,
+    )
+    # the levels of every re-encoded column match the schema
+    assert pq.read_table(Path(tmp_path / "out.parquet")).num_rows == 1000
+    assert ak.from_parquet(Path(tmp_path / "out.parquet")).tolist() == array.tolist()
+
+
+def test_storage_options(tmp_path, monkeypatch):
+    fsspec = pytest.importorskip("fsspec")
+    ak.to_parquet(
+        ak.Array({"x": np.arange(100), "y": np.ones(100)}),
+        Path(tmp_path / "in.parquet"),
+        row_group_size=30,
+    )
+    opened = []
+    original_open, original_url_to_fs = fsspec.open, fsspec.core.url_to_fs
+
+    def fsspec_open(file, *args, **kwargs):
+        opened.append((Path(file).name, kwargs.get("auto_mkdir")))
+        return original_open(file, *args, **kwargs)
+
+    def url_to_fs(file, **kwargs):
+        opened.append((Path(file).name, kwargs.get("auto_mkdir")))
+        return original_url_to_fs(file, **kwargs)
+
+    parsed = []
+    original_parquet_file = pq.ParquetFile
+
+    def parquet_file(source, *args, **kwargs):
+        parsed.append(kwargs.get("metadata") is None)
+        return original_parquet_file(source, *args, **kwargs)
+
+    monkeypatch.setattr(fsspec, "open", fsspec_open)
+    monkeypatch.setattr(fsspec.core, "url_to_fs", url_to_fs)
+    monkeypatch.setattr(pq, "ParquetFile", parquet_file)
+    hepconvert.parquet_to_parquet(
+        Path(tmp_path / "out.parquet"),
+        Path(tmp_path / "in.parquet"),
+        compression={"x": "gzip"},
+        storage_options={"auto_mkdir": True},
+    )
+    # the input's footer, copied and re-encoded column chunks all get the options
+    assert ("in.parquet", None) not in opened
+    assert opened.count(("in.parquet", True)) == 9
+    assert ("out.parquet", True) in opened
+    # the input footer is parsed once, not again for each re-encoded column chunk
+    assert parsed.count(False) == 4
+    assert ak.from_parquet(Path(tmp_path / "out.parquet"))["x"].tolist() == list(
+        range(100)
+    )
@@ -3,6 +3,8 @@ from __future__ import annotations
 from pathlib import Path
 
 import awkward as ak
+import fsspec
+import pyarrow.parquet as pq
 import pytest
 import uproot
 
@@ -100,3 +102,50 @@ def test_hzz(tmp_path):
         assert key in original["events"].keys()
     for key in test["events"].keys():
         assert ak.all(test["events"].arrays()[key] == original["events"].arrays()[key])
+
+
+def test_memory_map(tmp_path, monkeypatch):
+    array = ak.Array(
+        {
+            "x": list(range(30)),
+            "y": [[float(j)] * (j % 3) for j in range(30)],
+        }
+    )
+    ak.to_parquet(array, Path(tmp_path) / "in.parquet", row_group_size=7)
+    mapped = []
+    original_parquet_file = pq.ParquetFile
+
+    def parquet_file(source, *args, **kwargs):
+        if kwargs.get("metadata") is not None:
+            mapped.append(kwargs.get("memory_map", False))
+        return original_parquet_file(source, *args, **kwargs)
+
+    monkeypatch.setattr(pq, "ParquetFile", parquet_file)
+    parquet_to_root(
+        Path(tmp_path) / "out.root",
+        Path(tmp_path) / "in.parquet",
+        name="tree",
+        memory_map=True,
+    )
+    with uproot.open(Path(tmp_path) / "out.root") as file:
+        assert file["tree"]["x"].array().tolist() == array["x"].tolist()
+        assert file["tree"]["y"].array().tolist() == array["y"].tolist()
+    # the local input is memory-mapped, once for all of its row groups
+    assert mapped == [True]
+
+    # other filesystems fall back to reading through fsspec
+    fs = fsspec.filesystem("memory")
+    fs.pipe("/memory_map/in.parquet", (Path(tmp_path) / "in.parquet").read_bytes())
+    mapped.clear()
+    try:
+        parquet_to_root(
+            Path(tmp_path) / "remote.root",
+            "memory://memory_map/in.parquet",
+            name="tree",
+            memory_map=True,
+        )
+    finally:
+        fs.rm("/memory_map", recursive=True)
+    assert mapped == [False]
+    with uproot.open(Path(tmp_path) / "remote.root") as file:
+        assert file["tree"]["x"].array().tolist() == array["x"].tolist()
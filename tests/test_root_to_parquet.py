@@ -144,3 +144,19 @@ def keep_branches(tmp_path):
     assert (
         ak.metadata_from_parquet(Path(tmp_path) / "test.parquet")["num_row_groups"] == 3
     )
+
+
+def test_memory_budget(tmp_path):
+    with uproot.recreate(Path(tmp_path) / "in.root") as file:
+        file.mktree("events", {"x": "int64", "y": "float64"})
+        file["events"].extend({"x": range(10000), "y": [0.5] * 10000})
+    hepconvert.root_to_parquet(
+        in_file=Path(tmp_path) / "in.root",
+        out_file=Path(tmp_path) / "test.parquet",
+        memory_budget="100 kB",
+    )
+    from_parquet = ak.from_parquet(Path(tmp_path) / "test.parquet")
+    assert from_parquet.x.tolist() == list(range(10000))
+    assert (
+        ak.metadata_from_parquet(Path(tmp_path) / "test.parquet")["num_row_groups"] > 1
+    )